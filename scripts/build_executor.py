@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""Socket protocol for running OpenQuatt compiles on remote build workers.
+
+Every message is a frame: a 4-byte big-endian header length, a UTF-8 JSON
+header, and `payload_size` bytes of binary payload. A build conversation is:
+
+    client -> worker  build {token, workspace, config, build_path}
+    worker -> client  need_workspace              (only when the sha is unknown)
+    client -> worker  workspace {sha} + tar.gz of the workspace
+    worker -> client  result {exit_code} + length-prefixed log and a tar.gz of build outputs
+
+The worker keeps one persistent workspace, so PlatformIO and ESPHome build
+caches survive between targets and only changed files are rewritten.
+
+A build runs the client's own scripts, so a worker only accepts requests that
+carry its shared token, and only for config and build paths inside the
+workspace.
+"""
+
+from __future__ import annotations
+
+import hmac
+import io
+import json
+import re
+import select
+import socket
+import struct
+import tarfile
+import tempfile
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path, PurePosixPath
+from typing import Callable, Iterable
+
+PROTOCOL_VERSION = 2
+TOKEN_ENV = "OPENQUATT_WORKER_TOKEN"
+FRAME_HEADER = struct.Struct(">I")
+MAX_HEADER_BYTES = 1024 * 1024
+WORKSPACE_SHA_PATTERN = re.compile(r"[0-9a-f]{64}")
+RESULT_FILE_PATTERNS = (
+    "firmware.*",
+    "bootloader.bin",
+    "partitions.bin",
+    "ota_data_initial.bin",
+    "flasher_args.json",
+)
+
+
+class ProtocolError(RuntimeError):
+    pass
+
+
+def parse_address(value: str) -> tuple[str, int]:
+    host, separator, port = value.rpartition(":")
+    if not separator or not port.isdigit():
+        raise ProtocolError(f"Expected HOST:PORT, got {value!r}")
+    return host or "127.0.0.1", int(port)
+
+
+def workspace_relative(value: object, kind: str) -> PurePosixPath:
+    """Return `value` as a path inside the workspace, refusing absolute paths and `..`."""
+    path = PurePosixPath(str(value)) if isinstance(value, str) and value else None
+    if path is None or path.is_absolute() or ".." in path.parts or "\\" in str(value):
+        raise ProtocolError(f"Refusing {kind} {value!r}: it must be a relative path inside the workspace")
+    return path
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = sock.recv(min(remaining, 1024 * 1024))
+        if not chunk:
+            raise ProtocolError("Connection closed mid-frame")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def send_frame(sock: socket.socket, header: dict[str, object], payload: bytes = b"") -> None:
+    encoded = json.dumps({**header, "payload_size": len(payload)}, separators=(",", ":")).encode("utf-8")
+    sock.sendall(FRAME_HEADER.pack(len(encoded)) + encoded)
+    if payload:
+        sock.sendall(payload)
+
+
+def recv_frame(sock: socket.socket, max_payload: int | None = None) -> tuple[dict, bytes]:
+    """Read one frame; anything malformed, or a payload above `max_payload`, raises ProtocolError."""
+    (header_size,) = FRAME_HEADER.unpack(_recv_exact(sock, FRAME_HEADER.size))
+    if header_size > MAX_HEADER_BYTES:
+        raise ProtocolError(f"Frame header too large: {header_size} bytes")
+    try:
+        header = json.loads(_recv_exact(sock, header_size).decode("utf-8"))
+    except (UnicodeDecodeError, json.JSONDecodeError) as exc:
+        raise ProtocolError(f"Malformed frame header: {exc}") from exc
+    if not isinstance(header, dict):
+        raise ProtocolError("Frame header is not a JSON object")
+    payload_size = header.get("payload_size", 0)
+    if type(payload_size) is not int or payload_size < 0:
+        raise ProtocolError(f"Invalid payload_size {payload_size!r}")
+    if max_payload is not None and payload_size > max_payload:
+        raise ProtocolError(f"Frame payload too large: {payload_size} bytes")
+    return header, _recv_exact(sock, payload_size) if payload_size else b""
+
+
+def pack_files(files: Iterable[tuple[str, Path]]) -> bytes:
+    """Pack (archive name, path) pairs into a gzip-compressed tarball."""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz", compresslevel=6) as archive:
+        for name, path in files:
+            archive.add(path, arcname=name, recursive=False)
+    return buffer.getvalue()
+
+
+def unpack_files(payload: bytes, destination: Path) -> list[Path]:
+    """Unpack a tarball from `pack_files`, refusing links and paths outside `destination`.
+
+    A corrupt tarball raises ProtocolError.
+    """
+    destination.mkdir(parents=True, exist_ok=True)
+    written = []
+    try:
+        with tarfile.open(fileobj=io.BytesIO(payload), mode="r:gz") as archive:
+            for member in archive.getmembers():
+                name = PurePosixPath(member.name)
+                if name.is_absolute() or ".." in name.parts or not member.isfile():
+                    raise ProtocolError(f"Refusing archive member {member.name!r}")
+                target = destination.joinpath(*name.parts)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                source = archive.extractfile(member)
+                assert source is not None
+                with source, target.open("wb") as handle:
+                    while chunk := source.read(1024 * 1024):
+                        handle.write(chunk)
+                written.append(target)
+    except (tarfile.TarError, EOFError, zlib.error) as exc:
+        raise ProtocolError(f"Corrupt archive: {exc}") from exc
+    return written
+
+
+@dataclass
+class BuildResult:
+    exit_code: int
+    log: str
+    outputs: bytes
+
+
+class WorkerClient:
+    """One connection-per-build client for a single worker address."""
+
+    def __init__(self, address: str, token: str, timeout_s: float = 30.0) -> None:
+        self.address = address
+        self.host, self.port = parse_address(address)
+        self.token = token
+        self.timeout_s = timeout_s
+
+    def build(
+        self,
+        *,
+        workspace_sha: str,
+        workspace_payload: Callable[[], bytes],
+        config: str,
+        build_path: str,
+        cancel_event: threading.Event | None = None,
+        heartbeat: Callable[[float], None] | None = None,
+        heartbeat_interval_s: float = 20.0,
+    ) -> BuildResult:
+        with socket.create_connection((self.host, self.port), timeout=self.timeout_s) as sock:
+            send_frame(
+                sock,
+                {
+                    "type": "build",
+                    "version": PROTOCOL_VERSION,
+                    "token": self.token,
+                    "workspace": workspace_sha,
+                    "config": config,
+                    "build_path": build_path,
+                },
+            )
+            started_at = time.monotonic()
+            next_heartbeat_at = started_at + heartbeat_interval_s
+            while True:
+                ready, _, _ = select.select([sock], [], [], 1.0)
+                if cancel_event is not None and cancel_event.is_set():
+                    return BuildResult(exit_code=1, log="Cancelled.\n", outputs=b"")
+                if not ready:
+                    now = time.monotonic()
+                    if heartbeat is not None and now >= next_heartbeat_at:
+                        heartbeat(now - started_at)
+                        next_heartbeat_at = now + heartbeat_interval_s
+                    continue
+                header, payload = recv_frame(sock)
+                kind = header.get("type")
+                if kind == "need_workspace":
+                    send_frame(sock, {"type": "workspace", "sha": workspace_sha}, workspace_payload())
+                elif kind == "result":
+                    log = ""
+                    outputs = b""
+                    if payload:
+                        log, outputs = _split_result(payload)
+                    exit_code = header.get("exit_code", 1)
+                    if type(exit_code) is not int:
+                        raise ProtocolError(f"{self.address}: invalid exit_code {exit_code!r}")
+                    return BuildResult(exit_code=exit_code, log=log, outputs=outputs)
+                elif kind == "error":
+                    raise ProtocolError(f"{self.address}: {header.get('message', 'worker error')}")
+                else:
+                    raise ProtocolError(f"{self.address}: unexpected frame {kind!r}")
+
+
+def _split_result(payload: bytes) -> tuple[str, bytes]:
+    if len(payload) < FRAME_HEADER.size:
+        raise ProtocolError("Truncated result payload")
+    (log_size,) = FRAME_HEADER.unpack_from(payload, 0)
+    start = FRAME_HEADER.size
+    if start + log_size > len(payload):
+        raise ProtocolError("Result log runs past the end of the payload")
+    return payload[start:start + log_size].decode("utf-8", errors="replace"), payload[start + log_size:]
+
+
+def _join_result(log: bytes, outputs: bytes) -> bytes:
+    return FRAME_HEADER.pack(len(log)) + log + outputs
+
+
+def serve_worker(
+    listen: str,
+    work_dir: Path,
+    *,
+    token: str,
+    sync_workspace: Callable[[Path, Path], None],
+    run_build: Callable[[Path, str, Callable[[], bool]], tuple[int, Path]],
+    announce: Callable[[str], None] = print,
+) -> None:
+    """Serve builds one at a time until interrupted.
+
+    Every request must carry `token`. `sync_workspace(source, workspace)` mirrors an unpacked tarball into the
+    persistent workspace. `run_build(workspace, config, disconnected)` runs the
+    build, polling `disconnected()` to stop early, and returns the exit code
+    and log path.
+    """
+    if not token:
+        raise ProtocolError("A worker needs a shared token")
+    host, port = parse_address(listen)
+    workspace = work_dir / "workspace"
+    sha_path = work_dir / "workspace.sha"
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    with socket.create_server((host, port)) as server:
+        bound_host, bound_port = server.getsockname()[:2]
+        announce(f"Listening on {bound_host}:{bound_port}")
+        while True:
+            conn, peer = server.accept()
+            with conn:
+                try:
+                    _serve_build(conn, token, workspace, sha_path, sync_workspace, run_build, announce)
+                except (ProtocolError, OSError) as exc:
+                    announce(f"[FAIL] {peer[0]}:{peer[1]}: {exc}")
+
+
+def _serve_build(
+    conn: socket.socket,
+    token: str,
+    workspace: Path,
+    sha_path: Path,
+    sync_workspace: Callable[[Path, Path], None],
+    run_build: Callable[[Path, str, Callable[[], bool]], tuple[int, Path]],
+    announce: Callable[[str], None],
+) -> None:
+    # The request carries no payload; refuse one before reading it, ahead of the token check.
+    request, _ = recv_frame(conn, max_payload=0)
+    if request.get("type") != "build" or request.get("version") != PROTOCOL_VERSION:
+        send_frame(conn, {"type": "error", "message": f"Unsupported request {request.get('type')!r}"})
+        return
+    if not hmac.compare_digest(str(request.get("token", "")).encode("utf-8"), token.encode("utf-8")):
+        send_frame(conn, {"type": "error", "message": "Invalid worker token"})
+        raise ProtocolError("rejected a request with an invalid token")
+    try:
+        config = workspace_relative(request.get("config"), "config").as_posix()
+        build_path = workspace_relative(request.get("build_path"), "build_path")
+        workspace_sha = request.get("workspace")
+        if not isinstance(workspace_sha, str) or not WORKSPACE_SHA_PATTERN.fullmatch(workspace_sha):
+            raise ProtocolError(f"Refusing workspace {workspace_sha!r}: expected a SHA-256 hex digest")
+    except ProtocolError as exc:
+        send_frame(conn, {"type": "error", "message": str(exc)})
+        raise
+
+    current_sha = sha_path.read_text(encoding="utf-8").strip() if sha_path.is_file() else ""
+    if workspace_sha != current_sha:
+        send_frame(conn, {"type": "need_workspace"})
+        header, payload = recv_frame(conn)
+        if header.get("type") != "workspace" or header.get("sha") != workspace_sha:
+            raise ProtocolError("Expected the requested workspace tarball")
+        with tempfile.TemporaryDirectory(prefix="incoming-", dir=sha_path.parent) as incoming:
+            try:
+                unpack_files(payload, Path(incoming))
+            except ProtocolError as exc:
+                send_frame(conn, {"type": "error", "message": str(exc)})
+                raise
+            sync_workspace(Path(incoming), workspace)
+        sha_path.write_text(workspace_sha + "\n", encoding="utf-8")
+        announce(f"[ok] workspace {workspace_sha[:12]}")
+
+    def disconnected() -> bool:
+        ready, _, _ = select.select([conn], [], [], 0)
+        return bool(ready) and not conn.recv(1, socket.MSG_PEEK)
+
+    announce(f"[run] compile {config}")
+    exit_code, log_path = run_build(workspace, config, disconnected)
+    build_dir = workspace.joinpath(*build_path.parts) / ".pioenvs" / "openquatt"
+    outputs = sorted(
+        {path for pattern in RESULT_FILE_PATTERNS for path in build_dir.glob(pattern) if path.is_file()}
+    ) if exit_code == 0 else []
+    log = log_path.read_bytes() if log_path.is_file() else b""
+    payload = _join_result(log, pack_files((path.name, path) for path in outputs))
+    send_frame(conn, {"type": "result", "exit_code": exit_code}, payload)
+    announce(f"[{'ok' if exit_code == 0 else 'FAIL'}] compile {config}")
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""Resolve the input files that feed an OpenQuatt firmware config."""
+
+from __future__ import annotations
+
+import hashlib
+import re
+import subprocess
+from pathlib import Path
+from typing import Iterable
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+INLINE_INCLUDE_PATTERN = re.compile(r"!include\s+([^\s#{][^\s#]*)")
+BARE_INCLUDE_PATTERN = re.compile(r"!include\s*(?:#.*)?$")
+INCLUDE_FILE_PATTERN = re.compile(r"^\s*file:\s*([^\s#]+)")
+SUBSTITUTION_PATH_PATTERN = re.compile(r"\$\{(openquatt_root|components_root|scripts_root)\}(/[^\s\"'#,]*)?")
+
+# Matches the roots defined in openquatt/oq_substitutions_common.yaml.
+SUBSTITUTION_ROOTS = {
+    "openquatt_root": "openquatt",
+    "components_root": "components",
+    "scripts_root": "scripts",
+}
+
+# Inputs every target compiles, whether or not a YAML file names them directly.
+SHARED_INPUTS = (
+    "components",
+    "openquatt/includes",
+    "scripts/flash_image.py",
+    "scripts/repair_factory_bin.py",
+    "scripts/firmware_size.py",
+)
+
+# Changes here can alter every target, so they select the full matrix.
+GLOBAL_INPUTS = (
+    "build_targets.yaml",
+    ".github/requirements-esphome.txt",
+    ".github/workflows/esphome-build.yml",
+    "scripts/build_inputs.py",
+)
+
+IGNORED_NAMES = {"__pycache__", ".DS_Store"}
+IGNORED_SUFFIXES = (".pyc", ".pyo")
+
+
+def _strip_quotes(value: str) -> str:
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in ("'", '"'):
+        return value[1:-1]
+    return value
+
+
+def _relative(path: Path, root_dir: Path) -> Path | None:
+    try:
+        return path.resolve().relative_to(root_dir)
+    except ValueError:
+        return None
+
+
+def yaml_references(path: Path, root_dir: Path = REPO_ROOT) -> set[Path]:
+    """Return repo-relative paths referenced by one YAML file."""
+    references: set[Path] = set()
+    lines = path.read_text(encoding="utf-8").splitlines()
+
+    for index, line in enumerate(lines):
+        include_targets: list[str] = []
+        inline = INLINE_INCLUDE_PATTERN.search(line)
+        if inline:
+            include_targets.append(inline.group(1))
+        elif BARE_INCLUDE_PATTERN.search(line):
+            for follower in lines[index + 1:]:
+                if not follower.strip():
+                    continue
+                match = INCLUDE_FILE_PATTERN.match(follower)
+                if match:
+                    include_targets.append(match.group(1))
+                break
+
+        for raw_target in include_targets:
+            relative = _relative(path.parent / _strip_quotes(raw_target), root_dir)
+            if relative is not None:
+                references.add(relative)
+
+        for match in SUBSTITUTION_PATH_PATTERN.finditer(line):
+            suffix = (match.group(2) or "").strip("/")
+            references.add(Path(SUBSTITUTION_ROOTS[match.group(1)], suffix))
+
+    return references
+
+
+def include_closure(config: str | Path, root_dir: Path = REPO_ROOT) -> set[Path]:
+    """Follow `!include` and substitution-root references starting at a config."""
+    start = Path(config)
+    if start.is_absolute():
+        relative_start = _relative(start, root_dir)
+        if relative_start is None:
+            raise SystemExit(f"Config is outside the repository: {config}")
+        start = relative_start
+
+    closure: set[Path] = set()
+    pending = [start]
+    while pending:
+        current = pending.pop()
+        if current in closure:
+            continue
+        closure.add(current)
+        absolute = root_dir / current
+        if absolute.is_file() and absolute.suffix in (".yaml", ".yml"):
+            pending.extend(yaml_references(absolute, root_dir) - closure)
+    return closure
+
+
+def expand_files(paths: Iterable[Path], root_dir: Path = REPO_ROOT) -> list[Path]:
+    """Expand repo-relative files and directories into a sorted file list."""
+    files: set[Path] = set()
+    for relative in paths:
+        absolute = root_dir / relative
+        if absolute.is_dir():
+            for candidate in absolute.rglob("*"):
+                if not candidate.is_file():
+                    continue
+                if IGNORED_NAMES.intersection(candidate.relative_to(root_dir).parts):
+                    continue
+                if candidate.name.endswith(IGNORED_SUFFIXES):
+                    continue
+                files.add(candidate.relative_to(root_dir))
+        else:
+            files.add(relative)
+    return sorted(files)
+
+
+def target_input_files(config: str | Path, root_dir: Path = REPO_ROOT) -> list[Path]:
+    """Return every repo-relative file that can change the build of `config`."""
+    return expand_files(include_closure(config, root_dir) | {Path(item) for item in SHARED_INPUTS}, root_dir)
+
+
+def hash_files(files: Iterable[Path], root_dir: Path = REPO_ROOT, extra: Iterable[str] = ()) -> str:
+    """Hash file names and contents together with extra key material."""
+    digest = hashlib.sha256()
+    for item in extra:
+        digest.update(item.encode("utf-8"))
+        digest.update(b"\0")
+    for relative in files:
+        digest.update(relative.as_posix().encode("utf-8"))
+        digest.update(b"\0")
+        absolute = root_dir / relative
+        if not absolute.is_file():
+            digest.update(b"<missing>\0")
+            continue
+        with absolute.open("rb") as handle:
+            for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+                digest.update(chunk)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _git_lines(args: list[str], root_dir: Path) -> list[str]:
+    completed = subprocess.run(
+        ["git", *args],
+        cwd=root_dir,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if completed.returncode != 0:
+        detail = completed.stderr.strip() or completed.stdout.strip() or "git command failed"
+        raise SystemExit(f"git {' '.join(args)}: {detail}")
+    return [line.strip() for line in completed.stdout.splitlines() if line.strip()]
+
+
+def changed_files_since(ref: str, root_dir: Path = REPO_ROOT) -> set[Path]:
+    """Return files changed between the merge base with `ref` and the working tree."""
+    try:
+        base = _git_lines(["merge-base", ref, "HEAD"], root_dir)[0]
+    except (SystemExit, IndexError):
+        base = ref
+    changed = _git_lines(["diff", "--name-only", base, "--"], root_dir)
+    changed.extend(_git_lines(["ls-files", "--others", "--exclude-standard"], root_dir))
+    return {Path(item) for item in changed}
+
+
+def affected_configs(configs: Iterable[str], changed: set[Path], root_dir: Path = REPO_ROOT) -> list[str]:
+    """Keep the configs whose input closure contains at least one changed file."""
+    configs = list(configs)
+    if changed & {Path(item) for item in GLOBAL_INPUTS}:
+        return configs
+    return [config for config in configs if changed.intersection(target_input_files(config, root_dir))]
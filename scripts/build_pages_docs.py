@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 from html import escape
 from pathlib import Path, PurePosixPath
+import hashlib
 import json
 import unicodedata
 import posixpath
@@ -13,6 +14,8 @@ import sys
 
 REPO_ROOT = Path(__file__).resolve().parent.parent
 GITHUB_REPO_URL = "https://github.com/jeroen85/OpenQuatt"
+CACHE_PATH = REPO_ROOT / ".tmp" / "pages-docs-cache.json"
+CACHE_VERSION = 1
 
 
 @dataclass(frozen=True)
@@ -464,7 +467,7 @@ def build_toc(toc: list[tuple[int, str, str]]) -> str:
     """
 
 
-def render_template(rendered_page: RenderedPage, rendered_pages: list[RenderedPage]) -> str:
+def render_template(rendered_page: RenderedPage) -> str:
     page = rendered_page.page
     asset_prefix = "./" if page.output.parent == PurePosixPath(".") else "../"
     install_href = rel_url(page.output, PurePosixPath("install/index.html"))
@@ -547,19 +550,102 @@ def render_template(rendered_page: RenderedPage, rendered_pages: list[RenderedPa
 """
 
 
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def site_key() -> str:
+    """Hash what every page depends on: this script (renderer and template) and the page list and sidebar."""
+    layout = {
+        "pages": [{key: str(value) for key, value in asdict(page).items()} for page in PAGES],
+        "sidebar": [[label, description, [str(source) for source in sources]] for label, description, sources in SIDEBAR_GROUPS],
+    }
+    script = Path(__file__).resolve().read_bytes()
+    return _sha256(script + b"\0" + json.dumps(layout, sort_keys=True).encode("utf-8"))
+
+
+def load_cache(site_dir: Path) -> dict[str, dict]:
+    try:
+        data = json.loads(CACHE_PATH.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return {}
+    if data.get("version") != CACHE_VERSION:
+        return {}
+    return dict(data.get("sites", {}).get(str(site_dir), {}))
+
+
+def save_cache(site_dir: Path, entries: dict[str, dict]) -> None:
+    try:
+        data = json.loads(CACHE_PATH.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        data = {}
+    sites = data.get("sites", {}) if data.get("version") == CACHE_VERSION else {}
+    sites = {path: value for path, value in sites.items() if Path(path).is_dir()}
+    sites[str(site_dir)] = entries
+    CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = CACHE_PATH.with_suffix(".tmp")
+    temp_path.write_text(json.dumps({"version": CACHE_VERSION, "sites": sites}, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+    temp_path.replace(CACHE_PATH)
+
+
+def _output_stamp(path: Path) -> list[int] | None:
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def write_if_changed(path: Path, content: str) -> bool:
+    """Write `content` unless the file already holds it, so unchanged outputs keep their mtime."""
+    data = content.encode("utf-8")
+    try:
+        if path.read_bytes() == data:
+            return False
+    except OSError:
+        pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return True
+
+
 def build_site(site_dir: Path) -> None:
-    rendered_pages: list[RenderedPage] = []
+    """Render the docs pages, skipping pages whose source, template and page list are unchanged.
+
+    A page is skipped when its cache key matches and its output still has the size and mtime
+    recorded when it was written. Rendered pages are only written when the HTML differs, and
+    outputs of pages no longer listed are deleted.
+    """
+    layout_key = site_key()
+    cached = load_cache(site_dir)
+    entries: dict[str, dict] = {}
+    rendered_count = 0
+    written_count = 0
+
     for page in PAGES:
+        source_bytes = (REPO_ROOT / page.source).read_bytes()
+        key = _sha256(layout_key.encode("ascii") + b"\0" + source_bytes)
+        output_path = site_dir / page.output
+        entry = cached.get(str(page.output))
+        if entry and entry.get("key") == key and entry.get("stamp") == _output_stamp(output_path):
+            entries[str(page.output)] = entry
+            continue
+
         renderer = MarkdownRenderer(page.source, page.output)
-        text = (REPO_ROOT / page.source).read_text(encoding="utf-8")
-        lead, body = renderer.render(text)
-        rendered_pages.append(RenderedPage(page, lead, body, list(renderer.toc)))
-
-    for rendered_page in rendered_pages:
-        html = render_template(rendered_page, rendered_pages)
-        output_path = site_dir / rendered_page.page.output
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-        output_path.write_text(html, encoding="utf-8")
+        lead, body = renderer.render(source_bytes.decode("utf-8"))
+        html = render_template(RenderedPage(page, lead, body, list(renderer.toc)))
+        rendered_count += 1
+        if write_if_changed(output_path, html):
+            written_count += 1
+        entries[str(page.output)] = {"key": key, "stamp": _output_stamp(output_path)}
+
+    # Pages dropped from PAGES since the last build would otherwise linger in the site.
+    for output in cached.keys() - entries.keys():
+        (site_dir / output).unlink(missing_ok=True)
+
+    save_cache(site_dir, entries)
+    skipped_count = len(PAGES) - rendered_count
+    print(f"Docs pages: {rendered_count} rendered, {written_count} written, {skipped_count} unchanged")
 
 
 def main(argv: list[str]) -> int:
@@ -4,18 +4,66 @@
 from __future__ import annotations
 
 import argparse
+import concurrent.futures
+import contextlib
 import hashlib
+import itertools
 import json
+import os
 import shutil
 import sys
+import zlib
 from pathlib import Path
 from typing import Sequence
 
+from build_inputs import affected_configs, changed_files_since
+from ota_delta import apply_delta, make_delta
+
 
 REPO_ROOT = Path(__file__).resolve().parents[1]
 TARGETS_FILE = REPO_ROOT / "build_targets.yaml"
 
 
+TARGET_KEYS = (
+    "id",
+    "status",
+    "hardware",
+    "hardware_label",
+    "topology",
+    "connection",
+    "config",
+    "build_path",
+    "artifact_name",
+    "manifest_name",
+    "display_name",
+    "chip_family",
+)
+TARGET_ENUMS = {
+    "status": ("enabled", "planned"),
+    "hardware": ("waveshare", "heatpump_listener", "heatpump_controller_q"),
+    "topology": ("single", "duo"),
+    "connection": ("wifi", "eth"),
+    "chip_family": ("ESP32", "ESP32-S3"),
+}
+SIZE_BUDGET_KEYS = tuple(f"size_budget_{name}" for name in ("ota", "flash", "iram", "dram", "rtc", "psram"))
+UNIQUE_KEYS = ("id", "config", "build_path", "artifact_name", "manifest_name")
+# Only these keys may hold an inline list; an entry expands to their product.
+MATRIX_KEYS = ("hardware", "topology", "connection")
+VALUE_LABELS = {
+    "single": "Single",
+    "duo": "Duo",
+    "wifi": "Wi-Fi",
+    "eth": "Ethernet",
+}
+
+# Publish a delta only when it saves a meaningful share of the full OTA download.
+DELTA_MAX_RATIO = 0.6
+# Same for the gzip variant of the full OTA image.
+GZIP_MAX_RATIO = 0.9
+
+_TARGETS_CACHE: dict[Path, tuple[tuple[int, int], list[dict[str, str]]]] = {}
+
+
 def _parse_scalar(value: str) -> str:
     value = value.strip()
     if (value.startswith('"') and value.endswith('"')) or (value.startswith("'") and value.endswith("'")):
@@ -23,13 +71,19 @@ def _parse_scalar(value: str) -> str:
     return value
 
 
-def load_targets() -> list[dict[str, str]]:
-    """Parse the intentionally simple build_targets.yaml without extra deps."""
-    targets: list[dict[str, str]] = []
-    current: dict[str, str] | None = None
+def _parse_value(value: str) -> str | list[str]:
+    value = value.strip()
+    if value.startswith("[") and value.endswith("]"):
+        return [_parse_scalar(item) for item in value[1:-1].split(",") if item.strip()]
+    return _parse_scalar(value)
+
+
+def _read_entries(path: Path) -> list[tuple[int, dict[str, str | list[str]]]]:
+    entries: list[tuple[int, dict[str, str | list[str]]]] = []
+    current: dict[str, str | list[str]] | None = None
     in_targets = False
 
-    for line_number, raw_line in enumerate(TARGETS_FILE.read_text(encoding="utf-8").splitlines(), start=1):
+    for line_number, raw_line in enumerate(path.read_text(encoding="utf-8").splitlines(), start=1):
         line = raw_line.rstrip()
         stripped = line.strip()
         if not stripped or stripped.startswith("#"):
@@ -38,43 +92,202 @@ def load_targets() -> list[dict[str, str]]:
             in_targets = True
             continue
         if not in_targets:
-            raise SystemExit(f"{TARGETS_FILE}:{line_number}: expected 'targets:' before target entries")
+            raise SystemExit(f"{path}:{line_number}: expected 'targets:' before target entries")
         if line.startswith("  - "):
-            if current is not None:
-                targets.append(current)
             current = {}
+            entries.append((line_number, current))
             key_value = line[4:]
         elif line.startswith("    "):
             if current is None:
-                raise SystemExit(f"{TARGETS_FILE}:{line_number}: key outside target entry")
+                raise SystemExit(f"{path}:{line_number}: key outside target entry")
             key_value = line[4:]
         else:
-            raise SystemExit(f"{TARGETS_FILE}:{line_number}: unsupported matrix syntax: {raw_line}")
+            raise SystemExit(f"{path}:{line_number}: unsupported matrix syntax: {raw_line}")
 
         if ":" not in key_value:
-            raise SystemExit(f"{TARGETS_FILE}:{line_number}: expected key/value pair")
+            raise SystemExit(f"{path}:{line_number}: expected key/value pair")
         key, value = key_value.split(":", 1)
-        current[key.strip()] = _parse_scalar(value)
-
-    if current is not None:
-        targets.append(current)
+        key = key.strip()
+        if key in current:
+            raise SystemExit(f"{path}:{line_number}: duplicate key {key!r}")
+        current[key] = _parse_value(value)
+    return entries
+
+
+class _Placeholders(dict):
+    def __init__(self, location: str, values: dict[str, str]) -> None:
+        super().__init__(values)
+        self.location = location
+
+    def __missing__(self, key: str) -> str:
+        raise SystemExit(f"{self.location}: unknown placeholder {{{key}}}")
+
+
+def _expand_entry(location: str, entry: dict[str, str | list[str]]) -> list[dict[str, str]]:
+    """Expand inline lists into their product; the last list key varies fastest."""
+    list_keys = [key for key, value in entry.items() if isinstance(value, list)]
+    for key in list_keys:
+        if key not in MATRIX_KEYS:
+            raise SystemExit(f"{location}: only {', '.join(MATRIX_KEYS)} may be lists, not {key!r}")
+        if not entry[key]:
+            raise SystemExit(f"{location}: empty list for {key!r}")
+
+    expanded: list[dict[str, str]] = []
+    for combination in itertools.product(*(entry[key] for key in list_keys)):
+        target = {**entry, **dict(zip(list_keys, combination))}
+        values = {key: value for key, value in target.items() if key in MATRIX_KEYS}
+        values.update({f"{key}_label": VALUE_LABELS.get(value, value) for key, value in values.items()})
+        placeholders = _Placeholders(location, values)
+        if "id" in target:
+            target["id"] = target["id"].format_map(placeholders)
+            placeholders["id"] = target["id"]
+            placeholders["slug"] = target["id"].replace("_", "-")
+        expanded.append({key: value.format_map(placeholders) for key, value in target.items()})
+    return expanded
+
+
+def validate_target(location: str, target: dict[str, str]) -> None:
+    missing = [key for key in TARGET_KEYS if not target.get(key)]
+    if missing:
+        raise SystemExit(f"{location}: target {target.get('id', '?')} is missing {', '.join(missing)}")
+    unknown = sorted(set(target) - set(TARGET_KEYS) - set(SIZE_BUDGET_KEYS))
+    if unknown:
+        raise SystemExit(f"{location}: target {target['id']} has unknown key(s) {', '.join(unknown)}")
+    for key, allowed in TARGET_ENUMS.items():
+        if target[key] not in allowed:
+            raise SystemExit(
+                f"{location}: target {target['id']} has {key} {target[key]!r}; expected one of {', '.join(allowed)}"
+            )
+    for key in SIZE_BUDGET_KEYS:
+        if key in target:
+            try:
+                int(target[key], 0)
+            except ValueError:
+                raise SystemExit(f"{location}: target {target['id']} has a non-numeric {key}: {target[key]!r}") from None
+
+
+def parse_targets(path: Path) -> list[dict[str, str]]:
+    """Parse, expand and validate the intentionally simple build_targets.yaml without extra deps."""
+    targets: list[dict[str, str]] = []
+    seen: dict[tuple[str, str], str] = {}
+    for line_number, entry in _read_entries(path):
+        location = f"{path}:{line_number}"
+        for target in _expand_entry(location, entry):
+            validate_target(location, target)
+            for key in UNIQUE_KEYS:
+                previous = seen.setdefault((key, target[key]), target["id"])
+                if previous != target["id"]:
+                    raise SystemExit(f"{location}: target {target['id']} reuses {key} {target[key]!r} of {previous}")
+            targets.append({key: target[key] for key in (*TARGET_KEYS, *SIZE_BUDGET_KEYS) if key in target})
     if not targets:
-        raise SystemExit(f"No targets found in {TARGETS_FILE}")
+        raise SystemExit(f"No targets found in {path}")
     return targets
 
 
+def load_targets() -> list[dict[str, str]]:
+    """Return the build targets, re-parsing only when build_targets.yaml changed."""
+    stat = TARGETS_FILE.stat()
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _TARGETS_CACHE.get(TARGETS_FILE)
+    if cached is None or cached[0] != signature:
+        cached = (signature, parse_targets(TARGETS_FILE))
+        _TARGETS_CACHE[TARGETS_FILE] = cached
+    return [dict(target) for target in cached[1]]
+
+
 def filter_targets(targets: list[dict[str, str]], status: str) -> list[dict[str, str]]:
     if status == "all":
         return targets
     return [target for target in targets if target.get("status") == status]
 
 
-def md5sum(path: Path) -> str:
-    digest = hashlib.md5()
-    with path.open("rb") as handle:
-        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
-            digest.update(chunk)
-    return digest.hexdigest()
+def filter_affected_targets(targets: list[dict[str, str]], ref: str) -> list[dict[str, str]]:
+    if not ref:
+        return targets
+    changed = changed_files_since(ref, REPO_ROOT)
+    affected = set(affected_configs((target["config"] for target in targets), changed, REPO_ROOT))
+    return [target for target in targets if target["config"] in affected]
+
+
+def copy_with_digests(
+    source: Path,
+    dest: Path,
+    gzip_dest: Path | None = None,
+    keep: bytearray | None = None,
+) -> dict[str, str]:
+    """Copy `source` to `dest` like shutil.copy2, hashing each chunk on the way through.
+
+    With `gzip_dest`, the same pass also writes a gzip copy and adds its `gzip_md5`.
+    With `keep`, the copied bytes are appended to it for steps that need the whole image.
+    """
+    digests = {"md5": hashlib.md5(), "sha256": hashlib.sha256()}
+    # wbits 31 selects the gzip container; zlib leaves its mtime at 0, so the output is reproducible.
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31) if gzip_dest is not None else None
+    gzip_digest = hashlib.md5()
+    with contextlib.ExitStack() as stack:
+        reader = stack.enter_context(source.open("rb"))
+        writer = stack.enter_context(dest.open("wb"))
+        gzip_writer = stack.enter_context(gzip_dest.open("wb")) if gzip_dest is not None else None
+
+        def write_gzip(data: bytes) -> None:
+            gzip_writer.write(data)
+            gzip_digest.update(data)
+
+        for chunk in iter(lambda: reader.read(1024 * 1024), b""):
+            writer.write(chunk)
+            if keep is not None:
+                keep.extend(chunk)
+            for digest in digests.values():
+                digest.update(chunk)
+            if compressor is not None:
+                write_gzip(compressor.compress(chunk))
+        if compressor is not None:
+            write_gzip(compressor.flush())
+    shutil.copystat(source, dest)
+    result = {name: digest.hexdigest() for name, digest in digests.items()}
+    if gzip_dest is not None:
+        result["gzip_md5"] = gzip_digest.hexdigest()
+    return result
+
+
+def map_targets(function, targets: list[dict[str, str]]) -> list:
+    """Run `function` per target in a thread pool; hashing and file I/O release the GIL."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(targets), os.cpu_count() or 1) or 1) as executor:
+        return list(executor.map(function, targets))
+
+
+def prepare_ota_delta(
+    base_path: Path,
+    ota_path: Path,
+    target: bytes,
+    target_md5: str,
+    base_url: str,
+) -> dict[str, object] | None:
+    """Write `ota_path` as a delta against `base_path`, the previous release's image of the same name.
+
+    `target` and `target_md5` come from the copy that wrote `ota_path`, so the new image is not read twice.
+    """
+    ota_name = ota_path.name
+    base = base_path.read_bytes()
+    if base == target:
+        return None
+    base_md5 = hashlib.md5(base).hexdigest()
+    delta = make_delta(base, target, base_md5=base_md5, target_md5=target_md5)
+    if len(delta) > len(target) * DELTA_MAX_RATIO:
+        print(f"[skip] {ota_name}: delta is {len(delta)} of {len(target)} bytes")
+        return None
+    if apply_delta(base, delta) != target:
+        raise SystemExit(f"Delta for {ota_name} does not reproduce the OTA image")
+
+    delta_name = ota_name.removesuffix(".bin") + ".delta.bin"
+    (ota_path.parent / delta_name).write_bytes(delta)
+    print(f"[ok] {delta_name}: {len(delta)} of {len(target)} bytes ({len(delta) / len(target):.0%})")
+    return {
+        "path": f"{base_url}/{delta_name}",
+        "md5": hashlib.md5(delta).hexdigest(),
+        "size": len(delta),
+        "base_md5": base_md5,
+    }
 
 
 def find_artifact_dir(dist_dir: Path, artifact_name: str) -> Path:
@@ -91,11 +304,17 @@ def find_artifact_dir(dist_dir: Path, artifact_name: str) -> Path:
     raise SystemExit(f"Ambiguous artifact directories for {artifact_name}: {names}")
 
 
-def prepare_release_assets(version: str, base_url: str, release_url: str) -> None:
+def prepare_release_assets(
+    version: str,
+    base_url: str,
+    release_url: str,
+    previous_dir: Path | None = None,
+    gzip_ota: bool = False,
+) -> None:
     dist_dir = REPO_ROOT / "dist"
     dist_dir.mkdir(parents=True, exist_ok=True)
 
-    for target in filter_targets(load_targets(), "enabled"):
+    def prepare(target: dict[str, str]) -> None:
         artifact_name = target["artifact_name"]
         artifact_dir = find_artifact_dir(dist_dir, artifact_name)
 
@@ -106,10 +325,32 @@ def prepare_release_assets(version: str, base_url: str, release_url: str) -> Non
 
         ota_name = f"{artifact_name}.firmware.ota.bin"
         factory_name = f"{artifact_name}.firmware.factory.bin"
-        ota_dest = dist_dir / ota_name
-        factory_dest = dist_dir / factory_name
-        shutil.copy2(ota_source, ota_dest)
-        shutil.copy2(factory_source, factory_dest)
+        gzip_name = f"{ota_name}.gz"
+        gzip_path = dist_dir / gzip_name if gzip_ota else None
+        base_path = previous_dir / ota_name if previous_dir is not None else None
+        has_base = base_path is not None and base_path.is_file()
+        ota_data = bytearray() if has_base else None
+        ota_digests = copy_with_digests(ota_source, dist_dir / ota_name, gzip_path, ota_data)
+        shutil.copy2(factory_source, dist_dir / factory_name)
+        delta = None
+        if has_base:
+            delta = prepare_ota_delta(base_path, dist_dir / ota_name, bytes(ota_data), ota_digests["md5"], base_url)
+
+        ota_size = (dist_dir / ota_name).stat().st_size
+        compressed = None
+        if gzip_path is not None:
+            gzip_size = gzip_path.stat().st_size
+            if gzip_size <= ota_size * GZIP_MAX_RATIO:
+                compressed = {
+                    "path": f"{base_url}/{gzip_name}",
+                    "format": "gzip",
+                    "md5": ota_digests["gzip_md5"],
+                    "size": gzip_size,
+                    "uncompressed_md5": ota_digests["md5"],
+                    "uncompressed_size": ota_size,
+                }
+            else:
+                gzip_path.unlink()
 
         manifest = {
             "name": target["display_name"],
@@ -119,24 +360,30 @@ def prepare_release_assets(version: str, base_url: str, release_url: str) -> Non
                     "chipFamily": target["chip_family"],
                     "ota": {
                         "path": f"{base_url}/{ota_name}",
-                        "md5": md5sum(ota_dest),
+                        "md5": ota_digests["md5"],
+                        "sha256": ota_digests["sha256"],
                         "release_url": release_url,
                         "summary": f"{target['display_name']} firmware {version}",
                     },
                 }
             ],
         }
+        if compressed is not None:
+            manifest["builds"][0]["ota"]["compressed"] = compressed
+        if delta is not None:
+            manifest["builds"][0]["ota"]["delta"] = delta
         manifest_path = REPO_ROOT / target["manifest_name"]
         manifest_path.write_text(json.dumps(manifest, indent=2) + "\n", encoding="utf-8")
 
+    map_targets(prepare, filter_targets(load_targets(), "enabled"))
+
 
 def prepare_pr_test_assets(pr_number: str, version: str, head_sha: str, base_url: str, release_url: str) -> None:
     dist_dir = REPO_ROOT / "dist"
     dist_dir.mkdir(parents=True, exist_ok=True)
     short_sha = head_sha[:7] if head_sha else ""
-    assets: list[dict[str, str]] = []
 
-    for target in filter_targets(load_targets(), "enabled"):
+    def prepare(target: dict[str, str]) -> dict[str, str]:
         artifact_name = target["artifact_name"]
         artifact_dir = find_artifact_dir(dist_dir, artifact_name)
         ota_source = artifact_dir / "firmware.ota.bin"
@@ -144,26 +391,23 @@ def prepare_pr_test_assets(pr_number: str, version: str, head_sha: str, base_url
             raise SystemExit(f"Artifact {artifact_name} is missing firmware.ota.bin")
 
         ota_name = f"{artifact_name}.firmware.ota.bin"
-        ota_dest = dist_dir / ota_name
-        shutil.copy2(ota_source, ota_dest)
-        digest = md5sum(ota_dest)
+        digests = copy_with_digests(ota_source, dist_dir / ota_name)
         md5_name = f"{ota_name}.md5"
-        (dist_dir / md5_name).write_text(f"{digest}\n", encoding="utf-8")
-
-        assets.append(
-            {
-                "target": target["id"],
-                "hardware": target["hardware"],
-                "topology": target["topology"],
-                "connection": target["connection"],
-                "display_name": target["display_name"],
-                "ota_file": ota_name,
-                "ota_url": f"{base_url}/{ota_name}",
-                "md5_file": md5_name,
-                "md5_url": f"{base_url}/{md5_name}",
-                "md5": digest,
-            }
-        )
+        (dist_dir / md5_name).write_text(f"{digests['md5']}\n", encoding="utf-8")
+
+        return {
+            "target": target["id"],
+            "hardware": target["hardware"],
+            "topology": target["topology"],
+            "connection": target["connection"],
+            "display_name": target["display_name"],
+            "ota_file": ota_name,
+            "ota_url": f"{base_url}/{ota_name}",
+            "md5_file": md5_name,
+            "md5_url": f"{base_url}/{md5_name}",
+            "md5": digests["md5"],
+            "sha256": digests["sha256"],
+        }
 
     catalog = {
         "pr": str(pr_number),
@@ -171,13 +415,13 @@ def prepare_pr_test_assets(pr_number: str, version: str, head_sha: str, base_url
         "head_sha": head_sha,
         "short_sha": short_sha,
         "release_url": release_url,
-        "assets": assets,
+        "assets": map_targets(prepare, filter_targets(load_targets(), "enabled")),
     }
     (dist_dir / "pr-firmware.json").write_text(json.dumps(catalog, indent=2) + "\n", encoding="utf-8")
 
 
 def command_list_configs(args: argparse.Namespace) -> int:
-    for target in filter_targets(load_targets(), args.status):
+    for target in filter_affected_targets(filter_targets(load_targets(), args.status), args.affected_since):
         print(target["config"])
     return 0
 
@@ -189,13 +433,14 @@ def command_factory_files(args: argparse.Namespace) -> int:
 
 
 def command_github_matrix(args: argparse.Namespace) -> int:
-    targets = filter_targets(load_targets(), args.status)
+    targets = filter_affected_targets(filter_targets(load_targets(), args.status), args.affected_since)
     print(json.dumps({"target": targets}, separators=(",", ":")))
     return 0
 
 
 def command_prepare_release_assets(args: argparse.Namespace) -> int:
-    prepare_release_assets(args.version, args.base_url, args.release_url)
+    previous_dir = Path(args.previous_dir) if args.previous_dir else None
+    prepare_release_assets(args.version, args.base_url, args.release_url, previous_dir, args.gzip_ota)
     return 0
 
 
@@ -216,8 +461,17 @@ def create_parser() -> argparse.ArgumentParser:
             help="Target status filter.",
         )
 
+    def add_affected_argument(subparser: argparse.ArgumentParser) -> None:
+        subparser.add_argument(
+            "--affected-since",
+            default="",
+            metavar="REF",
+            help="Only include targets whose inputs changed since the merge base with REF.",
+        )
+
     list_configs_parser = subparsers.add_parser("list-configs", help="Print target config paths.")
     add_status_argument(list_configs_parser)
+    add_affected_argument(list_configs_parser)
     list_configs_parser.set_defaults(func=command_list_configs)
 
     factory_files_parser = subparsers.add_parser("factory-files", help="Print expected factory asset filenames.")
@@ -226,12 +480,23 @@ def create_parser() -> argparse.ArgumentParser:
 
     github_matrix_parser = subparsers.add_parser("github-matrix", help="Print a GitHub Actions matrix JSON.")
     add_status_argument(github_matrix_parser)
+    add_affected_argument(github_matrix_parser)
     github_matrix_parser.set_defaults(func=command_github_matrix)
 
     prepare_parser = subparsers.add_parser("prepare-release-assets", help="Prepare release assets and OTA manifests.")
     prepare_parser.add_argument("version")
     prepare_parser.add_argument("base_url")
     prepare_parser.add_argument("release_url")
+    prepare_parser.add_argument(
+        "--previous-dir",
+        default="",
+        help="Directory with the previous release's *.firmware.ota.bin files; adds a delta per target.",
+    )
+    prepare_parser.add_argument(
+        "--gzip-ota",
+        action="store_true",
+        help="Also publish a gzip copy of each OTA image and list it in the manifest.",
+    )
     prepare_parser.set_defaults(func=command_prepare_release_assets)
 
     pr_prepare_parser = subparsers.add_parser("prepare-pr-test-assets", help="Prepare PR test OTA assets.")
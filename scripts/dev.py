@@ -3,19 +3,42 @@ from __future__ import annotations
 
 import argparse
 import concurrent.futures
+import contextlib
 import fnmatch
+import hashlib
 import json
 import os
+import queue
 import re
+import secrets
+import select
 import shutil
+import statistics
+import struct
 import subprocess
 import sys
 import tempfile
+import threading
 import time
-from pathlib import Path
-from typing import Iterable, Sequence
-
+from dataclasses import dataclass, field
+from pathlib import Path, PurePosixPath
+from typing import Callable, Iterable, Iterator, Sequence
+
+from build_executor import (
+    TOKEN_ENV as WORKER_TOKEN_ENV,
+    BuildResult,
+    ProtocolError,
+    WorkerClient,
+    pack_files,
+    serve_worker,
+    unpack_files,
+)
+from build_pages_docs import PAGES as DOCS_PAGES
+from build_inputs import affected_configs, changed_files_since, hash_files, target_input_files
 from build_targets import filter_targets, load_targets
+from check_style_consistency import TEXT_PATTERNS as STYLE_CHECK_PATTERNS
+from firmware_size import FirmwareSizeError, check_budgets, describe, format_bytes, measure_build, target_budgets
+from repair_factory_bin import repair_result
 
 STAGE_EXCLUDE_DIRS = {
     ".git",
@@ -28,6 +51,13 @@ STAGE_EXCLUDE_DIRS = {
 }
 
 STAGE_EXCLUDE_FILES = ("*.pyc", "*.pyo")
+STAGE_HARDLINK_MIN_BYTES = 1024 * 1024
+DEFAULT_STAGE_DIR = ".cache/stage/workspace"
+
+PAGES_SKIPPED_DOCS = {"onderhoudsgids.md", "releaseproces.md"}
+# Written into the site after prepare-pages-site, by preview-pages and the Pages workflow.
+PAGES_EXTERNAL_FILES = {"firmware/main/version.json"}
+PAGES_PREVIEW_DIR = ".tmp/pages-preview"
 
 EFUSE_DUPLICATE_SOURCE = '"src/esp_efuse_fields.c"'
 EFUSE_DUPLICATE_UTILITY_SOURCE = '"src/esp_efuse_utility.c"'
@@ -46,6 +76,34 @@ PHY_LIB_PRINTF_SOURCE = '"src/lib_printf.c"'
 PHY_LIB_PRINTF_RENAMED = '"src/phy_lib_printf.c"'
 HAL_TARGET_EFUSE_SOURCE = '"${target}/efuse_hal.c"'
 HAL_TARGET_EFUSE_RENAMED = '"${target}/efuse_hal_${target}.c"'
+VALIDATE_CACHE_VERSION = 1
+TIMINGS_HISTORY_LIMIT = 50
+SIZE_HISTORY_LIMIT = 50
+# Relative compile cost without history: Duo adds the second heat pump
+# packages and Ethernet adds the W5500 stack on top of the Wi-Fi build.
+STATIC_COMPILE_WEIGHTS = {"duo": 1.3, "eth": 1.15}
+# Files whose edits make `watch` re-run each consistency check. Globs use the
+# `Path.glob` syntax of the checks themselves, so `**/` may match no directory.
+WATCH_CHECK_PATTERNS = {
+    "style consistency": STYLE_CHECK_PATTERNS,
+    "docs consistency": ("README.md", "docs/*", "openquatt/*.yaml", "scripts/check_docs_consistency.py"),
+}
+COMPILE_OBJECT_PATTERN = re.compile(r"^Compiling (\S+\.o)\s*$")
+COMPILE_ARCHIVE_PATTERN = re.compile(r"^(?:Archiving|Indexing) (\S+)")
+# Leading text of ESPHome/PlatformIO output lines that start a new compile stage.
+COMPILE_STAGE_PREFIXES = (
+    ("Linking ", "link"),
+    ("RAM:", "size"),
+    ("Flash:", "size"),
+    ("Building ", "image"),
+    ("esptool", "image"),
+)
+COMPILE_IDLE_WARNING_S = 60.0
+# `--jobs auto` sizing. Each ESPHome compile already runs SCons with one job
+# per core, so extra targets mostly fill the serial setup and link phases.
+AUTO_JOBS_CORES_PER_JOB = 4
+AUTO_JOBS_DEFAULT_PEAK_RSS = 1536 * 1024 * 1024
+AUTO_JOBS_MEMORY_RESERVE = 1024 * 1024 * 1024
 
 
 def repo_root() -> Path:
@@ -68,6 +126,10 @@ def build_path_by_config() -> dict[str, str]:
     return {target["config"]: target["build_path"] for target in load_targets()}
 
 
+def target_build_dir(command_root: Path, target_build_paths: dict[str, str], config: str) -> Path:
+    return command_root / target_build_paths.get(config, f".esphome/build/{Path(config).stem}") / ".pioenvs" / "openquatt"
+
+
 def config_log_stem(config: str) -> str:
     path = Path(config)
     return "_".join((*path.parent.parts, path.stem)) if path.parent.parts else path.stem
@@ -112,6 +174,59 @@ def resolve_helper_python(venv_dir: Path) -> list[str]:
     return [sys.executable]
 
 
+def validation_cache_path(root_dir: Path) -> Path:
+    return root_dir / ".cache" / "validate" / "validate-cache.json"
+
+
+def load_validation_cache(path: Path) -> dict[str, dict[str, str]]:
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return {}
+    if not isinstance(data, dict) or data.get("version") != VALIDATE_CACHE_VERSION:
+        return {}
+    entries = data.get("entries", {})
+    return entries if isinstance(entries, dict) else {}
+
+
+def save_validation_cache(path: Path, entries: dict[str, dict[str, str]]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_suffix(".tmp")
+    temp_path.write_text(
+        json.dumps({"version": VALIDATE_CACHE_VERSION, "entries": entries}, indent=2, sort_keys=True) + "\n",
+        encoding="utf-8",
+    )
+    os.replace(temp_path, path)
+
+
+def validation_input_keys(root_dir: Path, configs: Sequence[str], esphome_version: str) -> dict[str, str]:
+    targets = {target["config"]: target for target in load_targets()}
+    return {
+        config: hash_files(
+            target_input_files(config, root_dir),
+            root_dir,
+            extra=(
+                f"cache-v{VALIDATE_CACHE_VERSION}",
+                esphome_version,
+                *sorted(f"{key}={value}" for key, value in targets.get(config, {}).items() if key.startswith("size_budget_")),
+            ),
+        )
+        for config in configs
+    }
+
+
+def resolve_esphome_version(esphome_command: Sequence[str], *, cwd: Path, env: dict[str, str]) -> str:
+    completed = subprocess.run(
+        [*esphome_command, "version"],
+        cwd=cwd,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    return completed.stdout.strip() or "unknown"
+
+
 def resolve_esphome_command(venv_dir: Path) -> list[str]:
     candidate = _existing_path(
         (
@@ -433,6 +548,232 @@ def has_framework_espidf_source_workaround(pio_core_dir: Path, duplicate_object:
     return False
 
 
+@dataclass(frozen=True)
+class FailureSignature:
+    """A known transient compile failure and how to clear it before retrying."""
+
+    name: str
+    description: str
+    # Every pattern must match somewhere in the log.
+    patterns: tuple[re.Pattern[str], ...]
+    actions: tuple[str, ...]
+    retries: int = 1
+    # Must match on the line of the first pattern's match or the line after it; its named
+    # groups are passed to the actions, so they describe that failure and not an unrelated line.
+    detail_pattern: re.Pattern[str] | None = None
+
+
+FAILURE_SIGNATURES = (
+    FailureSignature(
+        name="espidf-duplicate-source",
+        description="framework-espidf duplicate-target failure",
+        patterns=(re.compile(r"Multiple ways to build the same target were specified for:"),),
+        actions=("patch_espidf", "clear_build_path"),
+        detail_pattern=re.compile(
+            r"(?P<object>esp_efuse_fields\.c\.o|efuse_hal\.c\.o|system_time\.c\.o|lib_printf\.c\.o)"
+        ),
+    ),
+    FailureSignature(
+        name="espressif-cache-race",
+        description="generated ESP-IDF component cache race",
+        patterns=(
+            re.compile(r"\.esphome[\\/]\.espressif[\\/]service_"),
+            re.compile(r"ArduinoJson|idf_component_manager"),
+        ),
+        actions=("clear_espressif_cache",),
+    ),
+)
+
+
+def classify_compile_failure(
+    log_path: Path,
+    signatures: Sequence[FailureSignature] = FAILURE_SIGNATURES,
+) -> tuple[FailureSignature, dict[str, str]] | None:
+    matched = {signature.name: [False] * len(signature.patterns) for signature in signatures}
+    captures: dict[str, dict[str, str] | None] = {
+        signature.name: None if signature.detail_pattern is not None else {} for signature in signatures
+    }
+    if not log_path.is_file():
+        return None
+    # Signatures whose first pattern matched on the previous line and still need their detail.
+    awaiting_detail: list[FailureSignature] = []
+    with log_path.open("r", encoding="utf-8", errors="replace") as handle:
+        for line in handle:
+            for signature in awaiting_detail:
+                match = signature.detail_pattern.search(line) if signature.detail_pattern else None
+                if match and captures[signature.name] is None:
+                    captures[signature.name] = match.groupdict()
+            awaiting_detail = []
+            for signature in signatures:
+                flags = matched[signature.name]
+                for index, pattern in enumerate(signature.patterns):
+                    if not pattern.search(line):
+                        continue
+                    flags[index] = True
+                    if index == 0 and signature.detail_pattern is not None and captures[signature.name] is None:
+                        detail = signature.detail_pattern.search(line)
+                        if detail:
+                            captures[signature.name] = detail.groupdict()
+                        else:
+                            awaiting_detail.append(signature)
+    for signature in signatures:
+        signature_captures = captures[signature.name]
+        if all(matched[signature.name]) and signature_captures is not None:
+            return signature, signature_captures
+    return None
+
+
+def remediate_compile_failure(
+    context: BuildContext,
+    config: str,
+    signature: FailureSignature,
+    captures: dict[str, str],
+) -> bool:
+    for action in signature.actions:
+        if action == "patch_espidf":
+            patched = apply_framework_espidf_source_workarounds(context.pio_core_dir)
+            if not patched and not has_framework_espidf_source_workaround(context.pio_core_dir, captures.get("object", "")):
+                return False
+        elif action == "clear_build_path":
+            shutil.rmtree(
+                target_build_dir(context.command_root, context.target_build_paths, config).parents[1],
+                ignore_errors=True,
+            )
+        elif action == "clear_espressif_cache":
+            shutil.rmtree(context.command_root / ".esphome" / ".espressif", ignore_errors=True)
+        else:
+            raise SystemExit(f"Unknown remediation action in failure signature {signature.name}: {action}")
+    return True
+
+
+FAILURE_SIGNATURES_LOCK = threading.Lock()
+
+
+def failure_signatures_path(root_dir: Path) -> Path:
+    return root_dir / ".cache" / "validate" / "failure-signatures.json"
+
+
+def record_failure_signature(
+    root_dir: Path,
+    signature: FailureSignature,
+    config: str,
+    *,
+    exhausted: bool,
+    counted: bool = False,
+) -> int:
+    """Count one failure of `signature`; `counted` only marks an already counted failure as exhausted."""
+    path = failure_signatures_path(root_dir)
+    with FAILURE_SIGNATURES_LOCK:
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            data = {}
+        entry = data.setdefault(signature.name, {"count": 0, "exhausted": 0, "configs": {}})
+        if not counted:
+            entry["count"] += 1
+            entry["configs"][config] = entry["configs"].get(config, 0) + 1
+        if exhausted:
+            entry["exhausted"] += 1
+        entry["last_seen"] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix(".tmp")
+        temp_path.write_text(json.dumps(data, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        os.replace(temp_path, path)
+        return entry["count"]
+
+
+def available_memory_bytes() -> int | None:
+    meminfo = Path("/proc/meminfo")
+    if meminfo.is_file():
+        for line in meminfo.read_text(encoding="utf-8").splitlines():
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def process_tree_rss(pid: int) -> int:
+    proc_dir = Path("/proc")
+    if not proc_dir.is_dir():
+        return 0
+
+    children: dict[int, list[int]] = {}
+    for entry in proc_dir.iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text(encoding="utf-8", errors="replace")
+            # The parent pid is the second field after the parenthesised command name.
+            parent = int(stat.rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry.name))
+
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            total += int((proc_dir / str(current) / "statm").read_text(encoding="utf-8").split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            pass
+        pending.extend(children.get(current, ()))
+    return total
+
+
+@dataclass
+class ProcessUsage:
+    peak_rss_bytes: int = 0
+
+    def sample(self, pid: int) -> None:
+        self.peak_rss_bytes = max(self.peak_rss_bytes, process_tree_rss(pid))
+
+
+class MemoryGate:
+    """Hold back new compiles while free memory cannot fit another one."""
+
+    def __init__(self, required_bytes: int, cancel_event: threading.Event, poll_interval_s: float = 5.0) -> None:
+        self.required_bytes = required_bytes
+        self.cancel_event = cancel_event
+        self.poll_interval_s = poll_interval_s
+        self.running = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, label: str) -> None:
+        waited = False
+        with self._condition:
+            while self.running and not self.cancel_event.is_set():
+                available = available_memory_bytes()
+                if available is None or available - AUTO_JOBS_MEMORY_RESERVE >= self.required_bytes:
+                    break
+                if not waited:
+                    print(
+                        f"[wait] {label}: {format_bytes(available)} available, "
+                        f"holding back until {format_bytes(self.required_bytes)} is free",
+                        flush=True,
+                    )
+                    waited = True
+                self._condition.wait(timeout=self.poll_interval_s)
+            self.running += 1
+
+    def release(self) -> None:
+        with self._condition:
+            self.running -= 1
+            self._condition.notify_all()
+
+
+def terminate_process(process: subprocess.Popen, timeout_s: float = 10.0) -> int:
+    process.terminate()
+    try:
+        return process.wait(timeout=timeout_s)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        return process.wait()
+
+
 def run_command(
     command: Sequence[str],
     *,
@@ -442,6 +783,9 @@ def run_command(
     check: bool = True,
     heartbeat_label: str | None = None,
     heartbeat_interval_s: float = 20.0,
+    cancel_event: threading.Event | None = None,
+    usage: ProcessUsage | None = None,
+    output_handler: Callable[[str], None] | None = None,
 ) -> int:
     if log_path is None:
         completed = subprocess.run(command, cwd=cwd, env=env, check=False)
@@ -450,27 +794,67 @@ def run_command(
         return completed.returncode
 
     log_path.parent.mkdir(parents=True, exist_ok=True)
-    with log_path.open("w", encoding="utf-8", errors="replace") as handle:
+    handle = log_path.open("w", encoding="utf-8", errors="replace")
+    reader: threading.Thread | None = None
+    try:
         started_at = time.monotonic()
         next_heartbeat_at = started_at + heartbeat_interval_s
-        process = subprocess.Popen(
-            command,
-            cwd=cwd,
-            env=env,
-            stdout=handle,
-            stderr=subprocess.STDOUT,
-            text=True,
-        )
+        if output_handler is None:
+            process = subprocess.Popen(
+                command,
+                cwd=cwd,
+                env=env,
+                stdout=handle,
+                stderr=subprocess.STDOUT,
+                text=True,
+            )
+        else:
+            process = subprocess.Popen(
+                command,
+                cwd=cwd,
+                env={**(os.environ if env is None else env), "PYTHONUNBUFFERED": "1"},
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                encoding="utf-8",
+                errors="replace",
+            )
+
+            # The reader owns the log handle from here on and closes it at end of output.
+            def pump_output() -> None:
+                assert process.stdout is not None
+                try:
+                    for line in process.stdout:
+                        handle.write(line)
+                        output_handler(line)
+                finally:
+                    handle.close()
+
+            reader = threading.Thread(target=pump_output, daemon=True)
+            reader.start()
         while True:
-            exit_code = process.poll()
-            if exit_code is not None:
+            try:
+                exit_code = process.wait(timeout=1.0)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            if usage is not None:
+                usage.sample(process.pid)
+            if cancel_event is not None and cancel_event.is_set():
+                exit_code = terminate_process(process)
                 break
             if heartbeat_label is not None:
                 now = time.monotonic()
                 if now >= next_heartbeat_at:
                     print(f"[wait] {heartbeat_label} ({format_duration(now - started_at)})", flush=True)
                     next_heartbeat_at = now + heartbeat_interval_s
-            time.sleep(1.0)
+    finally:
+        if reader is None:
+            handle.close()
+    if reader is not None:
+        # Grandchildren that outlive a terminated compile can hold the pipe open;
+        # the reader then finishes the log on its own once they exit.
+        reader.join(timeout=10.0)
 
     if check and exit_code != 0:
         raise subprocess.CalledProcessError(exit_code, command)
@@ -478,31 +862,51 @@ def run_command(
     return exit_code
 
 
-def run_logged(
-    command: Sequence[str],
+def start_background_checks(
+    executor: concurrent.futures.Executor,
+    checks: Sequence[tuple[str, list[str], Path]],
     *,
     cwd: Path,
-    env: dict[str, str] | None,
-    log_path: Path,
-    label: str,
-) -> None:
-    print(f"[run] {label}", flush=True)
-    exit_code = run_command(
-        command,
-        cwd=cwd,
-        env=env,
-        log_path=log_path,
-        check=False,
-        heartbeat_label=label,
-    )
-    if exit_code != 0:
+    env: dict[str, str],
+    cancel_event: threading.Event,
+    timings: BuildTimings | None = None,
+    stop_on_failure: bool = True,
+) -> list[concurrent.futures.Future]:
+    def run_check(label: str, command: list[str], log_path: Path) -> tuple[str, bool, Path]:
+        print(f"[run] {label}", flush=True)
+        started_at = time.monotonic()
+        exit_code = run_command(
+            command,
+            cwd=cwd,
+            env=env,
+            log_path=log_path,
+            check=False,
+            cancel_event=cancel_event,
+        )
+        if timings is not None:
+            timings.record("check", label, time.monotonic() - started_at, exit_code=exit_code)
+        if exit_code == 0:
+            print(f"[ok] {label}", flush=True)
+            return label, False, log_path
+        if cancel_event.is_set():
+            return label, False, log_path
+
+        if stop_on_failure:
+            cancel_event.set()
         print(f"[FAIL] {label}", file=sys.stderr)
         tail = tail_lines(log_path)
         if tail:
             print(tail, file=sys.stderr, end="" if tail.endswith("\n") else "\n")
-        raise SystemExit(f"{label} failed. Full log: {log_path}")
+        return label, True, log_path
+
+    return [executor.submit(run_check, label, command, log_path) for label, command, log_path in checks]
 
-    print(f"[ok] {label}")
+
+def finish_background_checks(futures: Sequence[concurrent.futures.Future]) -> None:
+    for future in futures:
+        label, failed, log_path = future.result()
+        if failed:
+            raise SystemExit(f"{label} failed. Full log: {log_path}")
 
 
 def stage_ignore(directory: str, entries: list[str]) -> set[str]:
@@ -548,18 +952,99 @@ def sync_staged_workspace(source_dir: Path, stage_dir: Path) -> None:
             raise SystemExit(f"workspace sync failed. Full log: {log_path}")
         return
 
-    if stage_dir.exists():
-        shutil.rmtree(stage_dir)
-    stage_dir.parent.mkdir(parents=True, exist_ok=True)
-    shutil.copytree(source_dir, stage_dir, ignore=stage_ignore)
+    copied, linked, removed, unchanged = mirror_workspace(source_dir, stage_dir)
+    print(f"Workspace mirror: {copied} copied, {linked} linked, {removed} removed, {unchanged} unchanged")
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def walk_stage_files(root_dir: Path) -> Iterator[Path]:
+    for directory, dir_names, file_names in os.walk(root_dir):
+        ignored = stage_ignore(directory, [*dir_names, *file_names])
+        dir_names[:] = sorted(name for name in dir_names if name not in ignored)
+        for name in sorted(file_names):
+            if name not in ignored:
+                yield (Path(directory) / name).relative_to(root_dir)
+
+
+def mirror_workspace(source_dir: Path, stage_dir: Path) -> tuple[int, int, int, int]:
+    manifest_path = stage_dir.parent / f"{stage_dir.name}.manifest.json"
+    try:
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8")) if stage_dir.is_dir() else {}
+    except (OSError, json.JSONDecodeError):
+        manifest = {}
+
+    stage_dir.mkdir(parents=True, exist_ok=True)
+    updated: dict[str, dict[str, object]] = {}
+    copied = linked = unchanged = 0
+    for relative in walk_stage_files(source_dir):
+        key = relative.as_posix()
+        source = source_dir / relative
+        dest = stage_dir / relative
+        stat = source.stat()
+        previous = manifest.get(key, {})
+        dest_present = dest.is_file() and dest.stat().st_size == stat.st_size
+        if dest_present and previous.get("size") == stat.st_size and previous.get("mtime_ns") == stat.st_mtime_ns:
+            updated[key] = previous
+            unchanged += 1
+            continue
+
+        digest = file_sha256(source)
+        updated[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+        if dest_present and previous.get("sha256") == digest:
+            unchanged += 1
+            continue
+
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        # Never write through an existing file: it may be a hardlink back to the source.
+        if dest.exists() or dest.is_symlink():
+            dest.unlink()
+        if stat.st_size >= STAGE_HARDLINK_MIN_BYTES:
+            try:
+                os.link(source, dest)
+                linked += 1
+                continue
+            except OSError:
+                pass
+        shutil.copy2(source, dest)
+        copied += 1
+
+    removed = 0
+    for relative in walk_stage_files(stage_dir):
+        if relative.as_posix() not in updated:
+            (stage_dir / relative).unlink()
+            removed += 1
+    for directory, _, _ in os.walk(stage_dir, topdown=False):
+        current = Path(directory)
+        relative = current.relative_to(stage_dir)
+        if current == stage_dir or STAGE_EXCLUDE_DIRS.intersection(relative.parts):
+            continue
+        if not (source_dir / relative).is_dir() and not any(current.iterdir()):
+            current.rmdir()
 
+    manifest_path.write_text(json.dumps(updated, separators=(",", ":")), encoding="utf-8")
+    return copied, linked, removed, unchanged
 
-def resolve_command_root(root_dir: Path) -> tuple[Path, Path, Path | None]:
+
+def resolve_command_root(root_dir: Path, stage_dir: Path | None = None) -> tuple[Path, Path, Path | None]:
     command_root = root_dir
     pio_core_dir = root_dir / ".cache" / "platformio"
     cleanup_dir: Path | None = None
 
-    if is_windows() and " " in str(root_dir):
+    if stage_dir is not None:
+        # A persistent stage: the incremental mirror only copies what changed since the last run,
+        # and ESPHome build directories inside the stage survive between runs.
+        command_root = stage_dir
+        print(f"Staging workspace in {command_root}")
+        sync_staged_workspace(root_dir, command_root)
+        print("[ok] workspace sync")
+    elif is_windows() and " " in str(root_dir):
         local_app_data = Path(os.environ.get("LOCALAPPDATA", tempfile.gettempdir()))
         stage_base_dir = local_app_data / "OpenQuattBuild"
         sessions_dir = stage_base_dir / "sessions"
@@ -576,52 +1061,103 @@ def resolve_command_root(root_dir: Path) -> tuple[Path, Path, Path | None]:
     return command_root, pio_core_dir, cleanup_dir
 
 
+def sync_site_file(source: Path, dest: Path) -> None:
+    """Copy like shutil.copy2, leaving `dest` untouched when its size and mtime already match."""
+    source_stat = source.stat()
+    try:
+        dest_stat = dest.stat()
+    except OSError:
+        dest_stat = None
+    if dest_stat is not None and (dest_stat.st_size, dest_stat.st_mtime_ns) == (
+        source_stat.st_size,
+        source_stat.st_mtime_ns,
+    ):
+        return
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copy2(source, dest)
+
+
+def write_site_text(path: Path, content: str) -> None:
+    try:
+        if path.read_text(encoding="utf-8") == content:
+            return
+    except (OSError, UnicodeDecodeError):
+        pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content, encoding="utf-8")
+
+
+def prune_site(site_dir: Path, expected: set[str]) -> int:
+    """Delete files under `site_dir` that the current build did not produce, then empty directories."""
+    removed = 0
+    for directory, _, file_names in os.walk(site_dir, topdown=False):
+        current = Path(directory)
+        for file_name in file_names:
+            path = current / file_name
+            if path.relative_to(site_dir).as_posix() not in expected:
+                path.unlink()
+                removed += 1
+        if current != site_dir and not any(current.iterdir()):
+            current.rmdir()
+    return removed
+
+
 def build_pages_site(site_dir: Path, factory_dir: Path, helper_python: Sequence[str]) -> None:
+    """Assemble the Pages site in place.
+
+    Unchanged files keep their mtime, so build_pages_docs.py can skip pages it rendered before;
+    files the current tree no longer produces are removed at the end.
+    """
     root_dir = repo_root()
     available_factory_files = ensure_factory_dir(factory_dir)
+    site_dir.mkdir(parents=True, exist_ok=True)
+    expected = set(PAGES_EXTERNAL_FILES) | {str(page.output) for page in DOCS_PAGES}
 
-    if site_dir.exists():
-        shutil.rmtree(site_dir)
+    def sync(source: Path, relative: str) -> None:
+        sync_site_file(source, site_dir / relative)
+        expected.add(relative)
 
-    (site_dir / "firmware" / "main").mkdir(parents=True, exist_ok=True)
-    (site_dir / "css").mkdir(parents=True, exist_ok=True)
-    (site_dir / "js").mkdir(parents=True, exist_ok=True)
-    shutil.copytree(root_dir / "docs", site_dir, dirs_exist_ok=True)
+    def write(relative: str, content: str) -> None:
+        write_site_text(site_dir / relative, content)
+        expected.add(relative)
 
-    for stale_file in ("onderhoudsgids.md", "releaseproces.md"):
-        stale_path = site_dir / stale_file
-        if stale_path.exists():
-            stale_path.unlink()
+    docs_dir = root_dir / "docs"
+    for source in sorted(docs_dir.rglob("*")):
+        relative = source.relative_to(docs_dir).as_posix()
+        if source.is_file() and relative not in PAGES_SKIPPED_DOCS:
+            sync(source, relative)
 
     run_command(
         [*helper_python, str(root_dir / "scripts" / "build_pages_docs.py"), str(site_dir)],
         cwd=root_dir,
     )
 
-    shutil.copy2(root_dir / "openquatt" / "web" / "css" / "openquatt-app.css", site_dir / "css" / "openquatt-app.css")
-    shutil.copy2(root_dir / "openquatt" / "web" / "js" / "mock-device.js", site_dir / "js" / "mock-device.js")
-    shutil.copy2(root_dir / "openquatt" / "web" / "js" / "openquatt-app.js", site_dir / "js" / "openquatt-app.js")
+    web_dir = root_dir / "openquatt" / "web"
+    sync(web_dir / "css" / "openquatt-app.css", "css/openquatt-app.css")
+    sync(web_dir / "js" / "mock-device.js", "js/mock-device.js")
+    sync(web_dir / "js" / "openquatt-app.js", "js/openquatt-app.js")
 
-    demo_html = (root_dir / "openquatt" / "web" / "dev.html").read_text(encoding="utf-8")
+    demo_html = (web_dir / "dev.html").read_text(encoding="utf-8")
     demo_html = demo_html.replace("<title>OpenQuatt UI Preview</title>", "<title>OpenQuatt web-app demo</title>")
     demo_html = demo_html.replace(
         '<meta name="viewport" content="width=device-width, initial-scale=1">',
         '<meta name="viewport" content="width=device-width, initial-scale=1">\n    <base href="../">',
     )
-    demo_dir = site_dir / "demo"
-    demo_dir.mkdir(parents=True, exist_ok=True)
-    (demo_dir / "index.html").write_text(demo_html, encoding="utf-8")
-
-    (site_dir / ".nojekyll").touch()
+    write("demo/index.html", demo_html)
+    write(".nojekyll", "")
 
     for file_name in available_factory_files:
-        shutil.copy2(factory_dir / file_name, site_dir / "firmware" / "main" / file_name)
+        sync(factory_dir / file_name, f"firmware/main/{file_name}")
 
-    (site_dir / "firmware" / "main" / "factory_files.json").write_text(
+    write(
+        "firmware/main/factory_files.json",
         json.dumps({"factory_files": available_factory_files}, indent=2) + "\n",
-        encoding="utf-8",
     )
 
+    removed = prune_site(site_dir, expected)
+    if removed:
+        print(f"Pages site: removed {removed} stale file(s)")
+
 
 def describe_version(root_dir: Path) -> str:
     result = subprocess.run(
@@ -634,17 +1170,40 @@ def describe_version(root_dir: Path) -> str:
     return label or "local-preview"
 
 
-def default_jobs() -> int:
-    raw_jobs = os.environ.get("JOBS", "2")
+def parse_jobs(raw_jobs: str) -> int | str:
+    if raw_jobs.strip().lower() == "auto":
+        return "auto"
     try:
         value = int(raw_jobs)
     except ValueError as exc:
-        raise SystemExit("JOBS must be a positive integer.") from exc
+        raise argparse.ArgumentTypeError("must be a positive integer or 'auto'") from exc
     if value < 1:
-        raise SystemExit("JOBS must be a positive integer.")
+        raise argparse.ArgumentTypeError("must be a positive integer or 'auto'")
     return value
 
 
+def default_jobs() -> int | str:
+    try:
+        return parse_jobs(os.environ.get("JOBS", "2"))
+    except argparse.ArgumentTypeError as exc:
+        raise SystemExit("JOBS must be a positive integer or 'auto'.") from exc
+
+
+def auto_jobs(root_dir: Path) -> tuple[int, str]:
+    cpu_count = os.cpu_count() or 1
+    jobs = max(1, cpu_count // AUTO_JOBS_CORES_PER_JOB)
+    reason = f"{cpu_count} CPU(s)"
+    if is_windows():
+        return 1, "native Windows"
+
+    available = available_memory_bytes()
+    if available is not None:
+        peak_rss = expected_compile_peak_rss(root_dir) or AUTO_JOBS_DEFAULT_PEAK_RSS
+        jobs = max(1, min(jobs, (available - AUTO_JOBS_MEMORY_RESERVE) // peak_rss))
+        reason += f", {format_bytes(available)} available, ~{format_bytes(peak_rss)} per compile"
+    return jobs, reason
+
+
 def ensure_supported_parallelism(args: argparse.Namespace) -> None:
     if is_windows() and args.jobs > 1:
         raise SystemExit(
@@ -683,171 +1242,1082 @@ def bootstrap_command(args: argparse.Namespace) -> int:
     return 0
 
 
-def validate_command(args: argparse.Namespace) -> int:
-    ensure_supported_parallelism(args)
+class BuildTimings:
+    def __init__(self) -> None:
+        self.started_at = time.time()
+        self.compile_cache = ""
+        self.compiler_cache: dict[str, int] | None = None
+        self.entries: list[dict[str, object]] = []
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        stage: str,
+        name: str,
+        seconds: float,
+        *,
+        exit_code: int = 0,
+        attempt: int = 1,
+        cached: bool = False,
+        **extra: object,
+    ) -> None:
+        entry: dict[str, object] = {
+            "stage": stage,
+            "name": name,
+            "seconds": round(seconds, 3),
+            "exit_code": exit_code,
+            "attempt": attempt,
+            "cached": cached,
+        }
+        entry.update(extra)
+        with self._lock:
+            self.entries.append(entry)
+
+    def report(self, result: str) -> dict[str, object]:
+        with self._lock:
+            entries = list(self.entries)
+        return {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started_at)),
+            "total_seconds": round(time.time() - self.started_at, 3),
+            "result": result,
+            "compile_cache": self.compile_cache,
+            "compiler_cache": self.compiler_cache,
+            "entries": entries,
+        }
+
+
+def timings_history_path(root_dir: Path) -> Path:
+    return root_dir / ".cache" / "validate" / "timings-history.jsonl"
+
+
+def load_timings_history(root_dir: Path) -> list[dict]:
+    try:
+        lines = timings_history_path(root_dir).read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return []
+    history: list[dict] = []
+    for line in lines:
+        try:
+            history.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return history
+
+
+def write_timings_report(root_dir: Path, log_dir: Path, report: dict[str, object]) -> None:
+    (log_dir / "timings.json").write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+    history = load_timings_history(root_dir)[-(TIMINGS_HISTORY_LIMIT - 1):]
+    history.append(report)
+    path = timings_history_path(root_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("".join(json.dumps(item, separators=(",", ":")) + "\n" for item in history), encoding="utf-8")
+
+
+def size_history_path(root_dir: Path) -> Path:
+    return root_dir / ".cache" / "validate" / "size-history.jsonl"
+
+
+def load_size_history(root_dir: Path) -> list[dict]:
+    path = size_history_path(root_dir)
+    if not path.is_file():
+        return []
+    entries = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue
+    return entries
+
+
+def check_target_size(root_dir: Path, build_dir: Path, config: str, history: list[dict]) -> list[str]:
+    """Measure one compiled target, append it to the size history and return budget violations."""
+    target = next((item for item in load_targets() if item["config"] == config), None)
+    try:
+        report = measure_build(build_dir)
+        budgets = target_budgets(report, target)
+    except FirmwareSizeError as exc:
+        return [str(exc)]
+
+    previous = next((entry["report"] for entry in reversed(history) if entry.get("config") == config), None)
+    print(f"[size] {config}: {describe(report, budgets, previous)}")
+    history.append(
+        {
+            "config": config,
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "report": report,
+        }
+    )
+    return check_budgets(report, budgets)
+
+
+def save_size_history(root_dir: Path, history: list[dict]) -> None:
+    kept: list[dict] = []
+    per_config: dict[str, int] = {}
+    for entry in reversed(history):
+        config = entry.get("config", "")
+        per_config[config] = per_config.get(config, 0) + 1
+        if per_config[config] <= SIZE_HISTORY_LIMIT:
+            kept.append(entry)
+    path = size_history_path(root_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_suffix(".tmp")
+    temp_path.write_text("".join(json.dumps(entry, sort_keys=True) + "\n" for entry in reversed(kept)), encoding="utf-8")
+    os.replace(temp_path, path)
+
+
+def stage_durations(report: dict) -> dict[tuple[str, str], float]:
+    durations: dict[tuple[str, str], float] = {}
+    for entry in report.get("entries", []):
+        # Failed compile attempts stay in: a retry is part of that target's cost.
+        if entry.get("cached") or (entry.get("exit_code") != 0 and entry.get("stage") != "compile"):
+            continue
+        key = (str(entry.get("stage")), str(entry.get("name")))
+        durations[key] = durations.get(key, 0.0) + float(entry.get("seconds", 0.0))
+    return durations
+
+
+def static_compile_weight(target: dict[str, str] | None) -> float:
+    weight = 1.0
+    if target is not None:
+        for key in ("topology", "connection"):
+            weight *= STATIC_COMPILE_WEIGHTS.get(target.get(key, ""), 1.0)
+    return weight
+
+
+def expected_compile_peak_rss(root_dir: Path, samples: int = 20) -> int | None:
+    peaks: list[int] = []
+    for report in load_timings_history(root_dir):
+        for entry in report.get("entries", []):
+            if entry.get("stage") == "compile" and entry.get("peak_rss_mb"):
+                peaks.append(int(entry["peak_rss_mb"]) * 1024 * 1024)
+    return max(peaks[-samples:]) if peaks else None
+
+
+def expected_compile_seconds(root_dir: Path, configs: Sequence[str], samples_per_target: int = 10) -> dict[str, float]:
+    samples: dict[str, list[float]] = {config: [] for config in configs}
+    for report in load_timings_history(root_dir):
+        for (stage, name), seconds in stage_durations(report).items():
+            if stage == "compile" and name in samples:
+                samples[name].append(seconds)
+
+    targets = {target["config"]: target for target in load_targets()}
+    weights = {config: static_compile_weight(targets.get(config)) for config in configs}
+    measured = {config: statistics.median(values[-samples_per_target:]) for config, values in samples.items() if values}
+    # Scale static weights by the measured seconds-per-weight so unmeasured
+    # targets still sort sensibly next to measured ones.
+    scale = statistics.median(measured[config] / weights[config] for config in measured) if measured else 1.0
+    return {config: measured.get(config, weights[config] * scale) for config in configs}
+
+
+def expected_compile_objects(root_dir: Path, configs: Sequence[str], samples_per_target: int = 10) -> dict[str, int]:
+    samples: dict[str, list[int]] = {config: [] for config in configs}
+    for report in load_timings_history(root_dir):
+        for entry in report.get("entries", []):
+            name = entry.get("name")
+            if entry.get("stage") == "compile" and name in samples and entry.get("exit_code") == 0 and entry.get("objects"):
+                samples[name].append(int(entry["objects"]))
+    return {config: int(statistics.median(values[-samples_per_target:])) for config, values in samples.items() if values}
+
+
+def object_component(object_path: str) -> str:
+    parts = PurePosixPath(object_path).parts
+    if ".pioenvs" in parts:
+        parts = parts[parts.index(".pioenvs") + 2:]
+    if "components" in parts[:-1]:
+        return parts[parts.index("components") + 1]
+    if parts and parts[0] == "esp-idf" and len(parts) > 2:
+        return f"esp-idf/{parts[1]}"
+    if parts and re.fullmatch(r"lib[0-9a-f]+", parts[0]) and len(parts) > 2:
+        return parts[1]
+    return parts[0] if len(parts) > 1 else "src"
+
+
+class CompileProgress:
+    """Incremental parser for the output of one `esphome compile` run."""
+
+    def __init__(self, expected_seconds: float | None, expected_objects: int | None) -> None:
+        self.expected_seconds = expected_seconds
+        self.expected_objects = expected_objects
+        self.started_at = time.monotonic()
+        self.last_output_at = self.started_at
+        self.stage = "setup"
+        self.objects = 0
+        self.component = ""
+        self._lock = threading.Lock()
+
+    def feed(self, line: str) -> None:
+        line = line.strip()
+        with self._lock:
+            self.last_output_at = time.monotonic()
+            match = COMPILE_OBJECT_PATTERN.match(line)
+            if match:
+                self.stage = "compile"
+                self.objects += 1
+                self.component = object_component(match.group(1))
+                return
+            match = COMPILE_ARCHIVE_PATTERN.match(line)
+            if match:
+                self.component = object_component(match.group(1))
+                return
+            for prefix, stage in COMPILE_STAGE_PREFIXES:
+                if line.startswith(prefix):
+                    self.stage = stage
+                    return
+
+    def eta_seconds(self, now: float) -> float | None:
+        elapsed = now - self.started_at
+        if self.stage == "compile" and self.expected_objects and self.objects:
+            fraction = min(self.objects / self.expected_objects, 0.99)
+            return elapsed / fraction - elapsed
+        if self.expected_seconds is None:
+            return None
+        return self.expected_seconds - elapsed
+
+    def describe(self, now: float) -> str:
+        with self._lock:
+            if self.stage == "compile":
+                total = f"/{self.expected_objects}" if self.expected_objects else ""
+                text = f"compile {self.objects}{total} obj"
+                if self.component:
+                    text += f" [{self.component}]"
+            else:
+                text = self.stage
+            eta = self.eta_seconds(now)
+            if eta is not None:
+                text += f" ETA {format_duration(eta)}" if eta > 0 else " overdue"
+            idle = now - self.last_output_at
+            if idle >= COMPILE_IDLE_WARNING_S:
+                text += f" (no output for {format_duration(idle)})"
+            return text
+
+
+class CompileProgressBoard:
+    """Print one aggregated progress line for every compile that is running."""
+
+    def __init__(
+        self,
+        expected_seconds: dict[str, float],
+        expected_objects: dict[str, int],
+        interval_s: float = 20.0,
+    ) -> None:
+        self.expected_seconds = expected_seconds
+        self.expected_objects = expected_objects
+        self.interval_s = interval_s
+        self.active: dict[str, CompileProgress] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def track(self, config: str) -> CompileProgress:
+        progress = CompileProgress(self.expected_seconds.get(config), self.expected_objects.get(config))
+        with self._lock:
+            self.active[config] = progress
+        return progress
+
+    def untrack(self, config: str) -> None:
+        with self._lock:
+            self.active.pop(config, None)
+
+    def line(self) -> str:
+        now = time.monotonic()
+        with self._lock:
+            active = list(self.active.items())
+        parts = [
+            f"{config.removeprefix('configs/').removesuffix('.yaml')}: {progress.describe(now)}"
+            for config, progress in active
+        ]
+        return " | ".join(parts)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            line = self.line()
+            if line:
+                print(f"[progress] {line}", flush=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+@dataclass
+class BuildContext:
+    root_dir: Path
+    command_root: Path
+    pio_core_dir: Path
+    log_dir: Path
+    env: dict[str, str]
+    esphome_command: list[str]
+    helper_python: list[str]
+    target_build_paths: dict[str, str]
+    ccache: str = ""
+    memory_gate: MemoryGate | None = None
+    progress: CompileProgressBoard | None = None
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+    timings: BuildTimings = field(default_factory=BuildTimings)
+
+
+def create_build_context(args: argparse.Namespace) -> tuple[BuildContext, Path | None]:
     root_dir = repo_root()
     venv_dir = resolve_path(args.venv_dir)
-    command_root, pio_core_dir, cleanup_dir = resolve_command_root(root_dir)
+    stage = getattr(args, "stage", "")
+    command_root, pio_core_dir, cleanup_dir = resolve_command_root(root_dir, resolve_path(stage) if stage else None)
     log_dir = root_dir / ".tmp" / "validate_local_logs"
-    helper_python = resolve_helper_python(venv_dir)
-    esphome_command = resolve_esphome_command(venv_dir)
-    target_build_paths = build_path_by_config()
-
     log_dir.mkdir(parents=True, exist_ok=True)
 
     env = os.environ.copy()
     env["PLATFORMIO_CORE_DIR"] = str(pio_core_dir)
     env["PLATFORMIO_HOME_DIR"] = str(pio_core_dir)
 
+    context = BuildContext(
+        root_dir=root_dir,
+        command_root=command_root,
+        pio_core_dir=pio_core_dir,
+        log_dir=log_dir,
+        env=env,
+        esphome_command=resolve_esphome_command(venv_dir),
+        helper_python=resolve_helper_python(venv_dir),
+        target_build_paths=build_path_by_config(),
+        ccache="" if getattr(args, "no_ccache", False) else configure_compiler_cache(env, root_dir, command_root),
+    )
+    return context, cleanup_dir
+
+
+def configure_compiler_cache(env: dict[str, str], root_dir: Path, command_root: Path) -> str:
+    ccache = shutil.which("ccache", path=env.get("PATH"))
+    if ccache is None:
+        return ""
+
+    env["OPENQUATT_CCACHE"] = ccache
+    env.setdefault("CCACHE_DIR", str(root_dir / ".cache" / "ccache"))
+    env.setdefault("CCACHE_MAXSIZE", "5G")
+    # Every build path sits at the same depth under the command root, so
+    # relative paths (and therefore cache keys) match across targets.
+    env["CCACHE_BASEDIR"] = str(command_root)
+    env["CCACHE_NOHASHDIR"] = "1"
+    env["CCACHE_SLOPPINESS"] = "time_macros,include_file_mtime,include_file_ctime"
+    extra_script = f"pre:{command_root / 'scripts' / 'platformio_ccache.py'}"
+    existing = env.get("PLATFORMIO_EXTRA_SCRIPTS", "")
+    env["PLATFORMIO_EXTRA_SCRIPTS"] = f"{existing}\n{extra_script}" if existing else extra_script
+    return ccache
+
+
+def compiler_cache_stats(ccache: str, env: dict[str, str]) -> dict[str, int]:
+    completed = subprocess.run(
+        [ccache, "--print-stats"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if completed.returncode != 0:
+        return {}
+    stats: dict[str, int] = {}
+    for line in completed.stdout.splitlines():
+        key, _, value = line.partition("\t")
+        if value.strip().isdigit():
+            stats[key.strip()] = int(value)
+    return stats
+
+
+def compiler_cache_delta(before: dict[str, int], after: dict[str, int]) -> dict[str, int] | None:
+    if not before or not after:
+        return None
+    hits = sum(after.get(key, 0) - before.get(key, 0) for key in ("direct_cache_hit", "preprocessed_cache_hit"))
+    misses = after.get("cache_miss", 0) - before.get("cache_miss", 0)
+    return {"hits": hits, "misses": misses}
+
+
+def consistency_checks(context: BuildContext) -> tuple[tuple[str, list[str], Path], ...]:
+    scripts_dir = context.command_root / "scripts"
+    return (
+        (
+            "style consistency",
+            [*context.helper_python, str(scripts_dir / "check_style_consistency.py")],
+            context.log_dir / "style-consistency.log",
+        ),
+        (
+            "docs consistency",
+            [*context.helper_python, str(scripts_dir / "check_docs_consistency.py")],
+            context.log_dir / "docs-consistency.log",
+        ),
+    )
+
+
+def check_config(context: BuildContext, config: str) -> tuple[str, int, Path]:
+    log_path = context.log_dir / f"{config_log_stem(config)}.config.log"
+    label = f"config {config}"
+    if context.cancel_event.is_set():
+        return config, 1, log_path
+    print(f"[run] {label}", flush=True)
+    started_at = time.monotonic()
+    exit_code = run_command(
+        [*context.esphome_command, "config", config],
+        cwd=context.command_root,
+        env=context.env,
+        log_path=log_path,
+        check=False,
+        heartbeat_label=label,
+        cancel_event=context.cancel_event,
+    )
+    context.timings.record("config", config, time.monotonic() - started_at, exit_code=exit_code)
+    return config, exit_code, log_path
+
+
+def compile_config(context: BuildContext, config: str) -> tuple[str, int, Path]:
+    log_path = context.log_dir / f"{config_log_stem(config)}.compile.log"
+    label = f"compile {config}"
+    cancel_event = context.cancel_event
+    if cancel_event.is_set():
+        return config, 1, log_path
+
+    attempt = 0
+
+    def run_compile() -> int:
+        nonlocal attempt
+        attempt += 1
+        started_at = time.monotonic()
+        usage = ProcessUsage()
+        progress = context.progress.track(config) if context.progress is not None else None
+        try:
+            exit_code = run_command(
+                [*context.esphome_command, "compile", config],
+                cwd=context.command_root,
+                env=context.env,
+                log_path=log_path,
+                check=False,
+                heartbeat_label=label if progress is None else None,
+                cancel_event=cancel_event,
+                usage=usage,
+                output_handler=progress.feed if progress is not None else None,
+            )
+        finally:
+            if context.progress is not None:
+                context.progress.untrack(config)
+        extra: dict[str, object] = {}
+        if usage.peak_rss_bytes:
+            extra["peak_rss_mb"] = round(usage.peak_rss_bytes / (1024 * 1024))
+        if progress is not None and progress.objects:
+            extra["objects"] = progress.objects
+        context.timings.record(
+            "compile",
+            config,
+            time.monotonic() - started_at,
+            exit_code=exit_code,
+            attempt=attempt,
+            **extra,
+        )
+        return exit_code
+
+    print(f"[run] {label}", flush=True)
+    exit_code = run_compile()
+    retries_used: dict[str, int] = {}
+    # Signatures already counted for this compile: a failure that persists through its
+    # retries is one failure, only marked exhausted when the retries run out.
+    counted: set[str] = set()
+    while exit_code != 0 and not cancel_event.is_set():
+        classified = classify_compile_failure(log_path)
+        if classified is None:
+            break
+        signature, captures = classified
+        exhausted = retries_used.get(signature.name, 0) >= signature.retries
+        seen = record_failure_signature(
+            context.root_dir,
+            signature,
+            config,
+            exhausted=exhausted,
+            counted=signature.name in counted,
+        )
+        counted.add(signature.name)
+        if exhausted:
+            print(
+                f"[FAIL] compile {config}: {signature.description} persisted after {signature.retries} retry(ies).",
+                file=sys.stderr,
+            )
+            break
+        started_at = time.monotonic()
+        if not remediate_compile_failure(context, config, signature, captures):
+            break
+        context.timings.record(
+            "remediation",
+            config,
+            time.monotonic() - started_at,
+            signature=signature.name,
+            actions=list(signature.actions),
+        )
+        retries_used[signature.name] = retries_used.get(signature.name, 0) + 1
+        print(f"[retry] compile {config}: {signature.description} (seen {seen} time(s)); {', '.join(signature.actions)}.")
+        exit_code = run_compile()
+
+    if exit_code == 0 and cancel_event.is_set():
+        # The factory binary was never repaired or verified: report it like any cancelled compile,
+        # so it is neither shown as [ok] nor cached as green.
+        with log_path.open("a", encoding="utf-8") as handle:
+            handle.write("[skip] repair: cancelled after an earlier failure\n")
+        return config, 1, log_path
+    if exit_code == 0:
+        # Repair in-process: the merge takes milliseconds, less than starting another interpreter.
+        result = repair_result(target_build_dir(context.command_root, context.target_build_paths, config))
+        message = f"[ok] repaired factory binary: {result['output']}" if result["ok"] else str(result["error"])
+        with log_path.open("a", encoding="utf-8") as handle:
+            handle.write(message + "\n")
+        exit_code = 0 if result["ok"] else 1
+        context.timings.record("repair", config, float(result["seconds"]), exit_code=exit_code)
+    return config, exit_code, log_path
+
+
+def gated_compile_config(context: BuildContext, config: str) -> tuple[str, int, Path]:
+    if context.memory_gate is None:
+        return compile_config(context, config)
+    context.memory_gate.acquire(f"compile {config}")
+    try:
+        return compile_config(context, config)
+    finally:
+        context.memory_gate.release()
+
+
+@contextlib.contextmanager
+def file_lock(path: Path) -> Iterator[None]:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a+b") as handle:
+        if is_windows():
+            import msvcrt
+
+            while True:
+                try:
+                    handle.seek(0)
+                    msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+            return
+
+        import fcntl
+
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+
+def chip_family_by_config() -> dict[str, str]:
+    return {target["config"]: target["chip_family"] for target in load_targets()}
+
+
+def prime_stamp_path(pio_core_dir: Path) -> Path:
+    return pio_core_dir / "openquatt-primed.json"
+
+
+def primed_chip_families(pio_core_dir: Path, esphome_version: str) -> set[str]:
+    packages_dir = pio_core_dir / "packages"
+    if not packages_dir.is_dir() or not any(packages_dir.iterdir()):
+        return set()
+    try:
+        stamp = json.loads(prime_stamp_path(pio_core_dir).read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return set()
+    if not isinstance(stamp, dict) or stamp.get("esphome_version") != esphome_version:
+        return set()
+    return set(stamp.get("chip_families", []))
+
+
+def save_primed_chip_families(pio_core_dir: Path, esphome_version: str, families: set[str]) -> None:
+    prime_stamp_path(pio_core_dir).write_text(
+        json.dumps({"esphome_version": esphome_version, "chip_families": sorted(families)}, indent=2) + "\n",
+        encoding="utf-8",
+    )
+
+
+def prime_compile_caches(
+    context: BuildContext,
+    configs: Sequence[str],
+    esphome_version: str,
+    *,
+    force: bool = False,
+) -> list[tuple[str, int, Path]]:
+    families = chip_family_by_config()
+    results: list[tuple[str, int, Path]] = []
+    with file_lock(context.pio_core_dir / "openquatt-prime.lock"):
+        primed = primed_chip_families(context.pio_core_dir, esphome_version)
+        representatives: dict[str, str] = {}
+        for config in configs:
+            representatives.setdefault(families.get(config, config), config)
+        pending = {family: config for family, config in representatives.items() if force or family not in primed}
+        if not pending:
+            return results
+
+        print(f"Priming shared compile caches for {', '.join(sorted(pending))}.")
+        context.timings.compile_cache = "cold"
+        # ESPHome 2026.5 keeps managed components per build path; a present but
+        # empty legacy shared cache is left over from an interrupted run.
+        espressif_cache_dir = context.command_root / ".esphome" / ".espressif"
+        if espressif_cache_dir.exists() and not any(espressif_cache_dir.iterdir()):
+            shutil.rmtree(espressif_cache_dir, ignore_errors=True)
+
+        for family, config in pending.items():
+            result = compile_config(context, config)
+            results.append(result)
+            if result[1] == 0:
+                primed.add(family)
+                save_primed_chip_families(context.pio_core_dir, esphome_version, primed)
+    return results
+
+
+class InotifyWatcher:
+    """Recursive inotify watch over the workspace, skipping the staging excludes."""
+
+    kind = "inotify"
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, root_dir: Path) -> None:
+        import ctypes
+        import ctypes.util
+
+        self.root_dir = root_dir
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches: dict[int, Path] = {}
+        self._watch_tree(root_dir)
+
+    def _watch_tree(self, directory: Path) -> set[Path]:
+        files: set[Path] = set()
+        for current, dir_names, file_names in os.walk(directory):
+            ignored = stage_ignore(current, [*dir_names, *file_names])
+            dir_names[:] = [name for name in dir_names if name not in ignored]
+            descriptor = self.libc.inotify_add_watch(self.fd, os.fsencode(current), self.WATCH_MASK)
+            if descriptor >= 0:
+                self.watches[descriptor] = Path(current)
+            files.update(
+                (Path(current) / name).relative_to(self.root_dir) for name in file_names if name not in ignored
+            )
+        return files
+
+    def read_changes(self, timeout_s: float | None) -> set[Path]:
+        ready, _, _ = select.select([self.fd], [], [], timeout_s)
+        if not ready:
+            return set()
+
+        data = os.read(self.fd, 64 * 1024)
+        changed: set[Path] = set()
+        offset = 0
+        while offset + self.EVENT_HEADER.size <= len(data):
+            descriptor, mask, _, name_length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + name_length].rstrip(b"\0"))
+            offset += name_length
+            if mask & self.IN_Q_OVERFLOW:
+                return set(walk_stage_files(self.root_dir))
+            directory = self.watches.get(descriptor)
+            if directory is None or not name or stage_ignore(str(directory), [name]):
+                continue
+            path = directory / name
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    changed.update(self._watch_tree(path))
+                continue
+            changed.add(path.relative_to(self.root_dir))
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Fallback watcher that compares file mtimes and sizes between scans."""
+
+    kind = "polling"
+
+    def __init__(self, root_dir: Path, interval_s: float = 1.0) -> None:
+        self.root_dir = root_dir
+        self.interval_s = interval_s
+        self.snapshot = self._scan()
+
+    def _scan(self) -> dict[Path, tuple[int, int]]:
+        snapshot: dict[Path, tuple[int, int]] = {}
+        for relative in walk_stage_files(self.root_dir):
+            try:
+                stat = (self.root_dir / relative).stat()
+            except OSError:
+                continue
+            snapshot[relative] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def read_changes(self, timeout_s: float | None) -> set[Path]:
+        deadline = None if timeout_s is None else time.monotonic() + timeout_s
+        while True:
+            current = self._scan()
+            changed = {path for path in current.keys() | self.snapshot.keys() if current.get(path) != self.snapshot.get(path)}
+            self.snapshot = current
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(self.interval_s if deadline is None else max(0.0, min(self.interval_s, deadline - time.monotonic())))
+
+    def close(self) -> None:
+        pass
+
+
+def create_watcher(root_dir: Path, *, polling: bool) -> InotifyWatcher | PollingWatcher:
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(root_dir)
+        except (AttributeError, OSError) as exc:
+            print(f"inotify unavailable ({exc}); falling back to polling.")
+    return PollingWatcher(root_dir)
+
+
+def wait_for_changes(watcher: InotifyWatcher | PollingWatcher, debounce_s: float) -> set[Path]:
+    changed = watcher.read_changes(None)
+    while True:
+        more = watcher.read_changes(debounce_s)
+        if not more:
+            return changed
+        changed |= more
+
+
+def glob_matches(path: str, pattern: str) -> bool:
+    # fnmatch's `*` already crosses `/`; the `**/`-less variant covers the zero-directory case.
+    return fnmatch.fnmatch(path, pattern) or ("**/" in pattern and fnmatch.fnmatch(path, pattern.replace("**/", "")))
+
+
+def impacted_checks(changed: set[Path]) -> list[str]:
+    return [
+        label
+        for label, patterns in WATCH_CHECK_PATTERNS.items()
+        if any(glob_matches(path.as_posix(), pattern) for path in changed for pattern in patterns)
+    ]
+
+
+class LocalCompileBackend:
+    """Compile on this machine with up to `max_workers` concurrent targets."""
+
+    name = "local"
+
+    def __init__(self, context: BuildContext, jobs: int) -> None:
+        self.context = context
+        self.max_workers = jobs
+
+    def compile(self, config: str) -> tuple[str, int, Path]:
+        return gated_compile_config(self.context, config)
+
+
+class WorkerCompileBackend:
+    """Send compiles to `dev.py worker` processes, one target per worker at a time."""
+
+    name = "workers"
+
+    def __init__(self, context: BuildContext, workers: Sequence[tuple[str, str]]) -> None:
+        self.context = context
+        self.max_workers = len(workers)
+        self.clients: queue.Queue[WorkerClient] = queue.Queue()
+        for address, token in workers:
+            self.clients.put(WorkerClient(address, token))
+        self.workspace_files = list(walk_stage_files(context.root_dir))
+        self.workspace_sha = hash_files(self.workspace_files, context.root_dir)
+        self._payload: bytes | None = None
+        self._lock = threading.Lock()
+
+    def workspace_payload(self) -> bytes:
+        with self._lock:
+            if self._payload is None:
+                root_dir = self.context.root_dir
+                self._payload = pack_files((path.as_posix(), root_dir / path) for path in self.workspace_files)
+            return self._payload
+
+    def compile(self, config: str) -> tuple[str, int, Path]:
+        context = self.context
+        log_path = context.log_dir / f"{config_log_stem(config)}.compile.log"
+        label = f"compile {config}"
+        if context.cancel_event.is_set():
+            return config, 1, log_path
+
+        client = self.clients.get()
+        try:
+            print(f"[run] {label} on {client.address}", flush=True)
+            started_at = time.monotonic()
+            build_dir = target_build_dir(context.command_root, context.target_build_paths, config)
+            try:
+                result = client.build(
+                    workspace_sha=self.workspace_sha,
+                    workspace_payload=self.workspace_payload,
+                    config=config,
+                    build_path=build_dir.parents[1].relative_to(context.command_root).as_posix(),
+                    cancel_event=context.cancel_event,
+                    heartbeat=lambda elapsed: print(
+                        f"[wait] {label} on {client.address} ({format_duration(elapsed)})",
+                        flush=True,
+                    ),
+                )
+                if result.exit_code == 0:
+                    unpack_files(result.outputs, build_dir)
+            except (OSError, ProtocolError) as exc:
+                result = BuildResult(exit_code=1, log=f"Worker {client.address} failed: {exc}\n", outputs=b"")
+            log_path.write_text(result.log, encoding="utf-8")
+            context.timings.record(
+                "compile",
+                config,
+                time.monotonic() - started_at,
+                exit_code=result.exit_code,
+                worker=client.address,
+            )
+            return config, result.exit_code, log_path
+        finally:
+            self.clients.put(client)
+
+
+def start_local_workers(
+    root_dir: Path,
+    count: int,
+    venv_dir: str,
+    token: str,
+) -> tuple[list[str], list[subprocess.Popen]]:
+    addresses: list[str] = []
+    processes: list[subprocess.Popen] = []
+    for index in range(count):
+        work_dir = root_dir / ".tmp" / "workers" / str(index)
+        work_dir.mkdir(parents=True, exist_ok=True)
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                str(Path(__file__).resolve()),
+                "worker",
+                "--listen",
+                "127.0.0.1:0",
+                "--work-dir",
+                str(work_dir),
+                "--venv-dir",
+                str(resolve_path(venv_dir)),
+            ],
+            env={**os.environ, WORKER_TOKEN_ENV: token},
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        processes.append(process)
+        assert process.stdout is not None
+        announcement = process.stdout.readline().strip()
+        if not announcement.startswith("Listening on "):
+            for started in processes:
+                terminate_process(started)
+            raise SystemExit(f"Local build worker {index} did not start: {announcement or 'no output'}")
+        addresses.append(announcement.removeprefix("Listening on "))
+
+        def drain(stream=process.stdout, log_path=work_dir / "worker.log") -> None:
+            with log_path.open("a", encoding="utf-8") as handle:
+                for line in stream:
+                    handle.write(line)
+                    handle.flush()
+
+        threading.Thread(target=drain, daemon=True).start()
+    return addresses, processes
+
+
+def validate_command(args: argparse.Namespace) -> int:
+    auto_reason = ""
+    if args.jobs == "auto":
+        args.jobs, auto_reason = auto_jobs(repo_root())
+    ensure_supported_parallelism(args)
+    context, cleanup_dir = create_build_context(args)
+    root_dir = context.root_dir
+    command_root = context.command_root
+    log_dir = context.log_dir
+    env = context.env
+    cancel_event = context.cancel_event
+    timings = context.timings
+    result = "failed"
+    worker_processes: list[subprocess.Popen] = []
+
     print(f"Workspace root: {root_dir}")
     if command_root != root_dir:
         print(f"Command root: {command_root}")
-    print(f"PlatformIO core dir: {pio_core_dir}")
+    print(f"PlatformIO core dir: {context.pio_core_dir}")
     print(f"Log dir: {log_dir}")
-    print(f"Parallel compile jobs: {args.jobs}")
+    if auto_reason:
+        print(f"Parallel compile jobs: {args.jobs} (auto: {auto_reason})")
+        # Auto mode also backs off mid-run when free memory drops below one compile.
+        if args.jobs > 1 and available_memory_bytes() is not None:
+            context.memory_gate = MemoryGate(
+                expected_compile_peak_rss(root_dir) or AUTO_JOBS_DEFAULT_PEAK_RSS,
+                cancel_event,
+            )
+    else:
+        print(f"Parallel compile jobs: {args.jobs}")
+    print(f"Compiler cache: {context.ccache or 'disabled'}")
 
+    esphome_version = resolve_esphome_version(context.esphome_command, cwd=root_dir, env=env)
+    cache_path = validation_cache_path(root_dir)
+    cache_entries = {} if args.no_cache else load_validation_cache(cache_path)
+    input_keys = validation_input_keys(root_dir, args.configs, esphome_version)
+
+    check_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
     try:
-        command_scripts_dir = command_root / "scripts"
-        run_logged(
-            [*helper_python, str(command_scripts_dir / "check_style_consistency.py")],
-            cwd=command_root,
-            env=env,
-            log_path=log_dir / "style-consistency.log",
-            label="style consistency",
-        )
-        run_logged(
-            [*helper_python, str(command_scripts_dir / "check_docs_consistency.py")],
+        check_futures = start_background_checks(
+            check_executor,
+            () if args.skip_checks else consistency_checks(context),
             cwd=command_root,
             env=env,
-            log_path=log_dir / "docs-consistency.log",
-            label="docs consistency",
+            cancel_event=cancel_event,
+            timings=timings,
+            stop_on_failure=not args.keep_going,
         )
 
+        config_queue: list[str] = []
         for config in args.configs:
-            stem = config_log_stem(config)
-            run_logged(
-                [*esphome_command, "config", config],
-                cwd=command_root,
-                env=env,
-                log_path=log_dir / f"{stem}.config.log",
-                label=f"config {config}",
-            )
+            if cache_entries.get(config, {}).get("config") == input_keys[config]:
+                print(f"[cached] config {config}")
+                timings.record("config", config, 0.0, cached=True)
+                continue
+            config_queue.append(config)
+
+        config_failures = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            futures = [executor.submit(check_config, context, config) for config in config_queue]
+            for future in concurrent.futures.as_completed(futures):
+                config, exit_code, log_path = future.result()
+                if cancel_event.is_set():
+                    continue
+                if exit_code != 0:
+                    config_failures += 1
+                    if not args.keep_going:
+                        cancel_event.set()
+                    print(f"[FAIL] config {config}", file=sys.stderr)
+                    tail = tail_lines(log_path)
+                    if tail:
+                        print(tail, file=sys.stderr, end="" if tail.endswith("\n") else "\n")
+                    continue
+                print(f"[ok] config {config}", flush=True)
+                cache_entries.setdefault(config, {})["config"] = input_keys[config]
+                save_validation_cache(cache_path, cache_entries)
+
+        if config_failures:
+            raise SystemExit(f"Validation finished with {config_failures} config failure(s).")
+        if cancel_event.is_set():
+            finish_background_checks(check_futures)
 
         if args.config_only:
+            finish_background_checks(check_futures)
+            result = "ok"
             print()
             print("Validation complete.")
             return 0
 
-        patched_packages = apply_framework_espidf_source_workarounds(pio_core_dir)
+        patched_packages = apply_framework_espidf_source_workarounds(context.pio_core_dir)
         for package_dir in patched_packages:
             print(f"[fix] patched framework-espidf duplicate sources in {package_dir}")
         if patched_packages:
             shutil.rmtree(command_root / ".esphome" / "build", ignore_errors=True)
 
-        compile_queue = list(args.configs)
-        packages_dir = pio_core_dir / "packages"
-        espressif_cache_dir = command_root / ".esphome" / ".espressif"
-        cold_platformio_cache = not packages_dir.exists() or not any(packages_dir.iterdir())
-        # ESPHome 2026.5 keeps managed components per build path. Only treat the
-        # legacy shared cache as cold when it is actually present.
-        cold_espressif_cache = espressif_cache_dir.exists() and not any(espressif_cache_dir.iterdir())
-        force_serial_compile = args.jobs > 1 and (cold_platformio_cache or cold_espressif_cache)
-        if force_serial_compile:
-            print(
-                "Cold compile cache detected; running this validation sequentially once "
-                "to avoid ESP-IDF component-cache races."
-            )
-            shutil.rmtree(espressif_cache_dir, ignore_errors=True)
-
-        def compile_one(config: str) -> tuple[str, int, Path]:
-            log_path = log_dir / f"{config_log_stem(config)}.compile.log"
-            label = f"compile {config}"
-            print(f"[run] {label}", flush=True)
-            exit_code = run_command(
-                [*esphome_command, "compile", config],
-                cwd=command_root,
-                env=env,
-                log_path=log_path,
-                check=False,
-                heartbeat_label=label,
-            )
-            if exit_code != 0:
-                tail = tail_lines(log_path, limit=160)
-                duplicate_object = next(
-                    (
-                        object_name
-                        for object_name in ("esp_efuse_fields.c.o", "efuse_hal.c.o", "system_time.c.o", "lib_printf.c.o")
-                        if object_name in tail
-                    ),
-                    "",
-                )
-                source_duplicate = (
-                    "Multiple ways to build the same target were specified for:" in tail
-                    and bool(duplicate_object)
-                )
-                cache_race = (
-                    ".esphome/.espressif/service_" in tail
-                    and ("ArduinoJson" in tail or "idf_component_manager" in tail)
-                )
-                if source_duplicate:
-                    patched = apply_framework_espidf_source_workarounds(pio_core_dir)
-                    if patched or has_framework_espidf_source_workaround(pio_core_dir, duplicate_object):
-                        print(
-                            f"[retry] compile {config}: resetting build cache after framework-espidf "
-                            "duplicate-target failure."
-                        )
-                        build_root = command_root / target_build_paths.get(config, f".esphome/build/{Path(config).stem}")
-                        shutil.rmtree(build_root, ignore_errors=True)
-                        exit_code = run_command(
-                            [*esphome_command, "compile", config],
-                            cwd=command_root,
-                            env=env,
-                            log_path=log_path,
-                            check=False,
-                            heartbeat_label=label,
-                        )
-                        tail = tail_lines(log_path, limit=160)
-
-                if cache_race:
-                    print(
-                        f"[retry] compile {config}: resetting ESP-IDF component cache after a generated-cache race."
-                    )
-                    shutil.rmtree(espressif_cache_dir, ignore_errors=True)
-                    exit_code = run_command(
-                        [*esphome_command, "compile", config],
-                        cwd=command_root,
-                        env=env,
-                        log_path=log_path,
-                        check=False,
-                        heartbeat_label=label,
-                    )
-            if exit_code == 0:
-                build_dir = command_root / target_build_paths.get(config, f".esphome/build/{Path(config).stem}") / ".pioenvs" / "openquatt"
-                exit_code = run_command(
-                    [*helper_python, str(command_scripts_dir / "repair_factory_bin.py"), str(build_dir)],
-                    cwd=command_root,
-                    env=env,
-                    log_path=log_path,
-                    check=False,
-                    heartbeat_label=f"repair factory {config}",
-                )
-            return config, exit_code, log_path
+        compile_queue: list[str] = []
+        for config in args.configs:
+            cached = cache_entries.get(config, {}).get("compile") == input_keys[config]
+            build_dir = target_build_dir(command_root, context.target_build_paths, config)
+            if cached and (build_dir / "firmware.factory.bin").is_file():
+                print(f"[cached] compile {config}")
+                timings.record("compile", config, 0.0, cached=True)
+                continue
+            compile_queue.append(config)
+
+        timings.compile_cache = "warm"
+
+        if args.workers and compile_queue:
+            remote_addresses = [address for address in args.workers if address != "local"]
+            remote_token = os.environ.get(WORKER_TOKEN_ENV, "")
+            if remote_addresses and not remote_token:
+                raise SystemExit(f"Set {WORKER_TOKEN_ENV} to the token the build workers were started with.")
+            workers = [(address, remote_token) for address in remote_addresses]
+            if "local" in args.workers:
+                local_token = secrets.token_urlsafe(32)
+                local_addresses, worker_processes = start_local_workers(root_dir, args.jobs, args.venv_dir, local_token)
+                workers.extend((address, local_token) for address in local_addresses)
+            backend: LocalCompileBackend | WorkerCompileBackend = WorkerCompileBackend(context, workers)
+            print(f"Build workers: {', '.join(address for address, _ in workers)}")
+        else:
+            backend = LocalCompileBackend(context, args.jobs)
+
+        local = backend.name == "local"
+        ccache_before = compiler_cache_stats(context.ccache, env) if local and context.ccache and compile_queue else {}
+        expected_seconds = expected_compile_seconds(root_dir, compile_queue)
+        if local and compile_queue:
+            context.progress = CompileProgressBoard(expected_seconds, expected_compile_objects(root_dir, compile_queue))
+            context.progress.start()
+        # Prime with the quickest target per chip family, then start the
+        # longest remaining targets first so the parallel tail stays short.
+        # Workers prime their own caches.
+        results = (
+            prime_compile_caches(context, sorted(compile_queue, key=expected_seconds.__getitem__), esphome_version)
+            if local and compile_queue
+            else []
+        )
+        # The first failed compile cancels the rest unless --keep-going asked for every failure.
+        failed_configs: set[str] = set()
+
+        def note_result(result: tuple[str, int, Path]) -> tuple[str, int, Path]:
+            config, exit_code, _ = result
+            if exit_code != 0 and not cancel_event.is_set():
+                failed_configs.add(config)
+                if not args.keep_going:
+                    cancel_event.set()
+            return result
+
+        for result in results:
+            note_result(result)
+        primed_configs = {config for config, _, _ in results}
+        remaining = sorted(
+            (config for config in compile_queue if config not in primed_configs),
+            key=expected_seconds.__getitem__,
+            reverse=True,
+        )
+        serial_compile = backend.max_workers == 1 or any(exit_code != 0 for _, exit_code, _ in results)
+        if remaining and backend.max_workers > 1 and serial_compile:
+            print("Compile cache priming failed; compiling the remaining targets sequentially.")
 
-        results: list[tuple[str, int, Path]] = []
-        if compile_queue:
-            if args.jobs == 1 or force_serial_compile:
-                results = [compile_one(config) for config in compile_queue]
+        if remaining:
+            if serial_compile:
+                results.extend(note_result(backend.compile(config)) for config in remaining)
             else:
-                with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
-                    futures = [executor.submit(compile_one, config) for config in compile_queue]
+                with concurrent.futures.ThreadPoolExecutor(max_workers=backend.max_workers) as executor:
+                    futures = [executor.submit(backend.compile, config) for config in remaining]
                     for future in concurrent.futures.as_completed(futures):
-                        results.append(future.result())
+                        results.append(note_result(future.result()))
+
+        if context.progress is not None:
+            context.progress.stop()
 
-                order = {config: index for index, config in enumerate(compile_queue)}
-                results.sort(key=lambda item: order[item[0]])
+        order = {config: index for index, config in enumerate(compile_queue)}
+        results.sort(key=lambda item: order[item[0]])
+
+        if cancel_event.is_set():
+            finish_background_checks(check_futures)
+
+        if ccache_before:
+            timings.compiler_cache = compiler_cache_delta(ccache_before, compiler_cache_stats(context.ccache, env))
 
         failures = 0
+        size_failures = 0
+        size_history = load_size_history(root_dir)
         for config, exit_code, log_path in results:
+            if exit_code != 0 and config not in failed_configs:
+                print(f"[skip] compile {config}: cancelled after an earlier failure", file=sys.stderr)
+                continue
             if exit_code != 0:
                 failures += 1
                 print(f"[FAIL] compile {config}", file=sys.stderr)
@@ -856,18 +2326,306 @@ def validate_command(args: argparse.Namespace) -> int:
                     print(tail, file=sys.stderr, end="" if tail.endswith("\n") else "\n")
                 continue
             print(f"[ok] compile {config}")
+            violations = check_target_size(
+                root_dir,
+                target_build_dir(command_root, context.target_build_paths, config),
+                config,
+                size_history,
+            )
+            if violations:
+                size_failures += 1
+                for violation in violations:
+                    print(f"[FAIL] size {config}: {violation}", file=sys.stderr)
+                continue
+            cache_entries.setdefault(config, {})["compile"] = input_keys[config]
+
+        if results:
+            save_size_history(root_dir, size_history)
+        save_validation_cache(cache_path, cache_entries)
 
         if failures:
             raise SystemExit(f"Validation finished with {failures} compile failure(s).")
+        if size_failures:
+            raise SystemExit(f"Validation finished with {size_failures} size budget failure(s).")
 
+        finish_background_checks(check_futures)
+        result = "ok"
         print()
+        if timings.compiler_cache is not None:
+            lookups = timings.compiler_cache["hits"] + timings.compiler_cache["misses"]
+            hit_rate = timings.compiler_cache["hits"] / lookups if lookups else 0.0
+            print(
+                f"Compiler cache: {timings.compiler_cache['hits']} hit(s), "
+                f"{timings.compiler_cache['misses']} miss(es) ({hit_rate:.0%} hit rate)"
+            )
         print("Validation complete.")
         return 0
+    except BaseException:
+        cancel_event.set()
+        raise
+    finally:
+        if context.progress is not None:
+            context.progress.stop()
+        for process in worker_processes:
+            terminate_process(process)
+        check_executor.shutdown(wait=True)
+        write_timings_report(root_dir, log_dir, timings.report(result))
+        if cleanup_dir is not None:
+            shutil.rmtree(cleanup_dir, ignore_errors=True)
+
+
+def timings_command(args: argparse.Namespace) -> int:
+    history = load_timings_history(repo_root())
+    if not history:
+        raise SystemExit("No validate timing history yet. Run 'python3 scripts/dev.py validate' first.")
+
+    latest = history[-1]
+    baseline_runs = [
+        report
+        for report in history[:-1][-args.window:]
+        if not latest.get("compile_cache") or report.get("compile_cache") == latest.get("compile_cache")
+    ]
+    print(
+        f"Latest run: {latest.get('started_at', '?')} ({latest.get('result', '?')}, "
+        f"{latest.get('compile_cache') or 'no'} compile cache, {format_duration(latest.get('total_seconds', 0))})"
+    )
+    print(f"Baseline: median of {len(baseline_runs)} earlier run(s)")
+    print()
+
+    baselines: dict[tuple[str, str], list[float]] = {}
+    for report in baseline_runs:
+        for key, seconds in stage_durations(report).items():
+            baselines.setdefault(key, []).append(seconds)
+
+    regressions = 0
+    print(f"{'stage':<8} {'name':<52} {'latest':>8} {'median':>8} {'delta':>8}")
+    for (stage, name), seconds in sorted(stage_durations(latest).items()):
+        samples = baselines.get((stage, name))
+        if not samples:
+            print(f"{stage:<8} {name:<52} {format_duration(seconds):>8} {'-':>8} {'-':>8}")
+            continue
+        median = statistics.median(samples)
+        delta = seconds - median
+        ratio = delta / median if median > 0 else 0.0
+        regressed = delta >= args.min_seconds and ratio >= args.threshold
+        regressions += int(regressed)
+        marker = "  REGRESSION" if regressed else ""
+        print(
+            f"{stage:<8} {name:<52} {format_duration(seconds):>8} {format_duration(median):>8} "
+            f"{ratio * 100:>+7.0f}%{marker}"
+        )
+
+    print()
+    if regressions:
+        print(f"{regressions} stage(s) regressed by at least {args.threshold:.0%} and {args.min_seconds:.0f}s.")
+        return 1 if args.fail_on_regression else 0
+    print("No timing regressions against the median.")
+    return 0
+
+
+def prime_command(args: argparse.Namespace) -> int:
+    context, cleanup_dir = create_build_context(args)
+    try:
+        print(f"PlatformIO core dir: {context.pio_core_dir}")
+        esphome_version = resolve_esphome_version(context.esphome_command, cwd=context.root_dir, env=context.env)
+        for package_dir in apply_framework_espidf_source_workarounds(context.pio_core_dir):
+            print(f"[fix] patched framework-espidf duplicate sources in {package_dir}")
+
+        results = prime_compile_caches(context, args.configs, esphome_version, force=args.force)
+        if not results:
+            print("Shared compile caches are already primed.")
+            return 0
+
+        failures = 0
+        for config, exit_code, log_path in results:
+            if exit_code != 0:
+                failures += 1
+                print(f"[FAIL] compile {config}", file=sys.stderr)
+                tail = tail_lines(log_path)
+                if tail:
+                    print(tail, file=sys.stderr, end="" if tail.endswith("\n") else "\n")
+                continue
+            print(f"[ok] compile {config}")
+        if failures:
+            raise SystemExit(f"Priming finished with {failures} compile failure(s).")
+
+        print()
+        print("Shared compile caches are primed.")
+        return 0
     finally:
         if cleanup_dir is not None:
             shutil.rmtree(cleanup_dir, ignore_errors=True)
 
 
+def watch_command(args: argparse.Namespace) -> int:
+    if args.jobs == "auto":
+        args.jobs, _ = auto_jobs(repo_root())
+    ensure_supported_parallelism(args)
+    context, cleanup_dir = create_build_context(args)
+    root_dir = context.root_dir
+    esphome_version = resolve_esphome_version(context.esphome_command, cwd=root_dir, env=context.env)
+    cache_path = validation_cache_path(root_dir)
+    cache_entries = load_validation_cache(cache_path)
+    checks = {label: (label, command, log_path) for label, command, log_path in consistency_checks(context)}
+    check_failures: set[str] = set()
+    config_failures: set[str] = set()
+    # Every (config, input key) seen this session, so reverted edits answer instantly.
+    config_results: dict[tuple[str, str], str | None] = {}
+    watcher = create_watcher(root_dir, polling=args.poll)
+
+    pending_configs = list(args.configs)
+    pending_checks = list(checks)
+    print(f"Watching {root_dir} ({watcher.kind}); press Ctrl+C to stop.")
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs + len(checks)) as executor:
+            while True:
+                started_at = time.monotonic()
+                # Check failures must not cancel the config runs of the same round.
+                check_futures = start_background_checks(
+                    executor,
+                    [checks[label] for label in pending_checks],
+                    cwd=context.command_root,
+                    env=context.env,
+                    cancel_event=threading.Event(),
+                )
+
+                input_keys = validation_input_keys(root_dir, pending_configs, esphome_version)
+                config_futures = []
+                for config in pending_configs:
+                    known = (config, input_keys[config])
+                    if cache_entries.get(config, {}).get("config") == input_keys[config]:
+                        config_results[known] = None
+                    if known not in config_results:
+                        config_futures.append(executor.submit(check_config, context, config))
+                        continue
+                    failure_tail = config_results[known]
+                    if failure_tail is None:
+                        print(f"[cached] config {config}")
+                        config_failures.discard(config)
+                    else:
+                        print(f"[FAIL] config {config} (unchanged since last run)", file=sys.stderr)
+                        if failure_tail:
+                            print(failure_tail, file=sys.stderr, end="" if failure_tail.endswith("\n") else "\n")
+                        config_failures.add(config)
+                for future in concurrent.futures.as_completed(config_futures):
+                    config, exit_code, log_path = future.result()
+                    if exit_code != 0:
+                        config_failures.add(config)
+                        print(f"[FAIL] config {config}", file=sys.stderr)
+                        tail = tail_lines(log_path)
+                        config_results[(config, input_keys[config])] = tail
+                        if tail:
+                            print(tail, file=sys.stderr, end="" if tail.endswith("\n") else "\n")
+                        continue
+                    config_failures.discard(config)
+                    config_results[(config, input_keys[config])] = None
+                    print(f"[ok] config {config}", flush=True)
+                    cache_entries.setdefault(config, {})["config"] = input_keys[config]
+                    save_validation_cache(cache_path, cache_entries)
+
+                for future in check_futures:
+                    label, failed, _ = future.result()
+                    if failed:
+                        check_failures.add(label)
+                    else:
+                        check_failures.discard(label)
+
+                failing = sorted(config_failures) + sorted(check_failures)
+                summary = f"{len(failing)} failing: {', '.join(failing)}" if failing else "all green"
+                print(f"[watch] {summary} ({format_duration(time.monotonic() - started_at)}); waiting for changes.")
+
+                while True:
+                    changed = wait_for_changes(watcher, args.debounce)
+                    pending_configs = affected_configs(args.configs, changed, root_dir)
+                    pending_checks = impacted_checks(changed)
+                    if pending_configs or pending_checks:
+                        break
+                preview = ", ".join(sorted(path.as_posix() for path in changed)[:3])
+                more = f" (+{len(changed) - 3} more)" if len(changed) > 3 else ""
+                print()
+                print(f"[watch] changed: {preview}{more}")
+                if context.command_root != root_dir:
+                    sync_staged_workspace(root_dir, context.command_root)
+    except KeyboardInterrupt:
+        context.cancel_event.set()
+        print()
+        print("Stopped watching.")
+        return 0
+    finally:
+        watcher.close()
+        if cleanup_dir is not None:
+            shutil.rmtree(cleanup_dir, ignore_errors=True)
+
+
+def worker_command(args: argparse.Namespace) -> int:
+    work_dir = resolve_path(args.work_dir)
+    venv_dir = resolve_path(args.venv_dir)
+    # Builds run the client's scripts; only clients that know this token may send them.
+    token = os.environ.get(WORKER_TOKEN_ENV, "")
+    if not token:
+        raise SystemExit(
+            f"Set {WORKER_TOKEN_ENV} to a shared secret, for example "
+            f"`export {WORKER_TOKEN_ENV}=$(python3 -c 'import secrets; print(secrets.token_urlsafe(32))')`."
+        )
+
+    def sync_workspace(source_dir: Path, workspace: Path) -> None:
+        copied, linked, removed, unchanged = mirror_workspace(source_dir, workspace)
+        print(f"Workspace mirror: {copied} copied, {linked} linked, {removed} removed, {unchanged} unchanged", flush=True)
+
+    def run_build(workspace: Path, config: str, disconnected: Callable[[], bool]) -> tuple[int, Path]:
+        log_path = work_dir / "build.log"
+        cancel_event = threading.Event()
+        finished = threading.Event()
+
+        def watch_client() -> None:
+            while not finished.wait(1.0):
+                if disconnected():
+                    cancel_event.set()
+                    return
+
+        threading.Thread(target=watch_client, daemon=True).start()
+        try:
+            exit_code = run_command(
+                [
+                    sys.executable,
+                    str(workspace / "scripts" / "dev.py"),
+                    "validate",
+                    "--config",
+                    config,
+                    "--jobs",
+                    "1",
+                    "--skip-checks",
+                    "--venv-dir",
+                    str(venv_dir),
+                ],
+                cwd=workspace,
+                log_path=log_path,
+                check=False,
+                cancel_event=cancel_event,
+            )
+        finally:
+            finished.set()
+        compile_log = workspace / ".tmp" / "validate_local_logs" / f"{config_log_stem(config)}.compile.log"
+        if compile_log.is_file():
+            with log_path.open("a", encoding="utf-8") as handle:
+                handle.write(f"\n--- {compile_log.name} ---\n")
+                handle.write(compile_log.read_text(encoding="utf-8", errors="replace"))
+        return exit_code, log_path
+
+    try:
+        serve_worker(
+            args.listen,
+            work_dir,
+            token=token,
+            sync_workspace=sync_workspace,
+            run_build=run_build,
+            announce=lambda message: print(message, flush=True),
+        )
+    except KeyboardInterrupt:
+        print("Stopped worker.")
+    return 0
+
+
 def prepare_pages_site_command(args: argparse.Namespace) -> int:
     venv_dir = resolve_path(args.venv_dir)
     helper_python = resolve_helper_python(venv_dir)
@@ -880,75 +2638,69 @@ def preview_pages_command(args: argparse.Namespace) -> int:
     venv_dir = resolve_path(args.venv_dir)
     helper_python = resolve_helper_python(venv_dir)
 
-    temp_dir = Path(tempfile.mkdtemp(prefix="openquatt-pages-preview."))
-    site_dir = temp_dir / "site"
-    work_firmware_dir = temp_dir / "firmware"
-    work_firmware_dir.mkdir(parents=True, exist_ok=True)
-
-    try:
-        if args.firmware_dir:
-            source_dir = Path(args.firmware_dir).resolve()
-            for file_name in ensure_factory_dir(source_dir):
-                shutil.copy2(source_dir / file_name, work_firmware_dir / file_name)
-        else:
-            for file_name in factory_files():
-                (work_firmware_dir / file_name).touch()
-
-        build_pages_site(site_dir, work_firmware_dir, helper_python)
-        version_path = site_dir / "firmware" / "main" / "version.json"
-        version_path.write_text(
-            json.dumps(
-                {
-                    "version": describe_version(root_dir),
-                    "release_url": "https://github.com/jeroen85/OpenQuatt/releases/latest",
-                },
-                indent=2,
-            )
-            + "\n",
-            encoding="utf-8",
+    # The preview stays in the repo so the next run only re-renders and rewrites what changed.
+    preview_dir = root_dir / PAGES_PREVIEW_DIR
+    site_dir = preview_dir / "site"
+    if args.firmware_dir:
+        firmware_dir = Path(args.firmware_dir).resolve()
+    else:
+        firmware_dir = preview_dir / "placeholder-firmware"
+        firmware_dir.mkdir(parents=True, exist_ok=True)
+        placeholders = set(factory_files())
+        for path in firmware_dir.glob("*.firmware.factory.bin"):
+            if path.name not in placeholders:
+                path.unlink()
+        for file_name in placeholders:
+            if not (firmware_dir / file_name).exists():
+                (firmware_dir / file_name).touch()
+
+    build_pages_site(site_dir, firmware_dir, helper_python)
+    write_site_text(
+        site_dir / "firmware" / "main" / "version.json",
+        json.dumps(
+            {
+                "version": describe_version(root_dir),
+                "release_url": "https://github.com/jeroen85/OpenQuatt/releases/latest",
+            },
+            indent=2,
         )
+        + "\n",
+    )
 
-        print("Local Pages preview ready.")
-        print(f"Preview directory: {site_dir}")
-        print("Open:")
-        print(f"  http://{args.host}:{args.port}/")
-        print(f"  http://{args.host}:{args.port}/verwarmen-en-koelen.html")
-        print(f"  http://{args.host}:{args.port}/install/index.html")
-
-        if not args.firmware_dir:
-            print()
-            print("Using placeholder firmware binaries.")
-            print("Use --firmware-dir <dir> if you want to test with real factory images.")
+    print("Local Pages preview ready.")
+    print(f"Preview directory: {site_dir}")
+    print("Open:")
+    print(f"  http://{args.host}:{args.port}/")
+    print(f"  http://{args.host}:{args.port}/verwarmen-en-koelen.html")
+    print(f"  http://{args.host}:{args.port}/install/index.html")
 
-        if args.no_serve:
-            print()
-            print("Build completed without starting the HTTP server because --no-serve was used.")
-            if not args.keep:
-                print("Use --keep if you want to inspect the generated preview directory after the command exits.")
-            return 0
+    if not args.firmware_dir:
+        print()
+        print("Using placeholder firmware binaries.")
+        print("Use --firmware-dir <dir> if you want to test with real factory images.")
 
+    if args.no_serve:
         print()
-        print("Stop with Ctrl+C.")
-        run_command(
-            [
-                *helper_python,
-                "-m",
-                "http.server",
-                str(args.port),
-                "--bind",
-                args.host,
-                "--directory",
-                str(site_dir),
-            ],
-            cwd=root_dir,
-            check=False,
-        )
+        print("Build completed without starting the HTTP server because --no-serve was used.")
         return 0
-    finally:
-        if args.keep:
-            print(f"Preview directory kept at: {temp_dir}")
-        else:
-            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    print()
+    print("Stop with Ctrl+C.")
+    run_command(
+        [
+            *helper_python,
+            "-m",
+            "http.server",
+            str(args.port),
+            "--bind",
+            args.host,
+            "--directory",
+            str(site_dir),
+        ],
+        cwd=root_dir,
+        check=False,
+    )
+    return 0
 
 
 def create_parser() -> argparse.ArgumentParser:
@@ -980,14 +2732,162 @@ def create_parser() -> argparse.ArgumentParser:
         help="Skip firmware compilation after config validation.",
     )
     validate_parser.add_argument("--venv-dir", default=".venv", help="Virtual environment directory.")
+    validate_parser.add_argument(
+        "--stage",
+        nargs="?",
+        const=DEFAULT_STAGE_DIR,
+        default="",
+        metavar="DIR",
+        help=f"Build from an incrementally mirrored copy of the workspace in DIR (default {DEFAULT_STAGE_DIR}).",
+    )
     validate_parser.add_argument(
         "--jobs",
-        type=int,
+        type=parse_jobs,
         default=default_jobs(),
-        help="Maximum number of concurrent compile jobs.",
+        help=(
+            "Maximum number of concurrent config and compile jobs, or 'auto' to size it from CPU cores, "
+            "free memory and the peak memory of earlier compiles."
+        ),
+    )
+    validate_parser.add_argument(
+        "--affected-since",
+        default="",
+        metavar="REF",
+        help="Only validate configs whose inputs changed since the merge base with REF.",
+    )
+    validate_parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Ignore cached green results and re-run every config and compile stage.",
+    )
+    validate_parser.add_argument(
+        "--no-ccache",
+        action="store_true",
+        help="Do not route ESP-IDF compiles through ccache even when it is installed.",
+    )
+    validate_parser.add_argument(
+        "--worker",
+        dest="workers",
+        action="append",
+        default=[],
+        metavar="HOST:PORT",
+        help=(
+            "Send compiles to a `dev.py worker` at HOST:PORT, authenticating with $OPENQUATT_WORKER_TOKEN. "
+            "May be passed multiple times; 'local' starts --jobs worker processes on this machine."
+        ),
+    )
+    validate_parser.add_argument(
+        "--skip-checks",
+        action="store_true",
+        help="Skip the style and docs consistency checks.",
+    )
+    validate_parser.add_argument(
+        "--keep-going",
+        action="store_true",
+        help="Do not stop at the first failed check, config or compile; report every failure at the end.",
     )
     validate_parser.set_defaults(func=validate_command)
 
+    worker_parser = subparsers.add_parser(
+        "worker",
+        help=f"Serve compiles for `validate --worker` over a socket. Requires {WORKER_TOKEN_ENV}.",
+    )
+    worker_parser.add_argument("--listen", default="127.0.0.1:8765", help="HOST:PORT to listen on; port 0 picks one.")
+    worker_parser.add_argument(
+        "--work-dir",
+        default=".tmp/worker",
+        help="Directory holding the persistent workspace and its build caches.",
+    )
+    worker_parser.add_argument("--venv-dir", default=".venv", help="Virtual environment directory.")
+    worker_parser.set_defaults(func=worker_command)
+
+    prime_parser = subparsers.add_parser(
+        "prime",
+        help="Populate the shared PlatformIO and ESP-IDF component caches once under a file lock.",
+    )
+    prime_parser.add_argument(
+        "--config",
+        dest="configs",
+        action="append",
+        default=[],
+        help="Prime using the given config file. May be passed multiple times.",
+    )
+    prime_parser.add_argument("--force", action="store_true", help="Prime again even when the caches are marked primed.")
+    prime_parser.add_argument(
+        "--no-ccache",
+        action="store_true",
+        help="Do not route ESP-IDF compiles through ccache even when it is installed.",
+    )
+    prime_parser.add_argument("--venv-dir", default=".venv", help="Virtual environment directory.")
+    prime_parser.add_argument(
+        "--stage",
+        nargs="?",
+        const=DEFAULT_STAGE_DIR,
+        default="",
+        metavar="DIR",
+        help=f"Build from an incrementally mirrored copy of the workspace in DIR (default {DEFAULT_STAGE_DIR}).",
+    )
+    prime_parser.set_defaults(func=prime_command)
+
+    watch_parser = subparsers.add_parser(
+        "watch",
+        help="Re-run the config and consistency checks affected by each file change.",
+    )
+    watch_parser.add_argument(
+        "--config",
+        dest="configs",
+        action="append",
+        default=[],
+        help="Watch only the given config file. May be passed multiple times.",
+    )
+    watch_parser.add_argument("--venv-dir", default=".venv", help="Virtual environment directory.")
+    watch_parser.add_argument(
+        "--stage",
+        nargs="?",
+        const=DEFAULT_STAGE_DIR,
+        default="",
+        metavar="DIR",
+        help=f"Build from an incrementally mirrored copy of the workspace in DIR (default {DEFAULT_STAGE_DIR}).",
+    )
+    watch_parser.add_argument(
+        "--jobs",
+        type=parse_jobs,
+        default=default_jobs(),
+        help="Maximum number of concurrent config jobs, or 'auto'.",
+    )
+    watch_parser.add_argument(
+        "--debounce",
+        type=float,
+        default=0.3,
+        help="Seconds without further changes before a batch of edits is checked.",
+    )
+    watch_parser.add_argument("--poll", action="store_true", help="Poll for changes instead of using inotify.")
+    watch_parser.set_defaults(func=watch_command)
+
+    timings_parser = subparsers.add_parser(
+        "timings",
+        help="Compare the latest validate timing report against the historical median.",
+    )
+    timings_parser.add_argument("--window", type=int, default=20, help="Number of earlier runs in the baseline.")
+    timings_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Relative slowdown that counts as a regression (0.2 = 20%%).",
+    )
+    timings_parser.add_argument(
+        "--min-seconds",
+        type=float,
+        default=15.0,
+        help="Minimum absolute slowdown in seconds that counts as a regression.",
+    )
+    timings_parser.add_argument(
+        "--fail-on-regression",
+        action="store_true",
+        help="Exit with status 1 when a regression is found.",
+    )
+    timings_parser.set_defaults(func=timings_command)
+
     prepare_parser = subparsers.add_parser(
         "prepare-pages-site",
         help="Assemble the local Pages site from docs and factory binaries.",
@@ -1008,7 +2908,11 @@ def create_parser() -> argparse.ArgumentParser:
         default="",
         help="Directory containing real *.firmware.factory.bin files.",
     )
-    preview_parser.add_argument("--keep", action="store_true", help="Keep the temporary preview directory.")
+    preview_parser.add_argument(
+        "--keep",
+        action="store_true",
+        help=f"Accepted for older scripts; the preview always stays in {PAGES_PREVIEW_DIR}.",
+    )
     preview_parser.add_argument(
         "--no-serve",
         action="store_true",
@@ -1023,10 +2927,14 @@ def create_parser() -> argparse.ArgumentParser:
 def main(argv: Sequence[str] | None = None) -> int:
     parser = create_parser()
     args = parser.parse_args(argv)
-    if getattr(args, "command", None) == "validate" and not args.configs:
+    if getattr(args, "command", None) in ("validate", "prime", "watch") and not args.configs:
         args.configs = default_configs()
-    if getattr(args, "command", None) == "validate" and args.jobs < 1:
-        parser.error("--jobs must be a positive integer")
+    if getattr(args, "command", None) == "validate" and args.affected_since:
+        selected = affected_configs(args.configs, changed_files_since(args.affected_since, repo_root()), repo_root())
+        skipped = [config for config in args.configs if config not in selected]
+        for config in skipped:
+            print(f"[skip] {config}: unaffected since {args.affected_since}")
+        args.configs = selected
     return args.func(args)
 
 
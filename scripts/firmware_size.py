@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""Measure firmware size and static RAM use per OpenQuatt component."""
+
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+
+from repair_factory_bin import PARTITION_TYPE_APP, FactoryBinError, parse_partition_table
+
+ELF_MAGIC = b"\x7fELF"
+ELF_HEADER = struct.Struct("<16sHHIIIIIHHHHHH")
+ELF_SECTION_HEADER = struct.Struct("<IIIIIIIIII")
+ELF_SYMBOL = struct.Struct("<IIIBBH")
+SHT_SYMTAB = 2
+SHF_ALLOC = 0x2
+
+# Output-section prefixes of the ESP-IDF linker scripts, mapped to memory regions.
+SECTION_REGIONS = (
+    (".iram", "iram"),
+    (".dram", "dram"),
+    (".noinit", "dram"),
+    (".rtc", "rtc"),
+    (".ext_ram", "psram"),
+    (".flash", "flash"),
+)
+REGIONS = ("flash", "iram", "dram", "rtc", "psram")
+
+COMPONENT_PATH_PATTERN = re.compile(r"components[\\/](openquatt_[a-z0-9_]+)[\\/]")
+# Mangled C++ names spell namespaces as <length><name>, e.g. `15openquatt_trends`.
+COMPONENT_SYMBOL_PATTERN = re.compile(r"(openquatt_[a-z_]+|OpenQuattOTSlave)")
+SYMBOL_COMPONENT_ALIASES = {"OpenQuattOTSlave": "openquatt_ot_slave"}
+MAP_INPUT_PATTERN = re.compile(r"^\s+(0x[0-9a-fA-F]+)\s+(0x[0-9a-fA-F]+)\s+(\S.*)$")
+
+
+class FirmwareSizeError(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class ElfSection:
+    name: str
+    address: int
+    size: int
+    kind: int
+    flags: int
+    index: int
+
+
+def section_region(name: str) -> str:
+    for prefix, region in SECTION_REGIONS:
+        if name.startswith(prefix):
+            return region
+    return ""
+
+
+def _read_elf(path: Path) -> tuple[bytes, list[ElfSection], list[tuple[int, int, int, int]]]:
+    data = path.read_bytes()
+    if len(data) < ELF_HEADER.size or data[:4] != ELF_MAGIC:
+        raise FirmwareSizeError(f"{path} is not an ELF file")
+    if data[4] != 1 or data[5] != 1:
+        raise FirmwareSizeError(f"{path} is not a 32-bit little-endian ELF file")
+    header = ELF_HEADER.unpack_from(data, 0)
+    section_offset, section_entry_size, section_count, names_index = header[6], header[11], header[12], header[13]
+    if section_entry_size != ELF_SECTION_HEADER.size:
+        raise FirmwareSizeError(f"{path} has unexpected section header size {section_entry_size}")
+
+    raw_sections = [
+        ELF_SECTION_HEADER.unpack_from(data, section_offset + index * section_entry_size)
+        for index in range(section_count)
+    ]
+    names_offset = raw_sections[names_index][4] if names_index < section_count else 0
+
+    def name_at(table_offset: int, offset: int) -> str:
+        start = table_offset + offset
+        return data[start:data.index(b"\0", start)].decode("utf-8", errors="replace")
+
+    sections = [
+        ElfSection(
+            name=name_at(names_offset, raw[0]),
+            address=raw[3],
+            size=raw[5],
+            kind=raw[1],
+            flags=raw[2],
+            index=index,
+        )
+        for index, raw in enumerate(raw_sections)
+    ]
+
+    symbols: list[tuple[int, int, int, int]] = []
+    for raw in raw_sections:
+        if raw[1] != SHT_SYMTAB:
+            continue
+        strings_offset = raw_sections[raw[6]][4]
+        for offset in range(raw[4], raw[4] + raw[5], ELF_SYMBOL.size):
+            name, _, size, _, _, section_index = ELF_SYMBOL.unpack_from(data, offset)
+            symbols.append((strings_offset, name, size, section_index))
+    return data, sections, symbols
+
+
+def elf_regions(path: Path) -> tuple[dict[str, int], dict[str, dict[str, int]]]:
+    """Return region totals and per-component attribution from ELF symbols."""
+    data, sections, symbols = _read_elf(path)
+    regions = dict.fromkeys(REGIONS, 0)
+    region_by_index: dict[int, str] = {}
+    for section in sections:
+        region = section_region(section.name)
+        if not region or not section.flags & SHF_ALLOC:
+            continue
+        regions[region] += section.size
+        region_by_index[section.index] = region
+
+    components: dict[str, dict[str, int]] = {}
+    for strings_offset, name_offset, size, section_index in symbols:
+        region = region_by_index.get(section_index)
+        if not region or not size:
+            continue
+        start = strings_offset + name_offset
+        name = data[start:data.index(b"\0", start)].decode("utf-8", errors="replace")
+        match = COMPONENT_SYMBOL_PATTERN.search(name)
+        if match is None:
+            continue
+        component = SYMBOL_COMPONENT_ALIASES.get(match.group(1), match.group(1))
+        usage = components.setdefault(component, dict.fromkeys(REGIONS, 0))
+        usage[region] += size
+    return regions, components
+
+
+def map_components(path: Path) -> dict[str, dict[str, int]]:
+    """Attribute linker input sections in a GNU ld map file to OpenQuatt components."""
+    components: dict[str, dict[str, int]] = {}
+    in_memory_map = False
+    output_region = ""
+    pending_region = ""
+    with path.open("r", encoding="utf-8", errors="replace") as handle:
+        for line in handle:
+            if not in_memory_map:
+                in_memory_map = line.startswith("Linker script and memory map")
+                continue
+            if line[:1] == ".":
+                output_region = section_region(line.split()[0])
+                continue
+            stripped = line.strip()
+            if line.startswith(" .") or line.startswith(" COMMON"):
+                parts = stripped.split(None, 3)
+                pending_region = output_region
+                if len(parts) < 4:
+                    continue
+                address, size, source = parts[1], parts[2], parts[3]
+            else:
+                match = MAP_INPUT_PATTERN.match(line.rstrip("\n"))
+                if match is None or not pending_region:
+                    pending_region = ""
+                    continue
+                address, size, source = match.groups()
+            region, pending_region = pending_region, ""
+            if not region or not address.startswith("0x"):
+                continue
+            component = COMPONENT_PATH_PATTERN.search(source)
+            if component is None:
+                continue
+            usage = components.setdefault(component.group(1), dict.fromkeys(REGIONS, 0))
+            usage[region] += int(size, 16)
+    return components
+
+
+def app_partition_size(path: Path) -> int | None:
+    """Return the smallest app partition in an ESP-IDF partition table binary."""
+    try:
+        partitions = parse_partition_table(path.read_bytes(), str(path))
+    except FactoryBinError as exc:
+        raise FirmwareSizeError(str(exc)) from exc
+    sizes = [partition.size for partition in partitions if partition.type == PARTITION_TYPE_APP]
+    return min(sizes) if sizes else None
+
+
+def measure_build(build_dir: Path) -> dict[str, object]:
+    """Measure one `.pioenvs/<env>` directory produced by `esphome compile`."""
+    ota_path = next(
+        (path for path in (build_dir / "firmware.ota.bin", build_dir / "firmware.bin") if path.is_file()),
+        None,
+    )
+    if ota_path is None:
+        raise FirmwareSizeError(f"No firmware.ota.bin or firmware.bin in {build_dir}")
+
+    report: dict[str, object] = {"ota_bytes": ota_path.stat().st_size}
+    partitions_path = build_dir / "partitions.bin"
+    if partitions_path.is_file():
+        report["app_partition_bytes"] = app_partition_size(partitions_path)
+
+    elf_path = build_dir / "firmware.elf"
+    if elf_path.is_file():
+        regions, components = elf_regions(elf_path)
+        map_path = build_dir / "firmware.map"
+        if map_path.is_file():
+            components = map_components(map_path) or components
+        report["regions"] = regions
+        report["components"] = {
+            name: {region: size for region, size in usage.items() if size}
+            for name, usage in sorted(components.items())
+        }
+    return report
+
+
+def target_budgets(report: dict[str, object], target: dict[str, str] | None = None) -> dict[str, int]:
+    """Default to the app partition for OTA, then apply `size_budget_*` target keys."""
+    budgets: dict[str, int] = {}
+    if report.get("app_partition_bytes"):
+        budgets["ota"] = int(report["app_partition_bytes"])
+    for key, value in (target or {}).items():
+        if key.startswith("size_budget_"):
+            try:
+                budgets[key.removeprefix("size_budget_")] = int(value, 0)
+            except ValueError as exc:
+                raise FirmwareSizeError(f"Invalid {key} for {target.get('id', '?')}: {value!r}") from exc
+    return budgets
+
+
+def budget_usage(report: dict[str, object]) -> dict[str, int]:
+    usage = {"ota": int(report["ota_bytes"])}
+    usage.update(report.get("regions", {}))
+    return usage
+
+
+def check_budgets(report: dict[str, object], budgets: dict[str, int]) -> list[str]:
+    usage = budget_usage(report)
+    return [
+        f"{name} uses {usage[name]} bytes, over its budget of {budget} bytes by {usage[name] - budget}"
+        for name, budget in sorted(budgets.items())
+        if name in usage and usage[name] > budget
+    ]
+
+
+BYTE_UNITS = (("GiB", 1024 * 1024 * 1024, 2), ("MiB", 1024 * 1024, 2), ("KiB", 1024, 1))
+
+
+def format_bytes(value: int) -> str:
+    """Format a byte count the same way in every script: binary units, plain bytes below 1 KiB."""
+    for unit, scale, digits in BYTE_UNITS:
+        if abs(value) >= scale:
+            return f"{value / scale:.{digits}f} {unit}"
+    return f"{value} B"
+
+
+def describe(report: dict[str, object], budgets: dict[str, int], previous: dict[str, object] | None = None) -> str:
+    usage = budget_usage(report)
+    before = budget_usage(previous) if previous else {}
+    parts = []
+    for name in ("ota", "dram", "iram", "psram"):
+        if name not in usage or (name != "ota" and not usage[name]):
+            continue
+        text = f"{name.upper()} {format_bytes(usage[name])}"
+        if name in budgets:
+            text += f" / {format_bytes(budgets[name])} ({usage[name] / budgets[name]:.0%})"
+        if name in before and before[name] != usage[name]:
+            delta = usage[name] - before[name]
+            text += f" {'+' if delta > 0 else '-'}{format_bytes(abs(delta))}"
+        parts.append(text)
+    return ", ".join(parts)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Report firmware size and static RAM use per OpenQuatt component.")
+    parser.add_argument("build_dir", help="Path to the .pioenvs/openquatt build directory.")
+    parser.add_argument("--config", default="", help="Apply the size_budget_* keys of this build_targets.yaml config.")
+    parser.add_argument("--json", action="store_true", help="Print the full report as JSON.")
+    args = parser.parse_args()
+
+    target = None
+    if args.config:
+        from build_targets import load_targets
+
+        target = next((item for item in load_targets() if item["config"] == args.config), None)
+        if target is None:
+            raise SystemExit(f"Unknown config in build_targets.yaml: {args.config}")
+
+    try:
+        report = measure_build(Path(args.build_dir))
+        budgets = target_budgets(report, target)
+    except FirmwareSizeError as exc:
+        raise SystemExit(str(exc)) from exc
+
+    if args.json:
+        print(json.dumps({**report, "budgets": budgets}, indent=2, sort_keys=True))
+    else:
+        print(describe(report, budgets))
+        for component, usage in report.get("components", {}).items():
+            print(f"  {component}: " + ", ".join(f"{region} {format_bytes(size)}" for region, size in usage.items()))
+
+    violations = check_budgets(report, budgets)
+    for violation in violations:
+        print(f"[FAIL] {violation}")
+    return 1 if violations else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
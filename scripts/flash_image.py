@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""Find the flash images an ESPHome build merges into its factory binary.
+
+Both PlatformIO actions (normalize_factory_merge_inputs.py before the app is
+linked, repair_factory_bin.py after it) and the standalone repair read the
+same flasher_args.json and look for the same files. They share one cache per
+build directory here: the parsed flasher_args.json, the file each entry
+resolved to, and the stat of every file looked at. The parsed args and
+resolved paths stay valid until flasher_args.json changes, except that a
+resolved fallback is dropped once the file the entry names appears; stats are
+dropped with `forget_stats()` whenever the images may have been rebuilt.
+
+The cache lives in one process. Neither PlatformIO action is registered as an
+`extra_scripts` entry today: validate repairs in-process through dev.py and CI
+runs repair_factory_bin.py as its own command, so the pre-action and
+post-action never share a cache. It only pays off within one repair, which
+then reads flasher_args.json and stats each image once.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import stat
+from dataclasses import dataclass, field
+from pathlib import Path
+
+ESP_IMAGE_MAGIC = 0xE9
+BOOTLOADER_OFFSETS = (0x0, 0x1000, 0x2000)
+PARTITION_TABLE_OFFSET = 0x8000
+OTADATA_OFFSETS = (0xE000, 0xF000)
+APP_MIN_OFFSET = 0x10000
+FLASHER_ARGS_NAME = "flasher_args.json"
+
+
+class FactoryBinError(RuntimeError):
+    pass
+
+
+@dataclass
+class BuildDirCache:
+    build_dir: Path
+    signature: tuple[int, int] | None = None
+    flasher_args: dict | None = None
+    resolved: dict[tuple[str, str, int], Path] = field(default_factory=dict)
+    stats: dict[Path, os.stat_result] = field(default_factory=dict)
+
+    def stat(self, path: Path) -> os.stat_result | None:
+        """Stat `path` once per cache generation; missing files are not cached."""
+        result = self.stats.get(path)
+        if result is None:
+            try:
+                result = path.stat()
+            except OSError:
+                return None
+            self.stats[path] = result
+        return result
+
+    def is_file(self, path: Path) -> bool:
+        result = self.stat(path)
+        return result is not None and stat.S_ISREG(result.st_mode)
+
+    def size(self, path: Path) -> int:
+        result = self.stat(path)
+        if result is None:
+            raise FactoryBinError(f"Flash file disappeared: {path}")
+        return result.st_size
+
+    def forget_stats(self) -> None:
+        self.stats.clear()
+
+    def reset(self) -> None:
+        self.signature = None
+        self.flasher_args = None
+        self.resolved.clear()
+        self.stats.clear()
+
+
+_CACHES: dict[Path, BuildDirCache] = {}
+
+
+def build_dir_cache(build_dir: Path) -> BuildDirCache:
+    build_dir = build_dir.resolve()
+    cache = _CACHES.get(build_dir)
+    if cache is None:
+        cache = _CACHES[build_dir] = BuildDirCache(build_dir)
+    return cache
+
+
+def parse_offset(value: str) -> int:
+    try:
+        return int(str(value).strip(), 0)
+    except ValueError as exc:
+        raise FactoryBinError(f"Invalid flash offset: {value!r}") from exc
+
+
+def _signature(path: Path) -> tuple[int, int] | None:
+    try:
+        result = path.stat()
+    except OSError:
+        return None
+    return result.st_mtime_ns, result.st_size
+
+
+def load_flasher_args(build_dir: Path) -> dict:
+    """Return the parsed flasher_args.json, re-reading it only when it changed on disk.
+
+    The returned dict is shared with the cache; copy it before changing it.
+    """
+    cache = build_dir_cache(build_dir)
+    path = cache.build_dir / FLASHER_ARGS_NAME
+    signature = _signature(path)
+    if signature is None:
+        cache.reset()
+        raise FactoryBinError(f"flasher_args.json not found: {path}")
+    if signature != cache.signature or cache.flasher_args is None:
+        cache.reset()
+        try:
+            flasher_args = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError) as exc:
+            raise FactoryBinError(f"Invalid flasher_args.json: {path}") from exc
+        cache.signature = signature
+        cache.flasher_args = flasher_args
+    return cache.flasher_args
+
+
+def save_flasher_args(build_dir: Path, flasher_args: dict) -> Path:
+    """Write flasher_args.json and keep the cache in step, so the next load does not re-parse it.
+
+    Paths resolved so far stay cached: rewriting the args does not move any image.
+    """
+    cache = build_dir_cache(build_dir)
+    path = cache.build_dir / FLASHER_ARGS_NAME
+    path.write_text(json.dumps(flasher_args, indent=2) + "\n", encoding="utf-8")
+    cache.signature = _signature(path)
+    cache.flasher_args = flasher_args
+    return path
+
+
+def is_app_image_name(name: str) -> bool:
+    normalized = name.lower()
+    return normalized == "firmware.bin" or normalized.startswith("openquatt_")
+
+
+def has_esp_image_magic(path: Path) -> bool:
+    try:
+        with path.open("rb") as handle:
+            return handle.read(1) == bytes([ESP_IMAGE_MAGIC])
+    except OSError:
+        return False
+
+
+def infer_role(offset: int, path: Path) -> str:
+    name = path.name.lower()
+    if offset in BOOTLOADER_OFFSETS or "bootloader" in name:
+        return "bootloader"
+    if offset == PARTITION_TABLE_OFFSET or "partition" in name or name == "partitions.bin":
+        return "partition-table"
+    if offset in OTADATA_OFFSETS or "ota_data" in name:
+        return "otadata"
+    if offset >= APP_MIN_OFFSET and has_esp_image_magic(path):
+        return "app"
+    return ""
+
+
+def fallback_candidates(raw_path: str, build_dir: Path, role: str, offset: int) -> list[Path]:
+    raw_name = Path(str(raw_path)).name
+    candidates = [
+        build_dir / raw_name,
+        build_dir / str(raw_path),
+    ]
+
+    if role == "bootloader" or offset in BOOTLOADER_OFFSETS:
+        candidates.extend(
+            (
+                build_dir / "bootloader.bin",
+                build_dir / "bootloader" / "bootloader.bin",
+            )
+        )
+    if role == "partition-table" or offset == PARTITION_TABLE_OFFSET:
+        candidates.extend(
+            (
+                build_dir / "partitions.bin",
+                build_dir / "partition_table" / "partition-table.bin",
+            )
+        )
+    if role == "otadata" or offset in OTADATA_OFFSETS:
+        candidates.append(build_dir / "ota_data_initial.bin")
+    if role == "app" or (not role and is_app_image_name(raw_name)):
+        candidates.append(build_dir / "firmware.bin")
+
+    return candidates
+
+
+def find_flash_file(raw_path: str, build_dir: Path, role: str, offset: int) -> tuple[Path | None, list[Path]]:
+    """Return the file a flasher_args entry points at, or None, together with the paths tried."""
+    cache = build_dir_cache(build_dir)
+    key = (str(raw_path), role, offset)
+    path = Path(str(raw_path))
+    primary = path if path.is_absolute() else cache.build_dir / path
+    resolved = cache.resolved.get(key)
+    if resolved is not None and cache.is_file(resolved):
+        # A cached fallback gives way as soon as the file the entry names shows up.
+        if resolved == primary or not cache.is_file(primary):
+            return resolved, [resolved]
+
+    candidates = [primary]
+    candidates.extend(fallback_candidates(str(raw_path), cache.build_dir, role, offset))
+    for candidate in candidates:
+        if cache.is_file(candidate):
+            resolved = candidate.resolve()
+            if resolved != candidate:
+                cache.stats[resolved] = cache.stats[candidate]
+            cache.resolved[key] = resolved
+            return resolved, candidates
+    cache.resolved.pop(key, None)
+    return None, candidates
+
+
+def resolve_flash_file(raw_path: str, build_dir: Path, role: str, offset: int) -> Path:
+    resolved, candidates = find_flash_file(raw_path, build_dir, role, offset)
+    if resolved is None:
+        tried = ", ".join(str(candidate) for candidate in candidates)
+        raise FactoryBinError(f"Flash file for {role or hex(offset)} not found. Tried: {tried}")
+    return resolved
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""Show the layout of an OpenQuatt factory or OTA image, or diff two of them."""
+
+from __future__ import annotations
+
+import argparse
+import json
+import mmap
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from firmware_size import format_bytes
+from flash_image import BOOTLOADER_OFFSETS, ESP_IMAGE_MAGIC, PARTITION_TABLE_OFFSET, FactoryBinError
+from repair_factory_bin import (
+    PARTITION_TABLE_MAGIC,
+    PARTITION_TABLE_MAX_SIZE,
+    PARTITION_TYPE_APP,
+    PARTITION_TYPE_DATA,
+    EspImage,
+    Partition,
+    parse_partition_table,
+    verify_esp_image,
+)
+
+DIFF_BLOCK_SIZE = 4096
+
+APP_SUBTYPES = {0x00: "factory", 0x20: "test", **{0x10 + index: f"ota_{index}" for index in range(16)}}
+DATA_SUBTYPES = {
+    0x00: "ota",
+    0x01: "phy",
+    0x02: "nvs",
+    0x03: "coredump",
+    0x04: "nvs_keys",
+    0x05: "efuse",
+    0x80: "esphttpd",
+    0x81: "fat",
+    0x82: "spiffs",
+    0x83: "littlefs",
+}
+
+
+@dataclass
+class Region:
+    name: str
+    offset: int
+    size: int
+    kind: str
+    image: EspImage | None = None
+    error: str = ""
+
+    @property
+    def used(self) -> int:
+        return self.image.size if self.image is not None else self.size
+
+
+@dataclass
+class ImageLayout:
+    path: Path
+    size: int
+    regions: list[Region] = field(default_factory=list)
+
+
+def partition_kind(partition: Partition) -> str:
+    if partition.type == PARTITION_TYPE_APP:
+        return f"app/{APP_SUBTYPES.get(partition.subtype, hex(partition.subtype))}"
+    if partition.type == PARTITION_TYPE_DATA:
+        return f"data/{DATA_SUBTYPES.get(partition.subtype, hex(partition.subtype))}"
+    return f"{hex(partition.type)}/{hex(partition.subtype)}"
+
+
+def _esp_region(data: mmap.mmap, name: str, offset: int, limit: int, kind: str) -> Region:
+    region = Region(name=name, offset=offset, size=limit - offset, kind=kind)
+    try:
+        region.image = verify_esp_image(data, offset, limit, name)
+    except FactoryBinError as exc:
+        region.error = str(exc)
+    return region
+
+
+def read_layout(path: Path, data: mmap.mmap) -> ImageLayout:
+    """Split an image into bootloader, partition table and partitions, or a single app for OTA images."""
+    layout = ImageLayout(path=path, size=len(data))
+    magic_end = PARTITION_TABLE_OFFSET + len(PARTITION_TABLE_MAGIC)
+    if data[PARTITION_TABLE_OFFSET:magic_end] != PARTITION_TABLE_MAGIC:
+        if not data[:1] or data[0] != ESP_IMAGE_MAGIC:
+            raise FactoryBinError(f"{path} is neither a factory image nor an ESP app image")
+        layout.regions.append(_esp_region(data, "app", 0, len(data), "app image"))
+        return layout
+
+    bootloader_offset = next(
+        (offset for offset in BOOTLOADER_OFFSETS if offset < len(data) and data[offset] == ESP_IMAGE_MAGIC),
+        None,
+    )
+    if bootloader_offset is not None:
+        layout.regions.append(
+            _esp_region(data, "bootloader", bootloader_offset, PARTITION_TABLE_OFFSET, "bootloader")
+        )
+    partitions = parse_partition_table(
+        data[PARTITION_TABLE_OFFSET:PARTITION_TABLE_OFFSET + PARTITION_TABLE_MAX_SIZE],
+        f"{path.name} partition table",
+    )
+    layout.regions.append(
+        Region(name="partition-table", offset=PARTITION_TABLE_OFFSET, size=PARTITION_TABLE_MAX_SIZE, kind="table")
+    )
+    for partition in sorted(partitions, key=lambda item: item.offset):
+        if partition.offset >= len(data):
+            layout.regions.append(Region(partition.label, partition.offset, 0, partition_kind(partition)))
+            continue
+        end = min(partition.end, len(data))
+        kind = partition_kind(partition)
+        if partition.type == PARTITION_TYPE_APP and data[partition.offset] == ESP_IMAGE_MAGIC:
+            layout.regions.append(_esp_region(data, partition.label, partition.offset, end, kind))
+        else:
+            layout.regions.append(Region(partition.label, partition.offset, end - partition.offset, kind))
+    return layout
+
+
+def changed_ranges(
+    old: mmap.mmap,
+    old_offset: int,
+    new: mmap.mmap,
+    new_offset: int,
+    size: int,
+) -> list[tuple[int, int]]:
+    """Return [start, end) ranges, relative to the region start, where two equally long regions differ."""
+    ranges: list[tuple[int, int]] = []
+    for start in range(0, size, DIFF_BLOCK_SIZE):
+        end = min(start + DIFF_BLOCK_SIZE, size)
+        if old[old_offset + start:old_offset + end] == new[new_offset + start:new_offset + end]:
+            continue
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+
+    # Narrow each block-aligned range to the first and last differing byte.
+    narrowed = []
+    for start, end in ranges:
+        while old[old_offset + start] == new[new_offset + start]:
+            start += 1
+        while old[old_offset + end - 1] == new[new_offset + end - 1]:
+            end -= 1
+        narrowed.append((start, end))
+    return narrowed
+
+
+def diff_bytes(old: mmap.mmap, old_offset: int, old_size: int, new: mmap.mmap, new_offset: int, new_size: int) -> dict:
+    common = min(old_size, new_size)
+    ranges = changed_ranges(old, old_offset, new, new_offset, common)
+    # Bytes past the shorter region were added or removed; count them either way.
+    if max(old_size, new_size) > common:
+        ranges.append((common, max(old_size, new_size)))
+    return {
+        "old_size": old_size,
+        "new_size": new_size,
+        "changed_ranges": ranges,
+        "changed_bytes": sum(end - start for start, end in ranges),
+    }
+
+
+def diff_layouts(old: ImageLayout, old_data: mmap.mmap, new: ImageLayout, new_data: mmap.mmap) -> list[dict]:
+    old_regions = {region.name: region for region in old.regions}
+    result = []
+    for region in new.regions:
+        before = old_regions.pop(region.name, None)
+        if before is None:
+            result.append({"region": region.name, "status": "added", "new_size": region.used, **_errors(None, region)})
+            continue
+        entry = {
+            "region": region.name,
+            **diff_bytes(old_data, before.offset, before.used, new_data, region.offset, region.used),
+            **_errors(before, region),
+        }
+        if before.offset != region.offset:
+            entry["moved"] = [before.offset, region.offset]
+        if before.image is not None and region.image is not None:
+            entry["segments"] = [
+                {
+                    "index": index,
+                    "load_address": (new_segment or old_segment).load_address,
+                    **diff_bytes(
+                        old_data,
+                        old_segment.offset if old_segment else 0,
+                        old_segment.size if old_segment else 0,
+                        new_data,
+                        new_segment.offset if new_segment else 0,
+                        new_segment.size if new_segment else 0,
+                    ),
+                }
+                for index, (old_segment, new_segment) in enumerate(
+                    _pair(before.image.segments, region.image.segments)
+                )
+            ]
+        changed = entry["changed_bytes"] or entry["old_size"] != entry["new_size"] or "moved" in entry
+        entry["status"] = "changed" if changed else "unchanged"
+        result.append(entry)
+    result.extend(
+        {"region": name, "status": "removed", "old_size": region.used, **_errors(region, None)}
+        for name, region in old_regions.items()
+    )
+    return result
+
+
+def _errors(old: Region | None, new: Region | None) -> dict[str, str]:
+    errors = {}
+    if old is not None and old.error:
+        errors["old_error"] = old.error
+    if new is not None and new.error:
+        errors["new_error"] = new.error
+    return errors
+
+
+def _pair(old: tuple, new: tuple) -> list[tuple]:
+    return [
+        (old[index] if index < len(old) else None, new[index] if index < len(new) else None)
+        for index in range(max(len(old), len(new)))
+    ]
+
+
+def format_delta(value: int) -> str:
+    return f"{'+' if value >= 0 else '-'}{format_bytes(abs(value))}"
+
+
+def layout_json(layout: ImageLayout) -> dict:
+    return {
+        "path": str(layout.path),
+        "size": layout.size,
+        "regions": [
+            {
+                "name": region.name,
+                "offset": region.offset,
+                "size": region.size,
+                "kind": region.kind,
+                "used": region.used,
+                **({"error": region.error} if region.error else {}),
+                **(
+                    {
+                        "segments": [
+                            {"load_address": segment.load_address, "offset": segment.offset, "size": segment.size}
+                            for segment in region.image.segments
+                        ],
+                        "hash_appended": region.image.hash_appended,
+                    }
+                    if region.image is not None
+                    else {}
+                ),
+            }
+            for region in layout.regions
+        ],
+    }
+
+
+def print_layout(layout: ImageLayout) -> None:
+    print(f"{layout.path} ({format_bytes(layout.size)})")
+    for region in layout.regions:
+        detail = ""
+        if region.image is not None:
+            detail = f"  ESP image {format_bytes(region.image.size)}, {len(region.image.segments)} segment(s)"
+            if region.image.hash_appended:
+                detail += ", SHA-256 ok"
+        elif region.error:
+            detail = f"  INVALID: {region.error}"
+        print(f"  0x{region.offset:06x}  {region.name:<16} {region.kind:<14} {format_bytes(region.size):>10}{detail}")
+        if region.image is not None:
+            for index, segment in enumerate(region.image.segments):
+                print(f"      segment {index}  load 0x{segment.load_address:08x}  {format_bytes(segment.size):>10}")
+
+
+def print_diff(entries: list[dict], max_ranges: int) -> None:
+    for entry in entries:
+        name = entry["region"]
+        if entry["status"] in ("added", "removed", "unchanged"):
+            print(f"  {name}: {entry['status']}")
+        else:
+            _print_changes(entry, max_ranges)
+        for key, side in (("old_error", "old"), ("new_error", "new")):
+            if key in entry:
+                print(f"      INVALID in {side} image: {entry[key]}")
+
+
+def _print_changes(entry: dict, max_ranges: int) -> None:
+    name = entry["region"]
+    line = (
+        f"  {name}: {format_bytes(entry['old_size'])} -> {format_bytes(entry['new_size'])} "
+        f"({format_delta(entry['new_size'] - entry['old_size'])}), "
+        f"{format_bytes(entry['changed_bytes'])} differ in {len(entry['changed_ranges'])} range(s)"
+    )
+    if "moved" in entry:
+        line += f", moved 0x{entry['moved'][0]:06x} -> 0x{entry['moved'][1]:06x}"
+    print(line)
+    for start, end in entry["changed_ranges"][:max_ranges]:
+        print(f"      +0x{start:06x}..+0x{end:06x} ({format_bytes(end - start)})")
+    if len(entry["changed_ranges"]) > max_ranges:
+        print(f"      ... {len(entry['changed_ranges']) - max_ranges} more range(s)")
+    for segment in entry.get("segments", []):
+        if not segment["changed_bytes"] and segment["old_size"] == segment["new_size"]:
+            continue
+        print(
+            f"      segment {segment['index']} load 0x{segment['load_address']:08x}: "
+            f"{format_bytes(segment['old_size'])} -> {format_bytes(segment['new_size'])} "
+            f"({format_delta(segment['new_size'] - segment['old_size'])}), "
+            f"{format_bytes(segment['changed_bytes'])} differ"
+        )
+
+
+def _map(path: Path) -> mmap.mmap:
+    with path.open("rb") as handle:
+        return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Inspect or diff OpenQuatt factory and OTA images.")
+    parser.add_argument("image", help="Factory or OTA image to inspect, or the old image with --diff.")
+    parser.add_argument("--diff", metavar="NEW", help="Compare IMAGE against NEW per region and segment.")
+    parser.add_argument("--max-ranges", type=int, default=8, help="Changed ranges to list per region.")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable JSON.")
+    args = parser.parse_args()
+
+    paths = [Path(args.image)] + ([Path(args.diff)] if args.diff else [])
+    for path in paths:
+        if not path.is_file() or path.stat().st_size == 0:
+            raise SystemExit(f"Not a non-empty file: {path}")
+    maps = [_map(path) for path in paths]
+    try:
+        layouts = [read_layout(path, data) for path, data in zip(paths, maps)]
+        invalid = [(layout.path, region) for layout in layouts for region in layout.regions if region.error]
+        if args.diff:
+            entries = diff_layouts(layouts[0], maps[0], layouts[1], maps[1])
+            if args.json:
+                print(json.dumps({"old": str(paths[0]), "new": str(paths[1]), "regions": entries}, indent=2))
+            else:
+                print(f"{paths[0]} -> {paths[1]}")
+                print_diff(entries, args.max_ranges)
+        elif args.json:
+            print(json.dumps(layout_json(layouts[0]), indent=2))
+        else:
+            print_layout(layouts[0])
+    except FactoryBinError as exc:
+        raise SystemExit(str(exc)) from exc
+    finally:
+        for data in maps:
+            data.close()
+    for path, region in invalid:
+        print(f"[FAIL] {path}: {region.name} is not a valid ESP image", file=sys.stderr)
+    return 1 if invalid else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
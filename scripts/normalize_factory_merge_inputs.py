@@ -1,9 +1,24 @@
 Import("env")  # noqa: F821
 
+import copy
+import inspect
 import itertools
-import json
+import sys
 from pathlib import Path
 
+# SCons runs this file without `__file__`; make the shared flash_image module importable.
+SCRIPTS_DIR = Path(inspect.getfile(inspect.currentframe())).resolve().parent
+if str(SCRIPTS_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPTS_DIR))
+
+from flash_image import (  # noqa: E402
+    FactoryBinError,
+    find_flash_file,
+    load_flasher_args,
+    parse_offset,
+    save_flasher_args,
+)
+
 
 def _flatten_flash_images(flash_images):
     return list(
@@ -32,12 +47,10 @@ def _flash_files_from_extra_images(env, build_dir):
     return flash_files
 
 
-def _load_flasher_args(path):
-    if not path.exists():
-        return None
+def _load_flasher_args(build_dir):
     try:
-        return json.loads(path.read_text())
-    except (OSError, json.JSONDecodeError):
+        return copy.deepcopy(load_flasher_args(build_dir))
+    except FactoryBinError:
         return None
 
 
@@ -45,24 +58,16 @@ def _normalize_flash_files(flash_files, build_dir):
     normalized = {}
     for address, filename in flash_files.items():
         resolved = _resolve_path(filename, build_dir)
-        if not resolved.exists():
-            for candidate in _fallback_candidates(address, build_dir):
-                if candidate.exists():
-                    resolved = candidate
-                    break
-        normalized[address] = str(resolved)
+        try:
+            offset = parse_offset(address)
+        except FactoryBinError:
+            normalized[address] = str(resolved)
+            continue
+        found, _ = find_flash_file(str(filename), build_dir, "", offset)
+        normalized[address] = str(found or resolved)
     return normalized
 
 
-def _fallback_candidates(address, build_dir):
-    by_address = {
-        "0x0": [build_dir / "bootloader.bin"],
-        "0x8000": [build_dir / "partitions.bin"],
-        "0xf000": [build_dir / "ota_data_initial.bin"],
-    }
-    return by_address.get(str(address).lower(), [])
-
-
 def _first_app_partition_offset(path):
     try:
         lines = path.read_text().splitlines()
@@ -110,8 +115,7 @@ def _set_firmware_image(data, env, flash_files):
 
 def normalize_factory_merge_inputs(source, target, env):
     build_dir = Path(env.subst("$BUILD_DIR"))
-    flasher_args_path = build_dir / "flasher_args.json"
-    data = _load_flasher_args(flasher_args_path) or {}
+    data = _load_flasher_args(build_dir) or {}
 
     flash_files = _normalize_flash_files(data.get("flash_files", {}), build_dir)
     if not flash_files:
@@ -122,7 +126,7 @@ def normalize_factory_merge_inputs(source, target, env):
     _set_firmware_image(data, env, flash_files)
 
     data["flash_files"] = flash_files
-    flasher_args_path.write_text(json.dumps(data, indent=2) + "\n")
+    flasher_args_path = save_flasher_args(build_dir, data)
     print(f"Normalized factory merge inputs: {flasher_args_path}")
 
 
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""Binary deltas between two OTA images of the same OpenQuatt target.
+
+A delta is a fixed header followed by a zlib stream of COPY and ADD
+instructions. COPY takes a byte range from the base image, ADD carries new
+bytes literally. The header pins the MD5 of both images, so a delta is only
+applied to the exact image it was made from and the result can be verified.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import struct
+import zlib
+from pathlib import Path
+
+DELTA_MAGIC = b"OQD1"
+DELTA_HEADER = struct.Struct("<4sI16sI16s")
+OP_COPY = 0
+OP_ADD = 1
+COPY_OP = struct.Struct("<BII")
+ADD_OP = struct.Struct("<BI")
+
+# Xtensa code is mostly 2- or 3-byte aligned and relocations shift whole
+# functions, so index every 4th base offset with a 16-byte key.
+BLOCK_SIZE = 16
+INDEX_STEP = 4
+# Shorter matches cost more as a COPY instruction than as literal bytes.
+MIN_COPY = 24
+
+
+class DeltaError(RuntimeError):
+    pass
+
+
+def _match_length(base: bytes, base_offset: int, target: bytes, target_offset: int) -> int:
+    limit = min(len(base) - base_offset, len(target) - target_offset)
+    length = 0
+    step = 4096
+    while length < limit:
+        size = min(step, limit - length)
+        if base[base_offset + length:base_offset + length + size] == target[target_offset + length:target_offset + length + size]:
+            length += size
+            continue
+        if size <= 16:
+            while length < limit and base[base_offset + length] == target[target_offset + length]:
+                length += 1
+            break
+        step = max(16, size // 16)
+    return length
+
+
+def make_delta(base: bytes, target: bytes, *, base_md5: str | None = None, target_md5: str | None = None) -> bytes:
+    """Encode `target` as COPY/ADD instructions against `base`.
+
+    Callers that already hashed either image pass its md5 hex so it is not hashed again.
+    """
+    index: dict[bytes, int] = {}
+    for offset in range(0, len(base) - BLOCK_SIZE + 1, INDEX_STEP):
+        index.setdefault(base[offset:offset + BLOCK_SIZE], offset)
+
+    ops = bytearray()
+    literal_start = 0
+    position = 0
+    # After a COPY, the next match usually continues at the same displacement.
+    expected_offset = -1
+
+    def flush_literal(end: int) -> None:
+        if end > literal_start:
+            ops.extend(ADD_OP.pack(OP_ADD, end - literal_start))
+            ops.extend(target[literal_start:end])
+
+    while position + BLOCK_SIZE <= len(target):
+        base_offset = -1
+        if 0 <= expected_offset <= len(base) - BLOCK_SIZE and (
+            base[expected_offset:expected_offset + BLOCK_SIZE] == target[position:position + BLOCK_SIZE]
+        ):
+            base_offset = expected_offset
+        else:
+            base_offset = index.get(target[position:position + BLOCK_SIZE], -1)
+        if base_offset < 0:
+            position += 1
+            expected_offset = expected_offset + 1 if expected_offset >= 0 else -1
+            continue
+
+        length = _match_length(base, base_offset, target, position)
+        start = position
+        while start > literal_start and base_offset > 0 and base[base_offset - 1] == target[start - 1]:
+            start -= 1
+            base_offset -= 1
+            length += 1
+        if length < MIN_COPY:
+            position += 1
+            expected_offset = -1
+            continue
+
+        flush_literal(start)
+        ops.extend(COPY_OP.pack(OP_COPY, base_offset, length))
+        position = start + length
+        literal_start = position
+        expected_offset = base_offset + length
+
+    flush_literal(len(target))
+    header = DELTA_HEADER.pack(
+        DELTA_MAGIC,
+        len(base),
+        bytes.fromhex(base_md5) if base_md5 else hashlib.md5(base).digest(),
+        len(target),
+        bytes.fromhex(target_md5) if target_md5 else hashlib.md5(target).digest(),
+    )
+    return header + zlib.compress(bytes(ops), 9)
+
+
+def delta_base_md5(delta: bytes) -> str:
+    if len(delta) < DELTA_HEADER.size or delta[:4] != DELTA_MAGIC:
+        raise DeltaError("Not an OpenQuatt OTA delta")
+    return DELTA_HEADER.unpack_from(delta, 0)[2].hex()
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    delta_base_md5(delta)
+    _, base_size, base_md5, target_size, target_md5 = DELTA_HEADER.unpack_from(delta, 0)
+    if len(base) != base_size or hashlib.md5(base).digest() != base_md5:
+        raise DeltaError("Base image does not match the image this delta was made from")
+    try:
+        ops = zlib.decompress(delta[DELTA_HEADER.size:])
+    except zlib.error as exc:
+        raise DeltaError(f"Corrupt delta stream: {exc}") from exc
+
+    output = bytearray()
+    position = 0
+    while position < len(ops):
+        if ops[position] == OP_COPY:
+            _, offset, length = COPY_OP.unpack_from(ops, position)
+            position += COPY_OP.size
+            if offset + length > len(base):
+                raise DeltaError("COPY instruction reads past the end of the base image")
+            output.extend(base[offset:offset + length])
+        elif ops[position] == OP_ADD:
+            _, length = ADD_OP.unpack_from(ops, position)
+            position += ADD_OP.size
+            if position + length > len(ops):
+                raise DeltaError("ADD instruction runs past the end of the delta")
+            output.extend(ops[position:position + length])
+            position += length
+        else:
+            raise DeltaError(f"Unknown delta instruction {ops[position]}")
+
+    if len(output) != target_size or hashlib.md5(output).digest() != target_md5:
+        raise DeltaError("Patched image does not match the expected target image")
+    return bytes(output)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Create or apply OpenQuatt OTA image deltas.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    make_parser = subparsers.add_parser("make", help="Write a delta that turns BASE into TARGET.")
+    make_parser.add_argument("base")
+    make_parser.add_argument("target")
+    make_parser.add_argument("output")
+    apply_parser = subparsers.add_parser("apply", help="Rebuild the target image from BASE and DELTA.")
+    apply_parser.add_argument("base")
+    apply_parser.add_argument("delta")
+    apply_parser.add_argument("output")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "make":
+            target = Path(args.target).read_bytes()
+            delta = make_delta(Path(args.base).read_bytes(), target)
+            Path(args.output).write_bytes(delta)
+            print(f"Delta: {len(delta)} bytes for a {len(target)} byte image ({len(delta) / len(target):.1%})")
+        else:
+            Path(args.output).write_bytes(apply_delta(Path(args.base).read_bytes(), Path(args.delta).read_bytes()))
+            print(f"Patched image written to {args.output}")
+    except DeltaError as exc:
+        raise SystemExit(str(exc)) from exc
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
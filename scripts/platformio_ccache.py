@@ -0,0 +1,16 @@
+Import("env")  # noqa: F821
+
+import os
+
+
+def _wrap_compile_commands(env, ccache):
+    for key in ("CCCOM", "CXXCOM"):
+        command = env.get(key, "")
+        if command and ccache not in command:
+            env.Replace(**{key: f'"{ccache}" {command}'})
+
+
+_ccache = os.environ.get("OPENQUATT_CCACHE", "")
+if _ccache:
+    _wrap_compile_commands(env, _ccache)  # noqa: F821
+    print(f"Compiler cache enabled: {_ccache}")
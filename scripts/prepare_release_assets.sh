@@ -1,10 +1,21 @@
 #!/usr/bin/env bash
 set -euo pipefail
 
-if [[ $# -ne 3 ]]; then
-  echo "Usage: $0 <version> <base-url> <release-url>" >&2
+if [[ $# -lt 3 ]]; then
+  echo "Usage: $0 <version> <base-url> <release-url> [previous-ota-dir] [--gzip-ota]" >&2
   exit 64
 fi
 
 ROOT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"
-exec python3 "${ROOT_DIR}/scripts/build_targets.py" prepare-release-assets "$1" "$2" "$3"
+VERSION="$1"
+BASE_URL="$2"
+RELEASE_URL="$3"
+shift 3
+
+PREVIOUS_ARGS=()
+if [[ $# -gt 0 && "$1" != -* ]]; then
+  PREVIOUS_ARGS=(--previous-dir "$1")
+  shift
+fi
+
+exec python3 "${ROOT_DIR}/scripts/build_targets.py" prepare-release-assets "${VERSION}" "${BASE_URL}" "${RELEASE_URL}" ${PREVIOUS_ARGS[@]+"${PREVIOUS_ARGS[@]}"} "$@"
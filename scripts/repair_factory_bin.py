@@ -2,12 +2,62 @@
 from __future__ import annotations
 
 import argparse
+import concurrent.futures
+import hashlib
+import inspect
 import json
+import os
+import struct
+import sys
+import time
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable
+from typing import BinaryIO
+
+# PlatformIO runs this file through SCons, where `__file__` is not defined.
+SCRIPTS_DIR = Path(inspect.getfile(inspect.currentframe())).resolve().parent  # type: ignore[arg-type]
+if str(SCRIPTS_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPTS_DIR))
+
+from flash_image import (  # noqa: E402
+    ESP_IMAGE_MAGIC,
+    BuildDirCache,
+    FactoryBinError,
+    build_dir_cache,
+    infer_role,
+    load_flasher_args,
+    parse_offset,
+    resolve_flash_file,
+)
+
+# magic, segment count, SPI mode, SPI speed/size, entry address
+ESP_IMAGE_HEADER = struct.Struct("<BBBBI")
+# WP pin, SPI drive settings, chip id, min rev, min/max full rev, reserved, hash appended
+ESP_EXTENDED_HEADER = struct.Struct("<B3sHBHH4sB")
+ESP_SEGMENT_HEADER = struct.Struct("<II")
+ESP_CHECKSUM_SEED = 0xEF
+ESP_MAX_SEGMENTS = 16
 
-ESP_IMAGE_MAGIC = 0xE9
 PARTITION_TABLE_MAGIC = b"\xaa\x50"
+PARTITION_MD5_MAGIC = b"\xeb\xeb"
+PARTITION_ENTRY = struct.Struct("<2sBBII16sI")
+PARTITION_TABLE_MAX_SIZE = 0xC00
+PARTITION_TYPE_APP = 0x00
+PARTITION_TYPE_DATA = 0x01
+PARTITION_SUBTYPE_OTA_DATA = 0x00
+ROLE_MAGIC = {
+    "bootloader": bytes([ESP_IMAGE_MAGIC]),
+    "app": bytes([ESP_IMAGE_MAGIC]),
+    "partition-table": PARTITION_TABLE_MAGIC,
+}
+ROLE_LABELS = {
+    "bootloader": "ESP bootloader",
+    "app": "ESP app",
+    "partition-table": "partition table",
+}
+
+COPY_CHUNK_SIZE = 1024 * 1024
+FILL_CHUNK = b"\xff" * (64 * 1024)
 
 ROLE_KEYS = (
     ("bootloader", ("bootloader",)),
@@ -17,99 +67,33 @@ ROLE_KEYS = (
 )
 
 
-class FactoryBinError(RuntimeError):
-    pass
-
-
-def parse_offset(value: str) -> int:
-    try:
-        return int(str(value).strip(), 0)
-    except ValueError as exc:
-        raise FactoryBinError(f"Invalid flash offset: {value!r}") from exc
-
-
-def load_flasher_args(build_dir: Path) -> dict:
-    path = build_dir / "flasher_args.json"
-    if not path.is_file():
-        raise FactoryBinError(f"flasher_args.json not found: {path}")
-    try:
-        return json.loads(path.read_text(encoding="utf-8"))
-    except json.JSONDecodeError as exc:
-        raise FactoryBinError(f"Invalid flasher_args.json: {path}") from exc
-
-
-def first_existing(candidates: Iterable[Path]) -> Path | None:
-    for candidate in candidates:
-        if candidate.is_file():
-            return candidate
-    return None
-
-
-def fallback_candidates(raw_path: str, build_dir: Path, role: str, offset: int) -> list[Path]:
-    raw_name = Path(str(raw_path)).name
-    candidates = [
-        build_dir / raw_name,
-        build_dir / str(raw_path),
-    ]
-
-    if role == "bootloader" or offset in (0x0, 0x1000, 0x2000):
-        candidates.extend(
-            (
-                build_dir / "bootloader.bin",
-                build_dir / "bootloader" / "bootloader.bin",
-            )
-        )
-    if role == "partition-table" or offset == 0x8000:
-        candidates.extend(
-            (
-                build_dir / "partitions.bin",
-                build_dir / "partition_table" / "partition-table.bin",
-            )
-        )
-    if role == "otadata":
-        candidates.append(build_dir / "ota_data_initial.bin")
-    if role == "app" or (not role and is_app_image_name(raw_name)):
-        candidates.append(build_dir / "firmware.bin")
-
-    return candidates
-
-
-def infer_role(offset: int, path: Path) -> str:
-    name = path.name.lower()
-    if offset in (0x0, 0x1000, 0x2000) or "bootloader" in name:
-        return "bootloader"
-    if offset == 0x8000 or "partition" in name or name == "partitions.bin":
-        return "partition-table"
-    if offset in (0xE000, 0xF000) or "ota_data" in name:
-        return "otadata"
-    if offset >= 0x10000 and has_esp_image_magic(path):
-        return "app"
-    return ""
-
-
-def has_esp_image_magic(path: Path) -> bool:
-    try:
-        with path.open("rb") as handle:
-            return handle.read(1) == bytes([ESP_IMAGE_MAGIC])
-    except OSError:
-        return False
+@dataclass(frozen=True)
+class Partition:
+    label: str
+    type: int
+    subtype: int
+    offset: int
+    size: int
+    flags: int
 
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
 
-def is_app_image_name(name: str) -> bool:
-    normalized = name.lower()
-    return normalized == "firmware.bin" or normalized.startswith("openquatt_")
 
+@dataclass(frozen=True)
+class Segment:
+    load_address: int
+    offset: int
+    size: int
 
-def resolve_flash_file(raw_path: str, build_dir: Path, role: str, offset: int) -> Path:
-    path = Path(str(raw_path))
-    candidates = [path] if path.is_absolute() else [build_dir / path]
-    candidates.extend(fallback_candidates(str(raw_path), build_dir, role, offset))
 
-    resolved = first_existing(candidates)
-    if resolved is None:
-        tried = ", ".join(str(candidate) for candidate in candidates)
-        raise FactoryBinError(f"Flash file for {role or hex(offset)} not found. Tried: {tried}")
-    return resolved.resolve()
+@dataclass(frozen=True)
+class EspImage:
+    segments: tuple[Segment, ...]
+    size: int
+    chip_id: int
+    hash_appended: bool
 
 
 def collect_sections(build_dir: Path, flasher_args: dict) -> tuple[list[tuple[int, Path]], dict[str, int]]:
@@ -153,79 +137,316 @@ def collect_sections(build_dir: Path, flasher_args: dict) -> tuple[list[tuple[in
     return sorted(sections.items()), role_offsets
 
 
-def merge_sections(sections: list[tuple[int, Path]], output_path: Path) -> None:
-    image_size = max(offset + path.stat().st_size for offset, path in sections)
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-
-    with output_path.open("wb") as output:
-        output.truncate(image_size)
-        output.seek(0)
-        output.write(b"\xff" * image_size)
-        for offset, path in sections:
-            output.seek(offset)
-            output.write(path.read_bytes())
-
+def check_section_magic(image_name: str, role: str, offset: int, header: bytes) -> None:
+    expected = ROLE_MAGIC.get(role)
+    if expected is None:
+        return
+    found = header[:len(expected)]
+    if found != expected:
+        raise FactoryBinError(
+            f"{image_name} has no {ROLE_LABELS[role]} magic at {hex(offset)} "
+            f"(got {found.hex() or 'nothing'})"
+        )
 
-def read_bytes(path: Path, offset: int, size: int) -> bytes:
-    with path.open("rb") as handle:
-        handle.seek(offset)
-        data = handle.read(size)
-    if len(data) != size:
-        raise FactoryBinError(f"{path} is too short to read {size} byte(s) at {hex(offset)}")
-    return data
 
+def merge_sections(
+    sections: list[tuple[int, Path]],
+    output_path: Path,
+    role_offsets: dict[str, int],
+    cache: BuildDirCache | None = None,
+) -> None:
+    """Stream sections into a factory image, filling gaps with 0xFF and checking magics on the way.
 
-def validate_factory_bin(output_path: Path, role_offsets: dict[str, int]) -> None:
-    bootloader_offset = role_offsets["bootloader"]
-    app_offset = role_offsets["app"]
+    Memory use is bounded by COPY_CHUNK_SIZE whatever the flash size. The image is written to a
+    temporary file and only replaces `output_path` once `verify_factory_image` accepts it.
+    """
+    roles_by_offset = {offset: role for role, offset in role_offsets.items()}
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = output_path.with_name(f".{output_path.name}.tmp")
+    buffer = memoryview(bytearray(COPY_CHUNK_SIZE))
+    position = 0
 
-    bootloader_magic = read_bytes(output_path, bootloader_offset, 1)[0]
-    if bootloader_magic != ESP_IMAGE_MAGIC:
-        raise FactoryBinError(
-            f"{output_path.name} has no ESP bootloader magic at {hex(bootloader_offset)} "
-            f"(got 0x{bootloader_magic:02x})"
+    try:
+        with temp_path.open("wb") as output:
+            for offset, path in sections:
+                if offset < position:
+                    raise FactoryBinError(
+                        f"{path.name} at {hex(offset)} overlaps the previous section ending at {hex(position)}"
+                    )
+                while position < offset:
+                    position += output.write(FILL_CHUNK[:min(len(FILL_CHUNK), offset - position)])
+
+                role = roles_by_offset.get(offset, "")
+                with path.open("rb") as section:
+                    size = section.readinto(buffer)
+                    check_section_magic(output_path.name, role, offset, bytes(buffer[:size]))
+                    while size:
+                        output.write(buffer[:size])
+                        position += size
+                        size = section.readinto(buffer)
+        verify_factory_image(temp_path, sections, role_offsets, output_path.name, cache)
+        os.replace(temp_path, output_path)
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+
+def parse_partition_table(data: bytes, name: str = "partition table") -> list[Partition]:
+    """Parse an ESP-IDF partition table, checking its MD5 entry when present."""
+    partitions: list[Partition] = []
+    for offset in range(0, min(len(data), PARTITION_TABLE_MAX_SIZE) - PARTITION_ENTRY.size + 1, PARTITION_ENTRY.size):
+        entry = data[offset:offset + PARTITION_ENTRY.size]
+        if entry[:2] == PARTITION_MD5_MAGIC:
+            if entry[16:] != hashlib.md5(data[:offset]).digest():
+                raise FactoryBinError(f"{name} MD5 does not match its entries")
+            break
+        if entry == b"\xff" * PARTITION_ENTRY.size:
+            break
+        magic, kind, subtype, part_offset, size, label, flags = PARTITION_ENTRY.unpack(entry)
+        if magic != PARTITION_TABLE_MAGIC:
+            raise FactoryBinError(f"{name} entry {len(partitions)} has bad magic {magic.hex()}")
+        partitions.append(
+            Partition(
+                label=label.rstrip(b"\0").decode("utf-8", errors="replace"),
+                type=kind,
+                subtype=subtype,
+                offset=part_offset,
+                size=size,
+                flags=flags,
+            )
         )
-
-    app_magic = read_bytes(output_path, app_offset, 1)[0]
-    if app_magic != ESP_IMAGE_MAGIC:
-        raise FactoryBinError(
-            f"{output_path.name} has no ESP app magic at {hex(app_offset)} "
-            f"(got 0x{app_magic:02x})"
+    if not partitions:
+        raise FactoryBinError(f"{name} has no entries")
+
+    ordered = sorted(partitions, key=lambda partition: partition.offset)
+    for previous, current in zip(ordered, ordered[1:]):
+        if current.offset < previous.end:
+            raise FactoryBinError(f"{name}: partition {current.label} overlaps {previous.label}")
+    return partitions
+
+
+def _xor_bytes(data: bytes) -> int:
+    # Fold the chunk as one big integer; this stays in C instead of looping per byte.
+    value = int.from_bytes(data, "little")
+    width = len(data)
+    while width > 1:
+        half = (width + 1) // 2
+        value = (value & ((1 << (half * 8)) - 1)) ^ (value >> (half * 8))
+        width = half
+    return value
+
+
+class _ImageReader:
+    """Sequential reader over an image in a file that feeds every byte into a SHA-256."""
+
+    def __init__(self, handle: BinaryIO, start: int, limit: int, name: str) -> None:
+        self.handle = handle
+        self.start = start
+        self.limit = limit
+        self.name = name
+        self.position = start
+        self.digest = hashlib.sha256()
+        handle.seek(start)
+
+    def read(self, size: int) -> bytes:
+        if self.position + size > self.limit:
+            raise FactoryBinError(f"{self.name} runs past {hex(self.limit)}")
+        data = self.handle.read(size)
+        if len(data) != size:
+            raise FactoryBinError(f"{self.name} is truncated at {hex(self.position + len(data))}")
+        self.position += size
+        self.digest.update(data)
+        return data
+
+
+def verify_esp_image(handle: BinaryIO, offset: int, limit: int, name: str) -> EspImage:
+    """Walk an ESP image header and segment table, checking the checksum and any appended SHA-256."""
+    reader = _ImageReader(handle, offset, limit, name)
+    magic, segment_count, _, _, _ = ESP_IMAGE_HEADER.unpack(reader.read(ESP_IMAGE_HEADER.size))
+    if magic != ESP_IMAGE_MAGIC:
+        raise FactoryBinError(f"{name} has no ESP image magic at {hex(offset)} (got 0x{magic:02x})")
+    if not 0 < segment_count <= ESP_MAX_SEGMENTS:
+        raise FactoryBinError(f"{name} declares {segment_count} segments")
+    extended = ESP_EXTENDED_HEADER.unpack(reader.read(ESP_EXTENDED_HEADER.size))
+    chip_id, hash_appended = extended[2], extended[7]
+    if hash_appended not in (0, 1):
+        raise FactoryBinError(f"{name} has an invalid hash-appended flag {hash_appended}")
+
+    checksum = ESP_CHECKSUM_SEED
+    segments = []
+    for _ in range(segment_count):
+        load_address, length = ESP_SEGMENT_HEADER.unpack(reader.read(ESP_SEGMENT_HEADER.size))
+        if reader.position + length > limit:
+            raise FactoryBinError(f"{name} segment at {hex(load_address)} runs past {hex(limit)}")
+        segments.append(Segment(load_address=load_address, offset=reader.position, size=length))
+        remaining = length
+        while remaining:
+            chunk = reader.read(min(remaining, COPY_CHUNK_SIZE))
+            checksum ^= _xor_bytes(chunk)
+            remaining -= len(chunk)
+
+    # The checksum byte sits in the last byte of the next 16-byte boundary.
+    padding = 15 - (reader.position - offset) % 16
+    stored_checksum = reader.read(padding + 1)[-1]
+    if stored_checksum != checksum:
+        raise FactoryBinError(f"{name} checksum is 0x{stored_checksum:02x}, expected 0x{checksum:02x}")
+    if hash_appended:
+        expected = reader.digest.digest()
+        stored_hash = reader.read(32)
+        if stored_hash != expected:
+            raise FactoryBinError(f"{name} appended SHA-256 does not match the image")
+    return EspImage(
+        segments=tuple(segments),
+        size=reader.position - offset,
+        chip_id=chip_id,
+        hash_appended=bool(hash_appended),
+    )
+
+
+def _containing_partition(partitions: list[Partition], offset: int, end: int) -> Partition | None:
+    return next((partition for partition in partitions if partition.offset <= offset and end <= partition.end), None)
+
+
+def verify_factory_image(
+    image_path: Path,
+    sections: list[tuple[int, Path]],
+    role_offsets: dict[str, int],
+    name: str | None = None,
+    cache: BuildDirCache | None = None,
+) -> None:
+    """Verify a merged image: ESP image checksums and hashes, the partition table, and section placement.
+
+    Section sizes come from `cache` when given, so files stat'ed while resolving them are not stat'ed again.
+    """
+    name = name or image_path.name
+    image_size = image_path.stat().st_size
+    with image_path.open("rb") as handle:
+        bootloader_offset = role_offsets["bootloader"]
+        partition_offset = role_offsets.get("partition-table")
+        verify_esp_image(
+            handle,
+            bootloader_offset,
+            partition_offset if partition_offset is not None else image_size,
+            f"{name} bootloader",
         )
+        if partition_offset is None:
+            verify_esp_image(handle, role_offsets["app"], image_size, f"{name} app")
+            return
 
-    partition_offset = role_offsets.get("partition-table")
-    if partition_offset is not None:
-        partition_magic = read_bytes(output_path, partition_offset, 2)
-        if partition_magic != PARTITION_TABLE_MAGIC:
-            raise FactoryBinError(
-                f"{output_path.name} has no partition table magic at {hex(partition_offset)} "
-                f"(got {partition_magic.hex()})"
-            )
+        handle.seek(partition_offset)
+        partitions = parse_partition_table(handle.read(PARTITION_TABLE_MAX_SIZE), f"{name} partition table")
+        table_end = partition_offset + PARTITION_TABLE_MAX_SIZE
+        first_partition = min(partition.offset for partition in partitions)
+        if first_partition < table_end:
+            raise FactoryBinError(f"{name}: partition table at {hex(partition_offset)} overlaps the first partition")
+
+        roles_by_offset = {offset: role for role, offset in role_offsets.items()}
+        for offset, path in sections:
+            role = roles_by_offset.get(offset, "")
+            end = offset + (cache.size(path) if cache is not None else path.stat().st_size)
+            if role == "bootloader":
+                if end > partition_offset:
+                    raise FactoryBinError(f"{name}: bootloader ends at {hex(end)}, past the partition table")
+                continue
+            if role == "partition-table":
+                if end > table_end:
+                    raise FactoryBinError(
+                        f"{name}: partition table is larger than {hex(PARTITION_TABLE_MAX_SIZE)} bytes"
+                    )
+                continue
+            partition = _containing_partition(partitions, offset, end)
+            if partition is None:
+                raise FactoryBinError(f"{name}: {path.name} at {hex(offset)}-{hex(end)} is not inside any partition")
+            if role == "app":
+                if partition.type != PARTITION_TYPE_APP:
+                    raise FactoryBinError(f"{name}: app image is in non-app partition {partition.label}")
+                verify_esp_image(handle, offset, partition.end, f"{name} app")
+            elif role == "otadata" and (partition.type, partition.subtype) != (
+                PARTITION_TYPE_DATA,
+                PARTITION_SUBTYPE_OTA_DATA,
+            ):
+                raise FactoryBinError(f"{name}: otadata is in {partition.label}, which is not an OTA data partition")
 
 
 def repair_factory_bin(build_dir: Path, output_name: str = "firmware.factory.bin") -> Path:
     build_dir = build_dir.resolve()
+    cache = build_dir_cache(build_dir)
+    # The images may have been rebuilt since the last repair; resolved paths and parsed args stay valid.
+    cache.forget_stats()
     flasher_args = load_flasher_args(build_dir)
     sections, role_offsets = collect_sections(build_dir, flasher_args)
     output_path = build_dir / output_name
-    merge_sections(sections, output_path)
-    validate_factory_bin(output_path, role_offsets)
+    merge_sections(sections, output_path, role_offsets, cache)
     return output_path
 
 
+def repair_result(build_dir: Path, output_name: str = "firmware.factory.bin") -> dict[str, object]:
+    """Repair one build directory and describe the outcome instead of raising."""
+    started_at = time.monotonic()
+    result: dict[str, object] = {"build_dir": str(build_dir)}
+    try:
+        output_path = repair_factory_bin(build_dir, output_name)
+    except (FactoryBinError, OSError) as exc:
+        result.update(ok=False, error=str(exc))
+    else:
+        result.update(ok=True, output=str(output_path), size=output_path.stat().st_size)
+    result["seconds"] = round(time.monotonic() - started_at, 3)
+    return result
+
+
+def repair_many(
+    build_dirs: list[Path],
+    output_name: str = "firmware.factory.bin",
+    jobs: int = 0,
+) -> list[dict[str, object]]:
+    """Repair several build directories in a process pool, keeping the input order."""
+    if len(build_dirs) <= 1 or jobs == 1:
+        return [repair_result(build_dir, output_name) for build_dir in build_dirs]
+    workers = min(len(build_dirs), jobs or os.cpu_count() or 1)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(repair_result, build_dirs, [output_name] * len(build_dirs)))
+
+
+def target_build_dirs(status: str) -> list[Path]:
+    from build_targets import REPO_ROOT, filter_targets, load_targets
+
+    return [
+        REPO_ROOT / target["build_path"] / ".pioenvs" / "openquatt"
+        for target in filter_targets(load_targets(), status)
+    ]
+
+
 def main() -> int:
-    parser = argparse.ArgumentParser(description="Repair and validate an ESPHome ESP-IDF factory binary.")
-    parser.add_argument("build_dir", help="Path to the .pioenvs/openquatt build directory.")
+    parser = argparse.ArgumentParser(description="Repair and validate ESPHome ESP-IDF factory binaries.")
+    parser.add_argument("build_dirs", nargs="*", help="One or more .pioenvs/openquatt build directories.")
     parser.add_argument("--output-name", default="firmware.factory.bin", help="Factory binary filename to write.")
+    parser.add_argument(
+        "--targets",
+        choices=("enabled", "planned", "all"),
+        help="Also repair the build_path of every build_targets.yaml target with this status.",
+    )
+    parser.add_argument("--jobs", type=int, default=0, help="Parallel repairs; defaults to the CPU count.")
+    parser.add_argument("--json", action="store_true", help="Print a JSON summary instead of one line per image.")
     args = parser.parse_args()
 
-    try:
-        output_path = repair_factory_bin(Path(args.build_dir), args.output_name)
-    except FactoryBinError as exc:
-        raise SystemExit(str(exc)) from exc
-
-    print(f"[ok] repaired factory binary: {output_path}")
-    return 0
+    build_dirs = [Path(item) for item in args.build_dirs]
+    if args.targets:
+        build_dirs.extend(target_build_dirs(args.targets))
+    if not build_dirs:
+        parser.error("pass at least one build_dir or --targets")
+
+    results = repair_many(build_dirs, args.output_name, args.jobs)
+    failures = [result for result in results if not result["ok"]]
+    if args.json:
+        print(json.dumps({"ok": not failures, "results": results}, indent=2))
+    elif len(results) == 1 and failures:
+        raise SystemExit(str(failures[0]["error"]))
+    else:
+        for result in results:
+            if result["ok"]:
+                print(f"[ok] repaired factory binary: {result['output']}")
+            else:
+                print(f"[FAIL] {result['build_dir']}: {result['error']}", file=sys.stderr)
+    return 1 if failures else 0
 
 
 def _register_platformio_action() -> None:
@@ -238,7 +459,7 @@ def _register_platformio_action() -> None:
         build_dir = Path(env.subst("$BUILD_DIR"))
         try:
             output_path = repair_factory_bin(build_dir)
-        except FactoryBinError as exc:
+        except (FactoryBinError, OSError) as exc:
             print(f"Error repairing factory binary: {exc}")
             env.Exit(1)
             return